@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+
+# Collects everything needed to debug a failed run into one tar.gz: cluster and hosts json, cluster files,
+# libvirt domains xmls and qemu logs, dhcp leases, assisted-installer pods logs and test_infra.log.
+# Artifacts are fetched concurrently into files, which are streamed into the tarball as soon as each one is ready,
+# artifacts that don't fit into max_size (uncompressed) are skipped by their size on disk, before they are read.
+# Collection runs automatically on every wait timeout for the targets registered with add_target
+
+import os
+import json
+import time
+import uuid
+import tarfile
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from xml.etree import ElementTree
+import consts
+import utils
+import polling
+from logger import log, LOG_FILE
+
+CLUSTER_FILES = ["kubeconfig-noingress", "install-config.yaml", "metadata.json"]
+QEMU_LOG = "/var/log/libvirt/qemu/%s.log"
+PODS_NAMESPACE = "assisted-installer"
+MAX_WORKERS = 10
+
+
+class Target(object):
+
+    def __init__(self, name, client=None, cluster_id=None, network_name=None):
+        self.name = name
+        self.client = client
+        self.cluster_id = cluster_id
+        self.network_name = network_name
+
+
+class ArtifactsCollector(object):
+
+    def __init__(self, output_folder=consts.ARTIFACTS_FOLDER, max_size=consts.ARTIFACTS_MAX_SIZE,
+                 max_workers=MAX_WORKERS):
+        self.output_folder = output_folder
+        self.max_size = max_size
+        self.max_workers = max_workers
+
+    @staticmethod
+    def _json(data):
+        return json.dumps(data, indent=2, default=str).encode()
+
+    # Unique path in scratch folder, artifacts of different targets have the same base names
+    @staticmethod
+    def _scratch_path(folder, name):
+        return os.path.join(folder, "%s-%s" % (uuid.uuid4().hex, os.path.basename(name)))
+
+    def _write(self, folder, name, data):
+        path = self._scratch_path(folder, name)
+        with open(path, "wb") as _file:
+            _file.write(data)
+        return path
+
+    def _cluster(self, target, folder):
+        return self._write(folder, "cluster.json", self._json(target.client.cluster_get(target.cluster_id).to_dict()))
+
+    def _hosts(self, target, folder):
+        return self._write(folder, "hosts.json", self._json(target.client.get_cluster_hosts(target.cluster_id)))
+
+    def _cluster_file(self, target, file_name, folder):
+        path = self._scratch_path(folder, file_name)
+        target.client.download_and_save_file(cluster_id=target.cluster_id, file_name=file_name, file_path=path)
+        return path
+
+    def _leases(self, target, folder):
+        return self._write(folder, "leases.json", self._json(utils.get_network_leases(target.network_name)))
+
+    @staticmethod
+    def _pods():
+        pods = utils.run_command("kubectl -n %s get pods -o name" % PODS_NAMESPACE)
+        return [pod for pod in pods.splitlines() if pod]
+
+    def _pod_logs(self, pod, folder):
+        path = self._scratch_path(folder, "%s.log" % pod)
+        with open(path, "wb") as _file:
+            subprocess.run(["kubectl", "-n", PODS_NAMESPACE, "logs", pod, "--all-containers"], stdout=_file,
+                           check=True)
+        return path
+
+    @staticmethod
+    def _network_domains(network_name):
+        domains = []
+        for domain in utils.get_libvirt_connection().listAllDomains():
+            root = ElementTree.fromstring(domain.XMLDesc())
+            if any(source.get("network") == network_name for source in root.findall("devices/interface/source")):
+                domains.append(domain)
+        return domains
+
+    # Every source is (name in tarball, func(scratch folder) returning path of the artifact file). Files that are
+    # already on disk are not copied, their func returns their own path
+    def _sources(self, targets):
+        sources = [(LOG_FILE, lambda folder: LOG_FILE)]
+        try:
+            sources += [("pods/%s.log" % pod.split("/")[-1], lambda folder, pod=pod: self._pod_logs(pod, folder))
+                        for pod in self._pods()]
+        except Exception as exc:
+            log.warning("Failed to list %s pods: %s", PODS_NAMESPACE, exc)
+
+        for target in targets:
+            if target.client and target.cluster_id:
+                sources += [("%s/cluster.json" % target.name,
+                             lambda folder, target=target: self._cluster(target, folder)),
+                            ("%s/hosts.json" % target.name, lambda folder, target=target: self._hosts(target, folder))]
+                sources += [("%s/files/%s" % (target.name, file_name),
+                             lambda folder, target=target, file_name=file_name:
+                             self._cluster_file(target, file_name, folder))
+                            for file_name in CLUSTER_FILES]
+            if target.network_name:
+                sources.append(("%s/leases.json" % target.name,
+                                lambda folder, target=target: self._leases(target, folder)))
+                try:
+                    domains = self._network_domains(target.network_name)
+                except Exception as exc:
+                    log.warning("Failed to list domains of network %s: %s", target.network_name, exc)
+                    domains = []
+                for domain in domains:
+                    sources += [("%s/domains/%s.xml" % (target.name, domain.name()),
+                                 lambda folder, domain=domain:
+                                 self._write(folder, "%s.xml" % domain.name(), domain.XMLDesc().encode())),
+                                ("%s/domains/%s.log" % (target.name, domain.name()),
+                                 lambda folder, domain=domain: QEMU_LOG % domain.name())]
+        return sources
+
+    @staticmethod
+    def _fetch(name, func, folder):
+        try:
+            return func(folder)
+        except Exception as exc:
+            log.warning("Failed to collect %s: %s", name, exc)
+            return None
+
+    def collect(self, targets, reason=""):
+        os.makedirs(self.output_folder, exist_ok=True)
+        path = os.path.join(self.output_folder, "artifacts-%s-%s.tar.gz" % (time.strftime("%Y%m%d-%H%M%S"),
+                                                                                 str(uuid.uuid4())[:8]))
+        log.info("Collecting artifacts of %s to %s", [target.name for target in targets], path)
+        started_at = time.time()
+        size = 0
+        skipped = []
+        with tempfile.TemporaryDirectory() as folder, tarfile.open(path, "w:gz") as tar, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._fetch, name, func, folder): name for name, func in self._sources(targets)}
+            for future in as_completed(futures):
+                name = futures.pop(future)
+                file_path = future.result()
+                if file_path is None:
+                    continue
+                try:
+                    file_size = os.stat(file_path).st_size
+                    if size + file_size > self.max_size:
+                        skipped.append(name)
+                        continue
+                    # Files that keep growing, like the log, are added up to their size at stat
+                    info = tar.gettarinfo(file_path, arcname=name)
+                    info.size = file_size
+                    with open(file_path, "rb") as _file:
+                        tar.addfile(info, _file)
+                    size += file_size
+                except OSError as exc:
+                    log.warning("Failed to collect %s: %s", name, exc)
+                finally:
+                    if os.path.dirname(file_path) == folder:
+                        os.remove(file_path)
+            summary_path = self._write(folder, "summary.json",
+                                       self._json({"reason": reason, "skipped_by_size": skipped}))
+            tar.add(summary_path, arcname="summary.json")
+        if skipped:
+            log.warning("Artifacts %s were skipped, they don't fit into %s bytes", skipped, self.max_size)
+        log.info("Collected %s bytes of artifacts to %s in %.1f seconds", size, path, time.time() - started_at)
+        return path
+
+
+_targets = {}
+_targets_lock = threading.Lock()
+
+
+def add_target(name, client=None, cluster_id=None, network_name=None):
+    with _targets_lock:
+        _targets[name] = Target(name, client, cluster_id, network_name)
+
+
+def collect_on_timeout(waiting_for):
+    with _targets_lock:
+        targets = list(_targets.values())
+    ArtifactsCollector().collect(targets, reason="Timeout while waiting for %s" % waiting_for)
+
+
+polling.add_timeout_hook(collect_on_timeout)
+
+
+def main():
+    tfvars = utils.get_tfvars(args.tf_folder)
+    client = None
+    if tfvars.get("cluster_inventory_id"):
+        import bm_inventory_api
+        client = bm_inventory_api.create_client(args.inventory_url, wait_for_url=False)
+    target = Target(tfvars["cluster_name"], client, tfvars.get("cluster_inventory_id"),
+                    tfvars["libvirt_network_name"])
+    ArtifactsCollector(max_size=args.max_size).collect([target], reason="Collected by hand")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Collect artifacts of the last deployed cluster')
+    parser.add_argument('-iU', '--inventory-url', help="Full url of remote inventory", type=str, default="")
+    parser.add_argument('-tf', '--tf-folder', help="Terraform folder of the cluster", type=str,
+                        default=consts.TF_FOLDER)
+    parser.add_argument('-s', '--max-size', help="Max size of collected artifacts in bytes", type=int,
+                        default=consts.ARTIFACTS_MAX_SIZE)
+    args = parser.parse_args()
+    main()
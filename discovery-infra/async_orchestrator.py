@@ -0,0 +1,174 @@
+# Asyncio based hosts registration. Every host has its own state machine that advances as soon as
+# the host changes (role is set right after it registers), while all hosts of a cluster share a single
+# hosts poll loop. All clusters of the process share one event loop running in a background thread,
+# so parallel cluster flows can submit their coroutines to it with run()
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from waiting.exceptions import TimeoutExpired
+import consts
+import utils
+import polling
+import run_report
+import role_assignment
+from logger import log
+
+EXECUTOR_WORKERS = 20
+
+_loop = None
+_loop_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+
+
+def get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="asyncio-loop", daemon=True).start()
+        return _loop
+
+
+# Runs coroutine on the shared loop and blocks the calling thread till it is done
+def run(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop()).result()
+
+
+async def run_blocking(func, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+# Async facade of InventoryClient, every method runs the generated client call in executor
+class AsyncInventoryClient(object):
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def _call(*args, **kwargs):
+            return await run_blocking(method, *args, **kwargs)
+        return _call
+
+
+# Polls cluster hosts and wakes everyone waiting for hosts changes. Interval backs off from
+# min_interval to max_interval while hosts don't change
+class ClusterHostsTracker(object):
+
+    def __init__(self, client, cluster_id, min_interval=1, max_interval=10):
+        self.client = client
+        self.cluster_id = cluster_id
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.snapshot = None
+        self._changed = asyncio.Condition()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._poll())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _poll(self):
+        interval = self.min_interval
+        fingerprint = None
+        while True:
+            try:
+                snapshot = await self.client.get_hosts_snapshot(self.cluster_id)
+            except Exception as exc:
+                log.warning("Failed to get hosts of cluster %s: %s", self.cluster_id, exc)
+            else:
+                current = [(host["id"], host["status"]) for host in snapshot.hosts]
+                if current != fingerprint:
+                    fingerprint, interval = current, self.min_interval
+                    run_report.report.record_hosts_statuses(snapshot.hosts)
+                else:
+                    interval = min(interval * 2, self.max_interval)
+                async with self._changed:
+                    self.snapshot = snapshot
+                    self._changed.notify_all()
+            await asyncio.sleep(interval)
+
+    # Waits till condition(snapshot) returns something not None and returns it
+    async def wait_for(self, condition, timeout, waiting_for):
+        async def _wait():
+            async with self._changed:
+                while True:
+                    result = condition(self.snapshot) if self.snapshot else None
+                    if result is not None:
+                        return result
+                    await self._changed.wait()
+        try:
+            return await asyncio.wait_for(_wait(), timeout)
+        except asyncio.TimeoutError:
+            await run_blocking(polling.run_timeout_hooks, waiting_for)
+            raise TimeoutExpired(timeout, waiting_for)
+
+    # If with_hardware is set, waits also till host reports its hardware and returns (host, hardware)
+    async def wait_for_host(self, mac, statuses, timeout, with_hardware=False):
+        def _condition(snapshot):
+            host = snapshot.get_host_by_mac(mac)
+            if host and host["status"] == consts.NodesStatus.ERROR:
+                raise Exception("Host %s with mac %s is in error status: %s" % (host["id"], mac,
+                                                                               host["status_info"]))
+            if not host or (statuses is not None and host["status"] not in statuses):
+                return None
+            if not with_hardware:
+                return host
+            hardware = snapshot.hardware_by_host_id.get(host["id"])
+            return (host, hardware) if hardware else None
+
+        return await self.wait_for(_condition, timeout, "Host %s to be in one of %s" % (mac, statuses))
+
+
+async def host_flow(tracker, client, cluster_id, mac, name, assigner, timeout=consts.NODES_REGISTERED_TIMEOUT):
+    if assigner.needs_hardware:
+        host, hardware = await tracker.wait_for_host(mac, None, timeout, with_hardware=True)
+    else:
+        host, hardware = await tracker.wait_for_host(mac, None, timeout), None
+    role = assigner.assign(name, hardware)
+    log.info("Host %s with mac %s registered, setting role %s", host["id"], mac, role, extra={"host_id": host["id"]})
+    await client.set_hosts_roles(cluster_id=cluster_id, hosts_with_roles=[{"id": host["id"], "role": role}])
+    host = await tracker.wait_for_host(mac, [consts.NodesStatus.KNOWN], timeout)
+    log.info("Host %s with mac %s is known", host["id"], mac, extra={"host_id": host["id"]})
+    return host
+
+
+# VIPs can be set once first host reports its inventory and is in insufficient status
+async def vips_flow(tracker, set_vips_func, timeout=consts.NODES_REGISTERED_TIMEOUT):
+    await tracker.wait_for(lambda snapshot: any(host["status"] == consts.NodesStatus.INSUFFICIENT
+                                                for host in snapshot.hosts) or None,
+                           timeout, "First host to be in insufficient status")
+    await run_blocking(set_vips_func)
+
+
+# Tracks all libvirt nodes of the network, every node gets its role by policies as soon as it registers.
+# set_vips_func is called once the first host is insufficient, if given
+async def register_hosts(inventory_client, cluster_id, network_name, set_vips_func=None,
+                         policies=role_assignment.DEFAULT_POLICIES):
+    client = AsyncInventoryClient(inventory_client)
+    nodes = await run_blocking(utils.get_libvirt_nodes_mac_role_ip_and_name, network_name)
+    assigner = role_assignment.RoleAssigner(policies)
+    tracker = ClusterHostsTracker(client, cluster_id)
+    tracker.start()
+    try:
+        flows = [host_flow(tracker, client, cluster_id, mac, metadata["name"], assigner)
+                 for mac, metadata in nodes.items()]
+        if set_vips_func:
+            flows.append(vips_flow(tracker, set_vips_func))
+        gathered = asyncio.gather(*flows)
+        try:
+            await gathered
+        except:
+            gathered.cancel()
+            raise
+    finally:
+        await tracker.stop()
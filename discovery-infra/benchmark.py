@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+
+# Offline benchmark of wait and registration loops. Runs utils/start_discovery waits against
+# fake_inventory server (in a separate process, so its cpu is not counted) and fake_libvirt,
+# and reports wall time, cpu time and api calls of every phase for each hosts count
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.request
+import fake_libvirt
+
+# Must be set before importing modules that use libvirt
+sys.modules["libvirt"] = fake_libvirt
+
+import consts
+import utils
+import polling
+import bm_inventory_api
+import start_discovery
+from logger import log
+
+DEFAULT_HOSTS_COUNTS = [3, 30, 300]
+PHASES = ["dhcp", "registration", "roles", "install"]
+
+
+class FakeInventoryProcess(object):
+
+    def __init__(self, port, known_delay, install_delay):
+        self.url = "http://127.0.0.1:%s" % port
+        self._cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_inventory.py"),
+                     "-p", str(port), "-kd", str(known_delay), "-id", str(install_delay)]
+        self._process = None
+
+    def __enter__(self):
+        self._process = subprocess.Popen(self._cmd)
+        polling.wait(lambda: self.stats() is not None, timeout_seconds=30, waiting_for="Fake inventory",
+                     max_interval=1, expected_exceptions=Exception)
+        return self
+
+    def __exit__(self, *_):
+        self._process.terminate()
+        self._process.wait()
+
+    def _call(self, method, path, data=None):
+        request = urllib.request.Request(self.url + path, method=method,
+                                         data=json.dumps(data).encode() if data is not None else None,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def stats(self):
+        return self._call("GET", "/fake/stats")["requests"]
+
+    def add_hosts(self, cluster_id, hosts):
+        self._call("POST", "/fake/clusters/%s/hosts" % cluster_id, hosts)
+
+
+class Measurement(object):
+
+    def __init__(self, inventory):
+        self._inventory = inventory
+        self.results = {}
+
+    def measure(self, phase, func):
+        requests_before = self._inventory.stats()
+        wall, cpu = time.time(), time.process_time()
+        func()
+        wall, cpu = time.time() - wall, time.process_time() - cpu
+        requests_after = self._inventory.stats()
+        api_calls = sum(requests_after.values()) - sum(requests_before.values())
+        self.results[phase] = {"wall": wall, "cpu": cpu, "api_calls": api_calls}
+        log.info("Phase %s took %.2f seconds, %.2f cpu seconds and %s api calls", phase, wall, cpu, api_calls)
+
+
+def _schedule_nodes(inventory, network, cluster_id, hosts_count, lease_spread, register_delay):
+    nodes = []
+    for index in range(hosts_count):
+        role = consts.NodeRoles.MASTER if index < consts.NUMBER_OF_MASTERS else consts.NodeRoles.WORKER
+        mac = "52:54:00:%02x:%02x:%02x" % (index >> 16 & 0xff, index >> 8 & 0xff, index & 0xff)
+        hostname = "bench-%s-%s" % (role, index)
+        delay = lease_spread * index / hosts_count
+        network.add_lease(mac=mac, ipaddr="10.%s.%s.%s" % (index >> 16 & 0xff, index >> 8 & 0xff, index & 0xff),
+                          hostname=hostname, delay=delay)
+        nodes.append({"mac": mac, "hostname": hostname, "delay": delay + register_delay})
+    inventory.add_hosts(cluster_id, nodes)
+    return [node["mac"] for node in nodes]
+
+
+def run_scenario(inventory, hosts_count, lease_spread, register_delay, install_timeout):
+    network_name = "bench-net-%s" % hosts_count
+    network = fake_libvirt.define_network(network_name, "benchbr%s" % hosts_count, "10.0.0.0/8")
+    client = bm_inventory_api.InventoryClient(inventory.url)
+    cluster = client.create_cluster("bench-%s" % hosts_count, openshift_version="4.5", base_dns_domain="redhat.com")
+    macs = _schedule_nodes(inventory, network, cluster.id, hosts_count, lease_spread, register_delay)
+
+    measurement = Measurement(inventory)
+    measurement.measure("dhcp", lambda: utils.wait_till_nodes_are_ready(hosts_count, network_name))
+    measurement.measure("registration", lambda: polling.wait(
+        lambda: utils.are_all_libvirt_nodes_in_cluster_hosts(client, cluster.id, network_name),
+        timeout_seconds=consts.NODES_REGISTERED_TIMEOUT, max_interval=10,
+        waiting_for="Nodes to be registered in inventory service"))
+
+    def _roles():
+        start_discovery.set_hosts_roles(client, cluster.id, network_name)
+        utils.wait_till_hosts_with_macs_are_in_status(client=client, cluster_id=cluster.id, macs=macs,
+                                                      statuses=[consts.NodesStatus.KNOWN])
+    measurement.measure("roles", _roles)
+
+    def _install():
+        client.install_cluster(cluster.id)
+        utils.wait_till_all_hosts_are_in_status(client=client, cluster_id=cluster.id, nodes_count=hosts_count,
+                                                statuses=[consts.NodesStatus.INSTALLED], timeout=install_timeout,
+                                                interval=60)
+    measurement.measure("install", _install)
+    return measurement.results
+
+
+def _log_results(results):
+    rows = ["%-8s %-14s %10s %10s %10s" % ("hosts", "phase", "wall", "cpu", "api calls")]
+    for hosts_count, phases in results.items():
+        for phase in PHASES:
+            rows.append("%-8s %-14s %10.2f %10.2f %10s" % (hosts_count, phase, phases[phase]["wall"],
+                                                           phases[phase]["cpu"], phases[phase]["api_calls"]))
+    log.info("Benchmark results:\n%s", "\n".join(rows))
+
+
+def main():
+    results = {}
+    with FakeInventoryProcess(args.port, args.known_delay, args.install_delay) as inventory:
+        for hosts_count in args.hosts:
+            log.info("Running benchmark with %s hosts", hosts_count)
+            results[hosts_count] = run_scenario(inventory, hosts_count, args.lease_spread, args.register_delay,
+                                                args.install_timeout)
+    _log_results(results)
+    if args.output:
+        with open(args.output, "w") as _file:
+            json.dump(results, _file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark wait loops against fake inventory and libvirt')
+    parser.add_argument('-H', '--hosts', help='Hosts counts to run with', type=int, nargs="*",
+                        default=DEFAULT_HOSTS_COUNTS)
+    parser.add_argument('-p', '--port', help='Port for fake inventory', type=int, default=8090)
+    parser.add_argument('-ls', '--lease-spread', help='Seconds over which hosts get their leases',
+                        type=float, default=5)
+    parser.add_argument('-rd', '--register-delay', help='Seconds from lease till host registration',
+                        type=float, default=2)
+    parser.add_argument('-kd', '--known-delay', help='Seconds from setting role till host is known',
+                        type=float, default=2)
+    parser.add_argument('-id', '--install-delay', help='Seconds from install command till hosts are installed',
+                        type=float, default=10)
+    parser.add_argument('-it', '--install-timeout', help='Timeout of install wait', type=int, default=600)
+    parser.add_argument('-o', '--output', help='Path to save json results to', type=str, default="")
+    args = parser.parse_args()
+    main()
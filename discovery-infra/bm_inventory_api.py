@@ -1,36 +1,205 @@
-import waiting
+import os
 import json
-from tqdm import tqdm
+import time
+import hashlib
+import threading
 import utils
 import consts
-from bm_inventory_client import ApiClient, Configuration, api, models
+import polling
+import downloader
+import cluster_files
+import run_report
 from logger import log
 
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+# Cpus and memory of host from its hardware_info, None if host didn't report its hardware yet
+def _host_hardware(hw):
+    if not hw.get("cpu") or not hw.get("memory"):
+        return None
+    memory = next((memory["total"] for memory in hw["memory"] if memory.get("name") == "Mem"), 0)
+    return {"cpus": hw["cpu"].get("cpus", 0), "memory_gib": memory / 1024 ** 3}
+
+
+# Point in time view of cluster hosts, hardware_info is parsed once per host and
+# hosts are indexed by their lowercase nic macs
+class HostsSnapshot(object):
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.macs_by_host_id = {}
+        self.hardware_by_host_id = {}
+        self._hosts_by_mac = {}
+        for host in hosts:
+            hw = json.loads(host.get("hardware_info") or '{"nics":[]}')
+            macs = [nic["mac"].lower() for nic in hw.get("nics", [])]
+            self.macs_by_host_id[host["id"]] = macs
+            self.hardware_by_host_id[host["id"]] = _host_hardware(hw)
+            for mac in macs:
+                self._hosts_by_mac[mac] = host
+
+    def get_host_by_mac(self, mac):
+        return self._hosts_by_mac.get(mac.lower())
+
+    def get_hosts_by_macs(self, macs):
+        return [self.get_host_by_mac(mac) for mac in macs]
+
+    def has_mac(self, mac):
+        return mac.lower() in self._hosts_by_mac
+
+
+# Downloaded images keyed by cluster id and image create params. Every entry has
+# json metadata with its size and checksum. Images are hashed while they are copied in and out of the cache,
+# so checking an entry doesn't read it again. Least recently used entries are evicted when cache size is
+# above max_size
+class IsoCache(object):
+
+    def __init__(self, cache_folder=consts.ISO_CACHE_FOLDER, max_size=consts.ISO_CACHE_MAX_SIZE):
+        self.cache_folder = cache_folder
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(cluster_id, ssh_key, proxy_url=None):
+        return hashlib.sha256(json.dumps([cluster_id, ssh_key or "", proxy_url or ""]).encode()).hexdigest()
+
+    def _iso_path(self, key):
+        return os.path.join(self.cache_folder, "%s.iso" % key)
+
+    def _metadata_path(self, key):
+        return os.path.join(self.cache_folder, "%s.json" % key)
+
+    def _read_metadata(self, key):
+        try:
+            with open(self._metadata_path(key)) as _file:
+                return json.load(_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_metadata(self, key, metadata):
+        with open(self._metadata_path(key), "w") as _file:
+            json.dump(metadata, _file)
+
+    def _remove(self, key):
+        for path in [self._iso_path(key), self._metadata_path(key)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Copied, not linked, image_path is written in place by the ranged downloader and booted by vms.
+    # Destination is replaced atomically, so a vm using the previous file keeps it. Returns sha256 of the
+    # copy, destination is kept as is if it isn't sha256
+    @staticmethod
+    def _place(source, destination, sha256=None):
+        sha = hashlib.sha256()
+        tmp_path = "%s.tmp" % destination
+        try:
+            with open(source, "rb") as source_file, open(tmp_path, "wb") as tmp_file:
+                for chunk in iter(lambda: source_file.read(COPY_CHUNK_SIZE), b""):
+                    sha.update(chunk)
+                    tmp_file.write(chunk)
+            if sha256 and sha.hexdigest() != sha256:
+                os.remove(tmp_path)
+                return sha.hexdigest()
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, destination)
+        return sha.hexdigest()
+
+    # Puts cached image to image_path, returns False if there is no valid cached image
+    def get(self, key, image_path):
+        with self._lock:
+            metadata = self._read_metadata(key)
+            iso_path = self._iso_path(key)
+            if not metadata or not os.path.exists(iso_path):
+                return False
+            if os.path.getsize(iso_path) != metadata["size"] or \
+                    self._place(iso_path, image_path, metadata["sha256"]) != metadata["sha256"]:
+                log.warning("Cached image %s doesn't match its checksum, removing it", iso_path)
+                self._remove(key)
+                return False
+            metadata["last_used"] = time.time()
+            self._write_metadata(key, metadata)
+            return True
+
+    def put(self, key, image_path, **metadata):
+        with self._lock:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            iso_path = self._iso_path(key)
+            sha256 = self._place(image_path, iso_path)
+            metadata.update({"size": os.path.getsize(iso_path), "sha256": sha256, "last_used": time.time()})
+            self._write_metadata(key, metadata)
+            self._evict(keep=key)
+
+    def _evict(self, keep):
+        entries = []
+        for file_name in os.listdir(self.cache_folder):
+            if not file_name.endswith(".json"):
+                continue
+            key = file_name[:-len(".json")]
+            metadata = self._read_metadata(key)
+            if metadata:
+                entries.append((metadata["last_used"], metadata["size"], key))
+            else:
+                self._remove(key)
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            log.info("Evicting cached image %s", self._iso_path(key))
+            self._remove(key)
+            total_size -= size
+
+
+iso_cache = IsoCache()
+
 
 class InventoryClient(object):
 
-    def __init__(self, inventory_url):
+    # pool_params are passed to http_pool.create_pool_manager: pool_size, max_concurrent_requests,
+    # connect_timeout, read_timeout, retries and backoff_factor
+    def __init__(self, inventory_url, **pool_params):
+        # Generated client imports all its apis and models, it is imported only when client is created
+        from bm_inventory_client import ApiClient, Configuration, api
+        import http_pool
         self.inventory_url = inventory_url
         configs = Configuration()
         configs.host = self.inventory_url + "/api/assisted-install/v1"
         self.api = ApiClient(configuration=configs)
+        # Proxy manager of generated client keeps its proxy settings in connection_pool_kw too, they are
+        # set again by the new proxy manager
+        pool_manager = self.api.rest_client.pool_manager
+        connection_pool_kw = {name: value for name, value in pool_manager.connection_pool_kw.items()
+                              if not name.startswith("_proxy")}
+        self.api.rest_client.pool_manager = http_pool.create_pool_manager(
+            connection_pool_kw, proxy_url=configs.proxy, proxy_headers=getattr(configs, "proxy_headers", None),
+            **pool_params)
         self.client = api.InstallerApi(api_client=self.api)
+        self.files_fetcher = cluster_files.ClusterFilesFetcher(self.api.rest_client.pool_manager,
+                                                               base_url=configs.host,
+                                                               headers=self.api.default_headers)
 
     def wait_for_api_readiness(self):
         log.info("Waiting for inventory api to be ready")
-        waiting.wait(lambda: self.clusters_list() is not None,
+        polling.wait(lambda: self.clusters_list() is not None,
                      timeout_seconds=consts.WAIT_FOR_BM_API,
-                     sleep_seconds=5, waiting_for="Wait till inventory is ready",
+                     max_interval=5, waiting_for="Wait till inventory is ready",
                      expected_exceptions=Exception)
 
     def create_cluster(self, name, ssh_public_key=None, **cluster_params):
+        from bm_inventory_client import models
         cluster = models.ClusterCreateParams(name=name, ssh_public_key=ssh_public_key,  **cluster_params)
         log.info("Creating cluster with params %s", cluster.__dict__)
         result = self.client.register_cluster(new_cluster_params=cluster)
         return result
 
     def get_cluster_hosts(self, cluster_id):
-        log.info("Getting registered nodes for cluster %s", cluster_id)
+        log.debug("Getting registered nodes for cluster %s", cluster_id)
         return self.client.list_hosts(cluster_id=cluster_id)
 
     def get_hosts_in_statuses(self, cluster_id, statuses):
@@ -44,18 +213,27 @@ class InventoryClient(object):
         return self.client.list_clusters()
 
     def cluster_get(self, cluster_id):
-        log.info("Getting cluster with id %s", cluster_id)
+        log.debug("Getting cluster with id %s", cluster_id)
         return self.client.get_cluster(cluster_id=cluster_id)
 
     def _download(self, response, file_path):
+        from tqdm import tqdm
+        started_at = time.time()
+        size = 0
         progress = tqdm(iterable=response.read_chunked())
-        with open(file_path, 'wb') as f:
-            for chunk in progress:
-                f.write(chunk)
-        progress.close()
+        try:
+            with open(file_path, 'wb') as f:
+                for chunk in progress:
+                    f.write(chunk)
+                    size += len(chunk)
+        finally:
+            progress.close()
+            response.release_conn()
+        downloader.log_throughput(file_path, size, started_at)
 
     def generate_image(self, cluster_id, ssh_key, proxy_url=None):
         log.info("Generating image for cluster %s", cluster_id)
+        from bm_inventory_client import models
         image_create_params = models.ImageCreateParams(ssh_public_key=ssh_key)
         if proxy_url:
             image_create_params.proxy_url = proxy_url
@@ -64,16 +242,30 @@ class InventoryClient(object):
 
     def download_image(self, cluster_id, image_path):
         log.info("Downloading image for cluster %s to %s", cluster_id, image_path)
+        url = "%s/clusters/%s/downloads/image" % (self.api.configuration.host, cluster_id)
+        ranged_downloader = downloader.RangedDownloader(self.api.rest_client.pool_manager,
+                                                        headers=self.api.default_headers)
+        if ranged_downloader.download(url, image_path):
+            return
         response = self.client.download_cluster_iso(cluster_id=cluster_id,
                                                     _preload_content=False)
         self._download(response=response, file_path=image_path)
 
-    def generate_and_download_image(self, cluster_id, ssh_key, image_path, proxy_url=None):
-        self.generate_image(cluster_id=cluster_id, ssh_key=ssh_key, proxy_url=proxy_url)
-        self.download_image(cluster_id=cluster_id, image_path=image_path)
+    def generate_and_download_image(self, cluster_id, ssh_key, image_path, proxy_url=None, use_cache=True):
+        cache_key = IsoCache.key(cluster_id, ssh_key, proxy_url)
+        if use_cache and iso_cache.get(cache_key, image_path):
+            log.info("Using cached image for cluster %s", cluster_id)
+            return
+        with run_report.report.span("iso_generate", cluster_id=cluster_id):
+            self.generate_image(cluster_id=cluster_id, ssh_key=ssh_key, proxy_url=proxy_url)
+        with run_report.report.span("iso_download", cluster_id=cluster_id):
+            self.download_image(cluster_id=cluster_id, image_path=image_path)
+        if use_cache:
+            iso_cache.put(cache_key, image_path, cluster_id=cluster_id)
 
     def set_hosts_roles(self, cluster_id, hosts_with_roles):
         log.info("Setting roles for hosts %s in cluster %s", hosts_with_roles, cluster_id)
+        from bm_inventory_client import models
         hosts = models.ClusterUpdateParams(hosts_roles=hosts_with_roles)
         return self.client.update_cluster(cluster_id=cluster_id, cluster_update_params=hosts)
 
@@ -85,28 +277,24 @@ class InventoryClient(object):
         log.info("Deleting cluster %s", cluster_id)
         self.client.deregister_cluster(cluster_id=cluster_id)
 
+    # Single list_hosts call, use it instead of calling get_host_by_mac per mac
+    def get_hosts_snapshot(self, cluster_id):
+        return HostsSnapshot(self.get_cluster_hosts(cluster_id))
+
     def get_hosts_id_with_macs(self, cluster_id):
-        hosts = self.get_cluster_hosts(cluster_id)
-        hosts_data = {}
-        for host in hosts:
-            hw = json.loads(host.get("hardware_info", '{"nics":[]}'))
-            hosts_data[host["id"]] = [nic["mac"] for nic in hw["nics"]]
-        return hosts_data
+        return self.get_hosts_snapshot(cluster_id).macs_by_host_id
 
     def get_host_by_mac(self, cluster_id, mac):
-        hosts = self.get_cluster_hosts(cluster_id)
-
-        for host in hosts:
-            hw = json.loads(host.get("hardware_info", '{"nics":[]}'))
-            if mac.lower() in [nic["mac"].lower() for nic in hw["nics"]]:
-                return host
+        return self.get_hosts_snapshot(cluster_id).get_host_by_mac(mac)
 
     def download_and_save_file(self, cluster_id, file_name, file_path):
         log.info("Downloading %s to %s", file_name, file_path)
-        response = self.client.download_cluster_files(cluster_id=cluster_id, file_name=file_name,
-                                                      _preload_content=False)
-        with open(file_path, "wb") as _file:
-            _file.write(response.data)
+        self.files_fetcher.fetch_file(cluster_id=cluster_id, file_name=file_name, file_path=file_path)
+
+    # All cluster files are fetched in parallel into folder, returns {file name: path or exception}
+    def download_cluster_files(self, cluster_id, folder, file_names=cluster_files.CLUSTER_FILES):
+        log.info("Downloading %s to %s", file_names, folder)
+        return self.files_fetcher.fetch_files(cluster_id=cluster_id, folder=folder, file_names=file_names)
 
     def download_kubeconfig_no_ingress(self, cluster_id, kubeconfig_path):
         log.info("Downloading kubeconfig-noingress to %s", kubeconfig_path)
@@ -114,16 +302,19 @@ class InventoryClient(object):
 
     def download_kubeconfig(self, cluster_id, kubeconfig_path):
         log.info("Downloading kubeconfig to %s", kubeconfig_path)
-        response = self.client.download_cluster_kubeconfig(cluster_id=cluster_id, _preload_content=False)
-        with open(kubeconfig_path, "wb") as _file:
-            _file.write(response.data)
+        self.files_fetcher.fetch_kubeconfig(cluster_id=cluster_id, file_path=kubeconfig_path)
 
     def install_cluster(self, cluster_id):
         log.info("Installing cluster %s", cluster_id)
         return self.client.install_cluster(cluster_id=cluster_id)
 
 
-def create_client(inventory_url=None, wait_for_url=True):
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# Clients are shared per inventory url and pool params, so all flows in the process use the same connections pool
+def create_client(inventory_url=None, wait_for_url=True, **pool_params):
     if inventory_url:
         i_url = inventory_url
     elif wait_for_url:
@@ -131,7 +322,11 @@ def create_client(inventory_url=None, wait_for_url=True):
     else:
         i_url = utils.get_service_url("bm-inventory")
     log.info("Inventory URL %s", i_url)
-    client = InventoryClient(inventory_url=i_url)
+    with _clients_lock:
+        key = (i_url, tuple(sorted(pool_params.items())))
+        client = _clients.get(key)
+        if not client:
+            client = _clients[key] = InventoryClient(inventory_url=i_url, **pool_params)
     if wait_for_url:
         client.wait_for_api_readiness()
     return client
@@ -0,0 +1,109 @@
+# Checks that requested clusters fit the hypervisor before any vm is created. Nodes get at least
+# bm-inventory hardware validator minimums (HW_VALIDATOR_* of update_bm_inventory_cm.ENVS), requested memory
+# is downscaled towards these minimums if free memory is not enough, and the run is rejected if even the
+# minimums don't fit in memory, cpus or storage pool free space
+
+import os
+from collections import namedtuple
+from xml.etree import ElementTree
+import libvirt
+import utils
+from logger import log
+
+# Memory left for hypervisor itself, minikube and bm-inventory
+RESERVED_MEMORY_MIB = 8192
+# Total vcpus of all nodes above host cpus * CPU_OVERCOMMIT are only logged, vms can share cpus
+CPU_OVERCOMMIT = 4
+
+HostCapacity = namedtuple("HostCapacity", ["memory_mib", "cpus", "storage_bytes"])
+NodesResources = namedtuple("NodesResources", ["master_memory", "worker_memory", "master_vcpu", "worker_vcpu"])
+ValidatorMinimums = namedtuple("ValidatorMinimums", ["master_memory", "worker_memory", "master_vcpu", "worker_vcpu",
+                                                     "disk_bytes"])
+
+
+def get_validator_minimums():
+    # Imported here as it needs yaml, which is not needed for anything else
+    import update_bm_inventory_cm
+    envs = update_bm_inventory_cm.get_relevant_envs()
+    return ValidatorMinimums(master_memory=int(envs["HW_VALIDATOR_MIN_RAM_GIB_MASTER"]) * 1024,
+                             worker_memory=int(envs["HW_VALIDATOR_MIN_RAM_GIB_WORKER"]) * 1024,
+                             master_vcpu=int(envs["HW_VALIDATOR_MIN_CPU_CORES_MASTER"]),
+                             worker_vcpu=int(envs["HW_VALIDATOR_MIN_CPU_CORES_WORKER"]),
+                             disk_bytes=int(envs["HW_VALIDATOR_MIN_DISK_SIZE_GIB"]) * 1024 ** 3)
+
+
+# Free space of libvirt pool that contains storage_path, or of its file system if there is no such pool
+def _storage_free_bytes(conn, storage_path):
+    for pool in conn.listAllStoragePools():
+        path = ElementTree.fromstring(pool.XMLDesc()).findtext("target/path")
+        if path and os.path.commonpath([path, storage_path]) == path:
+            return pool.info()[3]
+    while not os.path.exists(storage_path):
+        storage_path = os.path.dirname(storage_path)
+    stat = os.statvfs(storage_path)
+    return stat.f_bavail * stat.f_frsize
+
+
+# Memory that can be given to vms is free memory with buffers and page cache, which kernel can reclaim
+def get_host_capacity(storage_path):
+    conn = utils.get_libvirt_connection()
+    memory = conn.getMemoryStats(libvirt.VIR_NODE_MEMORY_STATS_ALL_CELLS)
+    available_kib = memory["free"] + memory.get("buffers", 0) + memory.get("cached", 0)
+    return HostCapacity(memory_mib=available_kib // 1024, cpus=conn.getInfo()[2],
+                        storage_bytes=_storage_free_bytes(conn, storage_path))
+
+
+def _nodes_memory(clusters_count, masters_count, workers_count, master_memory, worker_memory):
+    return clusters_count * (masters_count * master_memory + workers_count * worker_memory)
+
+
+# Returns resources every node should get, raises if requested clusters can't fit the host.
+# With downscale, memory above validator minimums of all nodes is reduced by the same factor
+def plan(capacity, minimums, requested, clusters_count, masters_count, workers_count, downscale=True):
+    nodes_count = clusters_count * (masters_count + workers_count)
+    resources = requested._replace(master_vcpu=max(requested.master_vcpu, minimums.master_vcpu),
+                                   worker_vcpu=max(requested.worker_vcpu, minimums.worker_vcpu),
+                                   master_memory=max(requested.master_memory, minimums.master_memory),
+                                   worker_memory=max(requested.worker_memory, minimums.worker_memory))
+    problems = []
+
+    max_vcpu = max(resources.master_vcpu, resources.worker_vcpu if workers_count else 0)
+    if max_vcpu > capacity.cpus:
+        problems.append("nodes need %s vcpus, host has only %s cpus" % (max_vcpu, capacity.cpus))
+    total_vcpu = clusters_count * (masters_count * resources.master_vcpu + workers_count * resources.worker_vcpu)
+    if total_vcpu > capacity.cpus * CPU_OVERCOMMIT:
+        log.warning("%s vcpus of all nodes are more than %s times %s host cpus, nodes will be slow",
+                    total_vcpu, CPU_OVERCOMMIT, capacity.cpus)
+
+    available_memory = capacity.memory_mib - RESERVED_MEMORY_MIB
+    needed_memory = _nodes_memory(clusters_count, masters_count, workers_count, resources.master_memory,
+                                  resources.worker_memory)
+    minimal_memory = _nodes_memory(clusters_count, masters_count, workers_count, minimums.master_memory,
+                                   minimums.worker_memory)
+    if needed_memory > available_memory:
+        if not downscale or minimal_memory > available_memory:
+            problems.append("nodes need %s MiB of memory (%s MiB with validator minimums), only %s MiB "
+                            "is available" % (needed_memory, minimal_memory, available_memory))
+        else:
+            factor = (available_memory - minimal_memory) / (needed_memory - minimal_memory)
+            resources = resources._replace(
+                master_memory=minimums.master_memory + int((resources.master_memory - minimums.master_memory) * factor),
+                worker_memory=minimums.worker_memory + int((resources.worker_memory - minimums.worker_memory) * factor))
+            log.warning("Not enough memory for %s MiB, downscaled nodes memory to %s MiB for masters and "
+                        "%s MiB for workers", needed_memory, resources.master_memory, resources.worker_memory)
+
+    needed_storage = nodes_count * minimums.disk_bytes
+    if needed_storage > capacity.storage_bytes:
+        problems.append("nodes need %s GiB of storage, only %s GiB is free" % (needed_storage // 1024 ** 3,
+                                                                                 capacity.storage_bytes // 1024 ** 3))
+
+    if problems:
+        raise Exception("%s clusters with %s masters and %s workers don't fit the host: %s" %
+                        (clusters_count, masters_count, workers_count, ", ".join(problems)))
+    log.info("Capacity plan for %s nodes on host with %s: %s", nodes_count, capacity, resources)
+    return resources
+
+
+def plan_for_host(storage_path, requested, clusters_count, masters_count, workers_count, downscale=True):
+    return plan(get_host_capacity(storage_path), get_validator_minimums(), requested, clusters_count,
+                masters_count, workers_count, downscale)
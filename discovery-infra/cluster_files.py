@@ -0,0 +1,144 @@
+# Cluster files and kubeconfig fetched from inventory into a per cluster cache. Responses are streamed to
+# a temp file that is renamed into the cache, ETag of every cached file is sent back as If-None-Match, and
+# destination is replaced (atomically) only if its checksum differs from the cached one, so retries never
+# leave partial or rewritten files behind
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import consts
+import utils
+from logger import log
+
+CHUNK_SIZE = 64 * 1024
+MAX_WORKERS = 8
+# File names of downloads/files api
+CLUSTER_FILES = ["bootstrap.ign", "master.ign", "worker.ign", "metadata.json", "kubeadmin-password",
+                 "kubeconfig", "kubeconfig-noingress", "install-config.yaml"]
+# Cache name of downloads/kubeconfig, which is not one of the cluster files
+KUBECONFIG = "downloads-kubeconfig"
+
+
+class ClusterFilesFetcher(object):
+
+    def __init__(self, pool_manager, base_url, headers=None, cache_folder=consts.CLUSTER_FILES_CACHE_FOLDER):
+        self.pool_manager = pool_manager
+        self.base_url = base_url
+        self.headers = headers or {}
+        self.cache_folder = cache_folder
+        self._lock = threading.Lock()
+
+    def _cluster_folder(self, cluster_id):
+        return os.path.join(self.cache_folder, cluster_id)
+
+    # Not metadata.json, which is one of the cluster files
+    def _metadata_path(self, cluster_id):
+        return os.path.join(self._cluster_folder(cluster_id), ".cache.json")
+
+    def _read_metadata(self, cluster_id):
+        try:
+            with open(self._metadata_path(cluster_id)) as _file:
+                return json.load(_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _update_metadata(self, cluster_id, name, entry):
+        with self._lock:
+            metadata = self._read_metadata(cluster_id)
+            metadata[name] = entry
+            tmp_path = "%s.tmp" % self._metadata_path(cluster_id)
+            with open(tmp_path, "w") as _file:
+                json.dump(metadata, _file)
+            os.replace(tmp_path, self._metadata_path(cluster_id))
+
+    def _cached(self, cluster_id, name):
+        entry = self._read_metadata(cluster_id).get(name)
+        if entry and os.path.exists(os.path.join(self._cluster_folder(cluster_id), name)):
+            return entry
+        return None
+
+    # Streams response body to a temp file in cluster cache folder, returns its path and sha256
+    def _stream(self, response, folder):
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as _file:
+                for chunk in response.stream(CHUNK_SIZE):
+                    _file.write(chunk)
+                    sha.update(chunk)
+        except:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, sha.hexdigest()
+
+    # Copies cached file to file_path unless it already has the same content
+    @staticmethod
+    def _place(cached_path, sha256, file_path):
+        if os.path.exists(file_path) and utils.file_sha256(file_path) == sha256:
+            log.info("%s is unchanged", file_path)
+            return
+        folder = os.path.dirname(os.path.abspath(file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(cached_path, tmp_path)
+        os.replace(tmp_path, file_path)
+
+    # Fetches url into cache as name and places it to file_path. Cached file younger than max_age seconds
+    # is used without any request
+    def _fetch(self, cluster_id, name, url, file_path, max_age=0):
+        folder = self._cluster_folder(cluster_id)
+        os.makedirs(folder, exist_ok=True)
+        cached_path = os.path.join(folder, name)
+        cached = self._cached(cluster_id, name)
+        if cached and time.time() - cached["fetched_at"] < max_age:
+            self._place(cached_path, cached["sha256"], file_path)
+            return file_path
+
+        headers = dict(self.headers)
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        response = self.pool_manager.request("GET", url, headers=headers, preload_content=False)
+        try:
+            if response.status == 304 and cached:
+                log.info("%s of cluster %s is not modified", name, cluster_id)
+                entry = dict(cached, fetched_at=time.time())
+            elif response.status == 200:
+                tmp_path, sha256 = self._stream(response, folder)
+                os.replace(tmp_path, cached_path)
+                entry = {"etag": response.headers.get("ETag"), "sha256": sha256, "fetched_at": time.time()}
+            else:
+                raise Exception("Failed to download %s of cluster %s, status %s: %s" %
+                                (name, cluster_id, response.status, response.data[:200]))
+        finally:
+            response.release_conn()
+
+        self._update_metadata(cluster_id, name, entry)
+        self._place(cached_path, entry["sha256"], file_path)
+        return file_path
+
+    def fetch_file(self, cluster_id, file_name, file_path, max_age=0):
+        url = "%s/clusters/%s/downloads/files?file_name=%s" % (self.base_url, cluster_id, file_name)
+        return self._fetch(cluster_id, file_name, url, file_path, max_age)
+
+    def fetch_kubeconfig(self, cluster_id, file_path, max_age=0):
+        url = "%s/clusters/%s/downloads/kubeconfig" % (self.base_url, cluster_id)
+        return self._fetch(cluster_id, KUBECONFIG, url, file_path, max_age)
+
+    # Fetches files in parallel into folder, returns {file name: path or exception}
+    def fetch_files(self, cluster_id, folder, file_names=CLUSTER_FILES, max_age=0):
+        os.makedirs(folder, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {file_name: executor.submit(self.fetch_file, cluster_id, file_name,
+                                                  os.path.join(folder, file_name), max_age)
+                       for file_name in file_names}
+        results = {}
+        for file_name, future in futures.items():
+            results[file_name] = future.exception() or future.result()
+            if future.exception():
+                log.warning("Failed to fetch %s of cluster %s: %s", file_name, cluster_id, future.exception())
+        return results
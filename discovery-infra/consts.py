@@ -1,20 +1,35 @@
 import os
 
 TF_FOLDER = "build/terraform"
-TFVARS_JSON_FILE = os.path.join(TF_FOLDER, "terraform.tfvars.json")
+TFVARS_JSON_FILE_NAME = "terraform.tfvars.json"
+TFVARS_JSON_FILE = os.path.join(TF_FOLDER, TFVARS_JSON_FILE_NAME)
 IMAGE_FOLDER = "/tmp/images"
 IMAGE_PATH = "%s/installer-image.iso" % IMAGE_FOLDER
+ISO_CACHE_FOLDER = "/tmp/iso_cache"
+ISO_CACHE_MAX_SIZE = 10 * 1024 ** 3
+LIBVIRT_URI = "qemu:///system"
 STORAGE_PATH = "/var/lib/libvirt/openshift-images"
 SSH_KEY = "ssh_key/key.pub"
 NODES_REGISTERED_TIMEOUT = 180
 TF_TEMPLATE = "terraform_files"
-STARTING_IP_ADDRESS = "192.168.126.10"
 NUMBER_OF_MASTERS = 3
 TEST_INFRA = "test-infra"
 CLUSTER = "%s-cluster" % TEST_INFRA
 CLUSTER_PREFIX = "%s-" % CLUSTER
 TEST_NETWORK = "%s-net" % TEST_INFRA
 DEFAULT_CLUSTER_KUBECONFIG_PATH = "build/kubeconfig"
+RUN_REPORT_PATH = "build/run_report.json"
+RUN_STATE_PATH = "build/run_state.json"
+ARTIFACTS_FOLDER = "build/artifacts"
+ARTIFACTS_MAX_SIZE = 200 * 1024 ** 2
+# Not prefixed with TEST_INFRA, cleanups of test infra resources by name must not delete the pool
+WARM_POOL_NAME = "warm-pool"
+WARM_POOL_NETWORK = "%s-net" % WARM_POOL_NAME
+WARM_POOL_BRIDGE = "twp0"
+WARM_POOL_CIDR = "192.168.200.0/24"
+WARM_POOL_TF_FOLDER = "build/warm_pool"
+INSTALL_HISTORY_PATH = "build/install_history.json"
+CLUSTER_FILES_CACHE_FOLDER = "build/cluster_files"
 WAIT_FOR_BM_API = 900
 
 
@@ -35,3 +50,4 @@ class ClusterStatus:
     INSTALLED = "installed"
     READY = "ready"
     INSTALLING = "installing"
+    ERROR = "error"
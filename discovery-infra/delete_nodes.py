@@ -1,41 +1,130 @@
 #!/usr/bin/python3
 
+import os
+import re
+import glob
+import json
 import argparse
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 import consts
 import utils
 import virsh_cleanup
+import warm_pool
 import bm_inventory_api
 from logger import log
 
+MAX_ENVIRONMENTS = 10
+# Terraform resources that virsh cleanup deletes by name
+LIBVIRT_RESOURCES = ["libvirt_domain", "libvirt_network", "libvirt_pool"]
+
 
 # Try to delete cluster if bm-inventory is up and such cluster exists
-def try_to_delete_cluster(tfvars):
+def try_to_delete_cluster(tfvars, inventory_url):
     try:
         cluster_id = tfvars.get("cluster_inventory_id")
         if cluster_id:
-            client = bm_inventory_api.create_client(args.inventory_url, wait_for_url=False)
+            client = bm_inventory_api.create_client(inventory_url, wait_for_url=False)
             client.delete_cluster(cluster_id=cluster_id)
     # TODO add different exception validations
     except Exception as exc:
         log.error("Failed to delete cluster %s", str(exc))
 
 
-# Runs terraform destroy and then cleans it with virsh cleanup to delete everything relevant
-def delete_nodes(tfvars):
+# Anchored to the cluster pool and nodes names and to the network name, so clusters and networks whose names
+# start with these, like clusters deployed in parallel, are not matched. Tfvars without names match all test infra
+def _resources_filter(tfvars):
+    if "cluster_name" not in tfvars or "libvirt_network_name" not in tfvars:
+        return [consts.TEST_INFRA]
+    return [r"^%s(-(master|worker)-\d+)?$" % re.escape(tfvars["cluster_name"]),
+            "^%s$" % re.escape(tfvars["libvirt_network_name"])]
+
+
+# Terraform can be skipped if every libvirt domain, network and pool in its state is matched by
+# virsh cleanup filter, volumes are deleted with their pools
+def _state_covered_by_filter(tf_folder, resource_filter):
+    state_path = os.path.join(tf_folder, "terraform.tfstate")
+    if not os.path.exists(state_path):
+        return False
+    with open(state_path) as _file:
+        state = json.load(_file)
+    names = [instance["attributes"]["name"] for resource in state.get("resources", [])
+             if resource["type"] in LIBVIRT_RESOURCES for instance in resource.get("instances", [])]
+    covered = virsh_cleanup.filter_resources(names, [], resource_filter)
+    uncovered = [name for name in names if name not in covered]
+    if uncovered:
+        log.info("Terraform state of %s has resources %s that virsh cleanup won't find", tf_folder, uncovered)
+    return not uncovered
+
+
+# Terraform folders of clusters deployed in parallel are nested in the default one, they are kept when it is removed
+def _remove_tf_folder(tf_folder):
+    for name in os.listdir(tf_folder):
+        path = os.path.join(tf_folder, name)
+        if os.path.exists(os.path.join(path, consts.TFVARS_JSON_FILE_NAME)):
+            continue
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    if not os.listdir(tf_folder):
+        os.rmdir(tf_folder)
+
+
+def _terraform_destroy(tf_folder):
     try:
-        log.info("Start running terraform delete")
+        log.info("Start running terraform delete in %s", tf_folder)
         cmd = "cd %s  && terraform destroy -auto-approve " \
               "-input=false -state=terraform.tfstate -state-out=terraform.tfstate " \
-              "-var-file=terraform.tfvars.json" % consts.TF_FOLDER
+              "-var-file=terraform.tfvars.json" % tf_folder
         utils.run_command_with_output(cmd)
     except:
-        log.exception("Failed to run terraform delete, deleting %s", consts.TF_FOLDER)
-        shutil.rmtree(consts.TF_FOLDER)
+        log.exception("Failed to run terraform delete, deleting %s", tf_folder)
+        _remove_tf_folder(tf_folder)
+
+
+# Runs terraform destroy and then cleans it with virsh cleanup to delete everything relevant.
+# With fast, terraform is skipped when virsh cleanup covers all resources of its state
+def delete_nodes(tfvars, tf_folder=consts.TF_FOLDER, fast=False):
+    resource_filter = _resources_filter(tfvars)
+    try:
+        if fast and _state_covered_by_filter(tf_folder, resource_filter):
+            # State would be stale after virsh cleanup, it is removed with the folder
+            log.info("Skipping terraform delete, deleting %s", tf_folder)
+            _remove_tf_folder(tf_folder)
+        else:
+            _terraform_destroy(tf_folder)
     finally:
-        virsh_cleanup.clean_virsh_resources(virsh_cleanup.DEFAULT_SKIP_LIST,
-                                            [tfvars.get("cluster_name", consts.TEST_INFRA),
-                                             tfvars.get("libvirt_network_name", consts.TEST_INFRA)])
+        warm_pool.release(tfvars.get("warm_pool_domains", []))
+        virsh_cleanup.clean_virsh_resources(virsh_cleanup.DEFAULT_SKIP_LIST, resource_filter)
+
+
+# Cluster is deleted from inventory while its nodes are deleted, they don't depend on each other
+def teardown(tfvars_file, inventory_url, only_nodes=False, fast=False):
+    with open(tfvars_file) as _file:
+        tfvars = json.load(_file)
+    tf_folder = os.path.dirname(tfvars_file)
+    log.info("Tearing down %s of %s", tfvars.get("cluster_name"), tf_folder)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        if not only_nodes:
+            executor.submit(try_to_delete_cluster, tfvars, inventory_url)
+        nodes = executor.submit(delete_nodes, tfvars, tf_folder, fast)
+    nodes.result()
+
+
+# Tfvars of the last deployed cluster and of clusters deployed in parallel, in TF_FOLDER subfolders
+def find_tfvars_files(tf_folder=consts.TF_FOLDER):
+    return sorted(glob.glob(os.path.join(tf_folder, consts.TFVARS_JSON_FILE_NAME)) +
+                  glob.glob(os.path.join(tf_folder, "*", consts.TFVARS_JSON_FILE_NAME)))
+
+
+# Nested terraform folders first, an environment is torn down only after all environments nested in it
+def _by_depth(tfvars_files):
+    depths = {}
+    for tfvars_file in tfvars_files:
+        depth = len(os.path.abspath(tfvars_file).split(os.sep))
+        depths.setdefault(depth, []).append(tfvars_file)
+    return [depths[depth] for depth in sorted(depths, reverse=True)]
 
 
 # Deletes every single virsh resource, leaves only defaults
@@ -47,14 +136,19 @@ def delete_all():
 def main():
     if args.delete_all:
         delete_all()
-    else:
-        try:
-            tfvars = utils.get_tfvars()
-            if not args.only_nodes:
-                try_to_delete_cluster(tfvars)
-            delete_nodes(tfvars)
-        except:
-            log.error("Failed to delete nodes")
+        return
+
+    tfvars_files = args.tfvars_files or find_tfvars_files()
+    if not tfvars_files:
+        log.error("No tfvars found, nothing to delete")
+        return
+    for group in _by_depth(tfvars_files):
+        with ThreadPoolExecutor(max_workers=MAX_ENVIRONMENTS) as executor:
+            futures = {executor.submit(teardown, tfvars_file, args.inventory_url, args.only_nodes, args.fast):
+                       tfvars_file for tfvars_file in group}
+        for future, tfvars_file in futures.items():
+            if future.exception():
+                log.error("Failed to delete nodes of %s: %s", tfvars_file, future.exception())
 
 
 if __name__ == "__main__":
@@ -63,5 +157,10 @@ if __name__ == "__main__":
     parser.add_argument('-id', '--cluster-id', help='Cluster id to install', type=str, default=None)
     parser.add_argument('-n', '--only-nodes', help='Delete only nodes, without cluster', action="store_true")
     parser.add_argument('-a', '--delete-all', help='Delete only nodes, without cluster', action="store_true")
+    parser.add_argument('-tf', '--tfvars-files', help="Tfvars of environments to delete, default: all tfvars in "
+                                                      "terraform folder and its subfolders", type=str, nargs="*",
+                        default=None)
+    parser.add_argument('-F', '--fast', help="Skip terraform if its state is covered by virsh cleanup",
+                        action="store_true")
     args = parser.parse_args()
     main()
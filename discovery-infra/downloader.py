@@ -0,0 +1,141 @@
+import os
+import re
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logger import log
+
+DEFAULT_SEGMENTS = 4
+CHUNK_SIZE = 1024 * 1024
+SEGMENT_RETRIES = 3
+JOURNAL_SAVE_INTERVAL = 2
+CONTENT_RANGE_REGEX = re.compile(r"bytes \d+-\d+/(\d+)")
+
+
+def log_throughput(file_path, size, started_at):
+    elapsed = max(time.time() - started_at, 0.001)
+    log.info("Downloaded %s, %.1f MB in %.1f seconds (%.1f MB/s)", file_path, size / 1024.0 ** 2, elapsed,
+             size / 1024.0 ** 2 / elapsed)
+
+
+# Downloads url with N parallel http range requests into preallocated file.
+# Progress of every segment is kept in <file_path>.journal, so interrupted download
+# continues from where it stopped, only if the server sent a validator (ETag or Last-Modified) that is
+# still the same. download returns False if server doesn't support ranges,
+# caller should fall back to single stream download in this case
+class RangedDownloader(object):
+
+    def __init__(self, pool_manager, headers=None, segments=DEFAULT_SEGMENTS, chunk_size=CHUNK_SIZE):
+        self.pool_manager = pool_manager
+        self.headers = headers or {}
+        self.segments = segments
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._journal = None
+        self._journal_path = None
+        self._journal_saved_at = 0
+
+    def _request(self, url, **headers):
+        request_headers = dict(self.headers)
+        request_headers.update(headers)
+        return self.pool_manager.request("GET", url, headers=request_headers, preload_content=False)
+
+    # Returns (size, validator) if server supports range requests, otherwise None.
+    # Validator is ETag or Last-Modified, None if server sent neither
+    def _probe(self, url):
+        response = self._request(url, Range="bytes=0-0")
+        try:
+            match = CONTENT_RANGE_REGEX.match(response.headers.get("Content-Range", ""))
+            if response.status != 206 or not match:
+                return None
+            return int(match.group(1)), response.headers.get("ETag") or response.headers.get("Last-Modified")
+        finally:
+            response.close()
+
+    # Without validator a regenerated file of the same size can't be told apart, so it is downloaded again
+    def _load_journal(self, url, size, validator, file_path):
+        try:
+            with open(self._journal_path) as _file:
+                journal = json.load(_file)
+            if validator and journal["url"] == url and journal["size"] == size and \
+                    journal["validator"] == validator and os.path.getsize(file_path) == size:
+                log.info("Resuming download of %s from journal", file_path)
+                return journal
+        except (OSError, ValueError, KeyError):
+            pass
+
+        segment_size = -(-size // self.segments)
+        segments = [{"start": start, "end": min(start + segment_size, size) - 1, "offset": start}
+                    for start in range(0, size, segment_size)]
+        return {"url": url, "size": size, "validator": validator, "segments": segments}
+
+    def _save_journal(self, force=False):
+        with self._lock:
+            if not force and time.time() - self._journal_saved_at < JOURNAL_SAVE_INTERVAL:
+                return
+            tmp_path = self._journal_path + ".tmp"
+            with open(tmp_path, "w") as _file:
+                json.dump(self._journal, _file)
+            os.rename(tmp_path, self._journal_path)
+            self._journal_saved_at = time.time()
+
+    # With If-Range server sends the whole file (200) instead of the range if it was changed meanwhile
+    def _download_segment(self, url, fd, segment):
+        headers = {"If-Range": self._journal["validator"]} if self._journal["validator"] else {}
+        for attempt in range(1, SEGMENT_RETRIES + 1):
+            if segment["offset"] > segment["end"]:
+                return
+            response = self._request(url, Range="bytes=%s-%s" % (segment["offset"], segment["end"]), **headers)
+            try:
+                if response.status != 206:
+                    raise Exception("Expected partial content for range %s-%s, got %s" %
+                                    (segment["offset"], segment["end"], response.status))
+                for chunk in response.stream(self.chunk_size):
+                    os.pwrite(fd, chunk, segment["offset"])
+                    segment["offset"] += len(chunk)
+                    self._save_journal()
+                if segment["offset"] > segment["end"]:
+                    return
+                raise Exception("Segment %s-%s ended at %s" % (segment["start"], segment["end"], segment["offset"]))
+            except Exception:
+                if attempt == SEGMENT_RETRIES:
+                    raise
+                log.warning("Failed to download segment %s-%s of %s, retrying from %s", segment["start"],
+                            segment["end"], url, segment["offset"], exc_info=True)
+            finally:
+                response.release_conn()
+
+    def download(self, url, file_path):
+        probe = self._probe(url)
+        if not probe:
+            log.info("Server doesn't support range requests for %s", url)
+            return False
+
+        size, validator = probe
+        started_at = time.time()
+        self._journal_path = file_path + ".journal"
+        self._journal = self._load_journal(url, size, validator, file_path)
+        remaining = sum(segment["end"] + 1 - segment["offset"] for segment in self._journal["segments"])
+
+        fd = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(fd, 0, size)
+            self._save_journal(force=True)
+            with ThreadPoolExecutor(max_workers=self.segments) as executor:
+                futures = [executor.submit(self._download_segment, url, fd, segment)
+                           for segment in self._journal["segments"]]
+            for future in futures:
+                future.result()
+        except:
+            self._save_journal(force=True)
+            raise
+        finally:
+            os.close(fd)
+
+        os.remove(self._journal_path)
+        log_throughput(file_path, remaining, started_at)
+        return True
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+# Stand-in bm-inventory server for offline benchmarks. Hosts are scheduled with POST /fake/clusters/<id>/hosts
+# and move through insufficient -> known -> installing -> installed with configurable delays.
+# GET /fake/stats returns number of api calls per endpoint
+
+import re
+import json
+import time
+import uuid
+import argparse
+import datetime
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import consts
+
+API_PREFIX = "/api/assisted-install/v1"
+
+
+def _timestamp(seconds):
+    return datetime.datetime.utcfromtimestamp(seconds).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class FakeInventory(object):
+
+    def __init__(self, known_delay=2, install_delay=10):
+        self.known_delay = known_delay
+        self.install_delay = install_delay
+        self._lock = threading.Lock()
+        self.clusters = {}
+        self.hosts = {}
+        self.requests = Counter()
+
+    def create_cluster(self, params):
+        cluster_id = str(uuid.uuid4())
+        with self._lock:
+            self.clusters[cluster_id] = {"params": params, "created_at": time.time(), "install_started_at": None,
+                                         "api_vip": None, "ingress_vip": None}
+            self.hosts[cluster_id] = {}
+        return self.get_cluster(cluster_id)
+
+    def add_hosts(self, cluster_id, hosts):
+        now = time.time()
+        with self._lock:
+            for host in hosts:
+                host_id = str(uuid.uuid4())
+                self.hosts[cluster_id][host_id] = {"id": host_id, "mac": host["mac"], "hostname": host["hostname"],
+                                                   "registered_at": now + host.get("delay", 0),
+                                                   "role": None, "role_set_at": None}
+
+    def update_cluster(self, cluster_id, params):
+        now = time.time()
+        with self._lock:
+            cluster = self.clusters[cluster_id]
+            for vip in ["api_vip", "ingress_vip"]:
+                if params.get(vip):
+                    cluster[vip] = params[vip]
+            for host_role in params.get("hosts_roles") or []:
+                host = self.hosts[cluster_id][host_role["id"]]
+                host["role"] = host_role["role"]
+                host["role_set_at"] = now
+        return self.get_cluster(cluster_id)
+
+    def install_cluster(self, cluster_id):
+        with self._lock:
+            self.clusters[cluster_id]["install_started_at"] = time.time()
+        return self.get_cluster(cluster_id)
+
+    def _host_status(self, host, cluster, now):
+        install_started_at = cluster["install_started_at"]
+        if install_started_at:
+            if now >= install_started_at + self.install_delay:
+                return consts.NodesStatus.INSTALLED, install_started_at + self.install_delay
+            return consts.NodesStatus.INSTALLING, install_started_at
+        if host["role_set_at"] and now >= host["role_set_at"] + self.known_delay:
+            return consts.NodesStatus.KNOWN, host["role_set_at"] + self.known_delay
+        return consts.NodesStatus.INSUFFICIENT, host["registered_at"]
+
+    def _host_dict(self, cluster_id, host, now):
+        status, status_updated_at = self._host_status(host, self.clusters[cluster_id], now)
+        hardware_info = {"nics": [{"name": "eth0", "mac": host["mac"]}], "cpu": {"cpus": 4},
+                         "memory": [{"name": "Mem", "total": 16 * 1024 ** 3}]}
+        return {"kind": "Host", "id": host["id"], "href": "%s/clusters/%s/hosts/%s" % (API_PREFIX, cluster_id,
+                                                                                    host["id"]),
+                "cluster_id": cluster_id, "status": status, "status_info": status, "role": host["role"],
+                "hardware_info": json.dumps(hardware_info), "created_at": _timestamp(host["registered_at"]),
+                "updated_at": _timestamp(status_updated_at), "status_updated_at": _timestamp(status_updated_at)}
+
+    def list_hosts(self, cluster_id):
+        now = time.time()
+        with self._lock:
+            return [self._host_dict(cluster_id, host, now) for host in self.hosts[cluster_id].values()
+                    if host["registered_at"] <= now]
+
+    def get_cluster(self, cluster_id):
+        hosts = self.list_hosts(cluster_id)
+        with self._lock:
+            cluster = self.clusters[cluster_id]
+            statuses = set(host["status"] for host in hosts)
+            if statuses == {consts.NodesStatus.INSTALLED}:
+                status = consts.ClusterStatus.INSTALLED
+            elif cluster["install_started_at"]:
+                status = consts.ClusterStatus.INSTALLING
+            elif statuses == {consts.NodesStatus.KNOWN}:
+                status = consts.ClusterStatus.READY
+            else:
+                status = "insufficient"
+            result = dict(cluster["params"])
+            result.update({"kind": "Cluster", "id": cluster_id, "href": "%s/clusters/%s" % (API_PREFIX, cluster_id),
+                           "status": status, "status_info": status, "hosts": hosts,
+                           "api_vip": cluster["api_vip"], "ingress_vip": cluster["ingress_vip"],
+                           "created_at": _timestamp(cluster["created_at"]), "image_info": {}})
+            return result
+
+    def list_clusters(self):
+        return [self.get_cluster(cluster_id) for cluster_id in list(self.clusters)]
+
+
+class FakeInventoryHandler(BaseHTTPRequestHandler):
+
+    inventory = None
+    routes = [
+        ("GET", r"/fake/stats$", lambda inv, body: {"requests": dict(inv.requests)}),
+        ("POST", r"/fake/clusters/(?P<cluster_id>[^/]+)/hosts$",
+         lambda inv, body, cluster_id: inv.add_hosts(cluster_id, body)),
+        ("GET", API_PREFIX + r"/clusters$", lambda inv, body: inv.list_clusters()),
+        ("POST", API_PREFIX + r"/clusters$", lambda inv, body: inv.create_cluster(body)),
+        ("GET", API_PREFIX + r"/clusters/(?P<cluster_id>[^/]+)$",
+         lambda inv, body, cluster_id: inv.get_cluster(cluster_id)),
+        ("PATCH", API_PREFIX + r"/clusters/(?P<cluster_id>[^/]+)$",
+         lambda inv, body, cluster_id: inv.update_cluster(cluster_id, body)),
+        ("GET", API_PREFIX + r"/clusters/(?P<cluster_id>[^/]+)/hosts$",
+         lambda inv, body, cluster_id: inv.list_hosts(cluster_id)),
+        ("POST", API_PREFIX + r"/clusters/(?P<cluster_id>[^/]+)/actions/install$",
+         lambda inv, body, cluster_id: inv.install_cluster(cluster_id)),
+    ]
+
+    def _handle(self, method):
+        path = self.path.split("?")[0]
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        for route_method, pattern, handler in self.routes:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                if not path.startswith("/fake"):
+                    endpoint = re.sub(r"\(\?P<(\w+)>[^)]*\)", r"{\1}", pattern[len(API_PREFIX):-1])
+                    self.inventory.requests["%s %s" % (method, endpoint)] += 1
+                try:
+                    self._reply(200 if method != "POST" else 201, handler(self.inventory, body, **match.groupdict()))
+                except KeyError:
+                    self._reply(404, {"code": "404", "reason": "not found"})
+                return
+        self._reply(404, {"code": "404", "reason": "no route for %s %s" % (method, path)})
+
+    def _reply(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def log_message(self, *_):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def create_server(port, known_delay, install_delay):
+    handler = type("Handler", (FakeInventoryHandler,), {"inventory": FakeInventory(known_delay, install_delay)})
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run fake bm-inventory server')
+    parser.add_argument('-p', '--port', help='Port to listen on', type=int, default=8090)
+    parser.add_argument('-kd', '--known-delay', help='Seconds from setting role till host is known',
+                        type=float, default=2)
+    parser.add_argument('-id', '--install-delay', help='Seconds from install command till hosts are installed',
+                        type=float, default=10)
+    args = parser.parse_args()
+    create_server(args.port, args.known_delay, args.install_delay).serve_forever()
@@ -0,0 +1,131 @@
+# Stand-in for the parts of libvirt python bindings used by test-infra, for offline benchmarks.
+# Networks are defined with define_network and leases are scheduled with FakeNetwork.add_lease,
+# domain lifecycle callbacks are called from virEventRunDefaultImpl when scheduled lease becomes visible
+
+import time
+import threading
+
+VIR_NETWORK_EVENT_ID_LIFECYCLE = 0
+VIR_DOMAIN_EVENT_ID_LIFECYCLE = 0
+VIR_DOMAIN_EVENT_STARTED = 2
+VIR_DOMAIN_UNDEFINE_MANAGED_SAVE = 1
+VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA = 2
+
+
+class libvirtError(Exception):
+    pass
+
+
+class FakeNetwork(object):
+
+    def __init__(self, name, bridge, cidr):
+        self._name = name
+        self._bridge = bridge
+        self._cidr = cidr
+        self._leases = []
+
+    def name(self):
+        return self._name
+
+    def bridgeName(self):
+        return self._bridge
+
+    def isActive(self):
+        return True
+
+    def XMLDesc(self, flags=0):
+        address, prefix = self._cidr.split("/")
+        return "<network><name>%s</name><bridge name='%s'/><ip address='%s' prefix='%s'/></network>" % (
+            self._name, self._bridge, address, prefix)
+
+    def add_lease(self, mac, ipaddr, hostname, delay=0):
+        self._leases.append((time.time() + delay, {"mac": mac, "ipaddr": ipaddr, "hostname": hostname}))
+
+    def DHCPLeases(self, mac=None, flags=0):
+        now = time.time()
+        return [dict(lease) for visible_at, lease in self._leases if visible_at <= now]
+
+
+class FakeHypervisor(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.networks = {}
+        self.domain_callbacks = {}
+        self.network_callbacks = {}
+        self.delivered_leases = 0
+        self._callback_id = 0
+
+    def next_callback_id(self):
+        with self.lock:
+            self._callback_id += 1
+            return self._callback_id
+
+    def deliver_events(self):
+        leases = sum(len(net.DHCPLeases()) for net in list(self.networks.values()))
+        if leases == self.delivered_leases:
+            return
+        self.delivered_leases = leases
+        for conn, callback, opaque in list(self.domain_callbacks.values()):
+            callback(conn, None, VIR_DOMAIN_EVENT_STARTED, 0, opaque)
+
+
+hypervisor = FakeHypervisor()
+
+
+def define_network(name, bridge, cidr):
+    hypervisor.networks[name] = FakeNetwork(name, bridge, cidr)
+    return hypervisor.networks[name]
+
+
+class FakeConnection(object):
+
+    def isAlive(self):
+        return 1
+
+    def networkLookupByName(self, name):
+        if name not in hypervisor.networks:
+            raise libvirtError("Network not found: no network with matching name '%s'" % name)
+        return hypervisor.networks[name]
+
+    def listAllNetworks(self, flags=0):
+        return list(hypervisor.networks.values())
+
+    def listAllDomains(self, flags=0):
+        return []
+
+    def listAllStoragePools(self, flags=0):
+        return []
+
+    def networkEventRegisterAny(self, net, event_id, callback, opaque):
+        callback_id = hypervisor.next_callback_id()
+        hypervisor.network_callbacks[callback_id] = (self, callback, opaque)
+        return callback_id
+
+    def domainEventRegisterAny(self, dom, event_id, callback, opaque):
+        callback_id = hypervisor.next_callback_id()
+        hypervisor.domain_callbacks[callback_id] = (self, callback, opaque)
+        return callback_id
+
+    def networkEventDeregisterAny(self, callback_id):
+        hypervisor.network_callbacks.pop(callback_id, None)
+
+    def domainEventDeregisterAny(self, callback_id):
+        hypervisor.domain_callbacks.pop(callback_id, None)
+
+    def close(self):
+        return 0
+
+
+def open(name=None):
+    return FakeConnection()
+
+
+def virEventRegisterDefaultImpl():
+    return 0
+
+
+def virEventRunDefaultImpl():
+    time.sleep(0.05)
+    hypervisor.deliver_events()
+    return 0
@@ -0,0 +1,59 @@
+from collections import namedtuple
+from logger import log
+
+ADDED = "added"
+REMOVED = "removed"
+STATUS = "status"
+PROGRESS = "progress"
+
+HostChange = namedtuple("HostChange", ["kind", "host_id", "old", "new"])
+
+# hosts as returned by the last fetch, changes from the previous fetch and counter
+# that grows on every fetch with changes
+HostsUpdate = namedtuple("HostsUpdate", ["hosts", "changes", "version"])
+
+
+def diff_hosts(previous, current):
+    changes = []
+    for host_id, host in current.items():
+        old_host = previous.get(host_id)
+        if not old_host:
+            changes.append(HostChange(ADDED, host_id, None, host["status"]))
+            continue
+        if old_host["status"] != host["status"]:
+            changes.append(HostChange(STATUS, host_id, old_host["status"], host["status"]))
+        if old_host.get("progress") != host.get("progress"):
+            changes.append(HostChange(PROGRESS, host_id, old_host.get("progress"), host.get("progress")))
+    for host_id, old_host in previous.items():
+        if host_id not in current:
+            changes.append(HostChange(REMOVED, host_id, old_host["status"], None))
+    return changes
+
+
+def log_changes(changes, hosts):
+    for change in changes:
+        if change.kind == ADDED:
+            log.info("Host %s was added in status %s", change.host_id, change.new, extra={"host_id": change.host_id})
+        elif change.kind == REMOVED:
+            log.info("Host %s was removed", change.host_id, extra={"host_id": change.host_id})
+        elif change.kind == STATUS:
+            log.info("Host %s moved from %s to %s: %s", change.host_id, change.old, change.new,
+                     hosts[change.host_id].get("status_info"), extra={"host_id": change.host_id})
+        else:
+            log.info("Host %s progress changed to %s", change.host_id, change.new, extra={"host_id": change.host_id})
+
+
+# Every next() calls fetch_hosts once, logs only what changed since the previous call and yields HostsUpdate.
+# fetch_hosts may return None for hosts that don't exist yet (hosts by macs)
+def hosts_feed(fetch_hosts):
+    previous = {}
+    version = 0
+    while True:
+        hosts = fetch_hosts()
+        current = {host["id"]: host for host in hosts if host}
+        changes = diff_hosts(previous, current)
+        if changes:
+            version += 1
+            log_changes(changes, current)
+        previous = current
+        yield HostsUpdate(hosts, changes, version)
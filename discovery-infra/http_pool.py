@@ -0,0 +1,109 @@
+import random
+import threading
+import urllib3
+from logger import log
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_MAX_CONCURRENT_REQUESTS = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (502, 503, 504)
+
+
+# Full jitter, random sleep between 0 and exponential backoff, so parallel waiters don't retry together
+class JitteredRetry(urllib3.util.Retry):
+
+    def get_backoff_time(self):
+        backoff = super(JitteredRetry, self).get_backoff_time()
+        return random.uniform(0, backoff) if backoff else 0
+
+
+# Keep-alive connections pool which lets at most max_concurrent_requests requests to be sent at the same time.
+# Streamed responses (preload_content=False) keep their place till release_conn or close, so reading their
+# body counts as a request too, callers must release them. Requests without explicit timeout and retries get
+# the pool defaults
+class _Gated(object):
+
+    def __init__(self, max_concurrent_requests, timeout, retries, **kwargs):
+        super(_Gated, self).__init__(**kwargs)
+        self.default_timeout = timeout
+        self.default_retries = retries
+        self._gate = threading.BoundedSemaphore(max_concurrent_requests)
+        self._local = threading.local()
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        if kw.get("timeout") is None:
+            kw["timeout"] = self.default_timeout
+        if kw.get("retries") is None:
+            kw["retries"] = self.default_retries
+        # Redirects call urlopen again from the same thread, the gate is already taken for them
+        if getattr(self._local, "in_gate", False):
+            return super(_Gated, self).urlopen(method, url, redirect=redirect, **kw)
+        self._gate.acquire()
+        self._local.in_gate = True
+        try:
+            response = super(_Gated, self).urlopen(method, url, redirect=redirect, **kw)
+        except:
+            self._gate.release()
+            raise
+        finally:
+            self._local.in_gate = False
+        if kw.get("preload_content", True):
+            self._gate.release()
+        else:
+            self._release_gate_with(response)
+        return response
+
+    # Gate is released once, by whichever of release_conn and close is called first
+    def _release_gate_with(self, response):
+        lock = threading.Lock()
+        released = []
+
+        def release_gate():
+            with lock:
+                if released:
+                    return
+                released.append(True)
+            self._gate.release()
+
+        def wrap(func):
+            def wrapped(*args, **kwargs):
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    release_gate()
+            return wrapped
+
+        response.release_conn = wrap(response.release_conn)
+        response.close = wrap(response.close)
+
+
+class GatedPoolManager(_Gated, urllib3.PoolManager):
+    pass
+
+
+class GatedProxyManager(_Gated, urllib3.ProxyManager):
+    pass
+
+
+# connection_pool_kw of pool manager created by generated client holds its ssl settings, they are kept as is.
+# With proxy_url requests go through the proxy, as with the ProxyManager of generated client
+def create_pool_manager(connection_pool_kw=None, pool_size=DEFAULT_POOL_SIZE,
+                        max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS,
+                        connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                        retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR, proxy_url=None,
+                        proxy_headers=None):
+    log.debug("Creating http pool with %s connections and %s concurrent requests", pool_size,
+              max_concurrent_requests)
+    kwargs = dict(connection_pool_kw or {})
+    kwargs.update({"maxsize": pool_size, "block": False})
+    retry = JitteredRetry(total=retries, connect=retries, read=retries, backoff_factor=backoff_factor,
+                          status_forcelist=RETRY_STATUSES, raise_on_status=False)
+    timeout = urllib3.Timeout(connect=connect_timeout, read=read_timeout)
+    if proxy_url:
+        return GatedProxyManager(max_concurrent_requests=max_concurrent_requests, timeout=timeout, retries=retry,
+                                 proxy_url=proxy_url, proxy_headers=proxy_headers, **kwargs)
+    return GatedPoolManager(max_concurrent_requests=max_concurrent_requests, timeout=timeout, retries=retry,
+                            **kwargs)
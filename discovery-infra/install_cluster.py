@@ -1,10 +1,15 @@
 #!/usr/bin/python3
 
 import argparse
-import waiting
 import utils
 import consts
+import polling
+import run_report
+import run_state
+import install_tracker
+import artifacts_collector
 import bm_inventory_api
+import logger
 from logger import log
 
 
@@ -29,15 +34,15 @@ def _install_cluster(client, cluster):
                                             interval=30)
 
 
+# Hosts and cluster statuses come in one cluster request per tick, polls are timed by install tracker
+# predictions of the next stage transition
 def wait_till_installed(client, cluster, timeout=60*60*2):
     log.info("Waiting %s till cluster finished installation", timeout)
-    # TODO: Change host validation for only previous known hosts
-    utils.wait_till_all_hosts_are_in_status(client=client, cluster_id=cluster.id,
-                                            nodes_count=len(cluster.hosts),
-                                            statuses=[consts.NodesStatus.INSTALLED],
-                                            timeout=timeout, interval=60)
-    utils.wait_till_cluster_is_in_status(client=client, cluster_id=cluster.id,
-                                         statuses=[consts.ClusterStatus.INSTALLED])
+    tracker = install_tracker.InstallTracker()
+    polling.wait_for(lambda: client.cluster_get(cluster.id).to_dict(), tracker.update,
+                     timeout_seconds=timeout, min_interval=install_tracker.LEAD_SECONDS, max_interval=60,
+                     waiting_for="Cluster to be installed", interval_func=tracker.next_interval)
+    tracker.save_history()
 
 
 # Runs installation flow :
@@ -45,33 +50,50 @@ def wait_till_installed(client, cluster, timeout=60*60*2):
 # 2. Running install cluster api
 # 3. Waiting till all nodes are in installing status
 # 4. Downloads kubeconfig for future usage
-def run_install_flow(client, cluster_id, kubeconfig_path, pull_secret):
+# Phases already done according to cluster run state are skipped when resuming
+def run_install_flow(client, cluster_id, kubeconfig_path, pull_secret, cluster_state=None):
     log.info("Verifying cluster exists")
     cluster = client.cluster_get(cluster_id)
-    log.info("Verifying pull secret")
-    verify_pull_secret(client=client, cluster=cluster, pull_secret=pull_secret)
-    log.info("Wait till cluster is ready")
-    utils.wait_till_cluster_is_in_status(client=client, cluster_id=cluster_id,
-                                         statuses=[consts.ClusterStatus.READY, consts.ClusterStatus.INSTALLING])
-    cluster = client.cluster_get(cluster_id)
-    if cluster.status == consts.ClusterStatus.READY:
-        log.info("Install cluster %s", cluster_id)
-        _install_cluster(client=client, cluster=cluster)
-
-    else:
-        log.info("Cluster is already in installing status, skipping install command")
-
-    log.info("Download kubeconfig-noingress")
-    client.download_kubeconfig_no_ingress(cluster_id=cluster_id, kubeconfig_path=kubeconfig_path)
-
-    wait_till_installed(client=client, cluster=cluster)
+    cluster_state = cluster_state or run_state.state.cluster(cluster.name)
+    cluster_state.update(cluster_id=cluster_id)
+    if not cluster_state.is_done("install_command"):
+        log.info("Verifying pull secret")
+        verify_pull_secret(client=client, cluster=cluster, pull_secret=pull_secret)
+        log.info("Wait till cluster is ready")
+        with run_report.report.span("wait_cluster_ready", cluster_id=cluster_id):
+            utils.wait_till_cluster_is_in_status(client=client, cluster_id=cluster_id,
+                                                 statuses=[consts.ClusterStatus.READY,
+                                                           consts.ClusterStatus.INSTALLING])
+        cluster = client.cluster_get(cluster_id)
+        if cluster.status == consts.ClusterStatus.READY:
+            log.info("Install cluster %s", cluster_id)
+            with run_report.report.span("install_command", cluster_id=cluster_id):
+                _install_cluster(client=client, cluster=cluster)
+
+        else:
+            log.info("Cluster is already in installing status, skipping install command")
+        cluster_state.mark_done("install_command")
+
+    if not cluster_state.is_done("kubeconfig_noingress"):
+        log.info("Download kubeconfig-noingress")
+        with run_report.report.span("kubeconfig_noingress", cluster_id=cluster_id):
+            client.download_kubeconfig_no_ingress(cluster_id=cluster_id, kubeconfig_path=kubeconfig_path)
+        cluster_state.mark_done("kubeconfig_noingress")
+
+    if not cluster_state.is_done("wait_installed"):
+        with run_report.report.span("wait_installed", cluster_id=cluster_id):
+            wait_till_installed(client=client, cluster=cluster)
+        cluster_state.mark_done("wait_installed")
 
     log.info("Download kubeconfig")
-    waiting.wait(lambda: client.download_kubeconfig(cluster_id=cluster_id, kubeconfig_path=kubeconfig_path) is None,
-                 timeout_seconds=240,
-                 sleep_seconds=20,
-                 expected_exceptions=Exception,
-                 waiting_for="Kubeconfig")
+    with run_report.report.span("kubeconfig", cluster_id=cluster_id):
+        polling.wait(lambda: client.download_kubeconfig(cluster_id=cluster_id,
+                                                        kubeconfig_path=kubeconfig_path) is None,
+                     timeout_seconds=240,
+                     max_interval=20,
+                     expected_exceptions=Exception,
+                     waiting_for="Kubeconfig")
+    cluster_state.mark_done("kubeconfig")
 
 
 def main():
@@ -81,9 +103,19 @@ def main():
     if not args.cluster_id:
         args.cluster_id = utils.get_tfvars()["cluster_inventory_id"]
     client = bm_inventory_api.create_client(wait_for_url=False)
-    run_install_flow(client=client, cluster_id=args.cluster_id,
-                     kubeconfig_path=args.kubeconfig_path,
-                     pull_secret=args.pull_secret)
+    run_report.report.metadata.update({"entry_point": "install_cluster", "cluster_id": args.cluster_id})
+    # State is always loaded, so install phases are added to the state of the deploy run
+    run_state.state.path = args.run_state
+    run_state.state.resume = args.resume
+    run_state.state.load()
+    artifacts_collector.add_target(args.cluster_id, client=client, cluster_id=args.cluster_id)
+    try:
+        with logger.log_context(cluster=args.cluster_id):
+            run_install_flow(client=client, cluster_id=args.cluster_id,
+                             kubeconfig_path=args.kubeconfig_path,
+                             pull_secret=args.pull_secret)
+    finally:
+        run_report.report.save(args.run_report)
 
 
 if __name__ == "__main__":
@@ -92,5 +124,11 @@ if __name__ == "__main__":
     parser.add_argument('-k', '--kubeconfig-path', help='Path to downloaded kubeconfig', type=str,
                         default="build/kubeconfig")
     parser.add_argument('-ps', '--pull-secret', help='Pull secret', type=str, default="")
+    parser.add_argument('-rR', '--run-report', help="Path to save json run report to", type=str,
+                        default=consts.RUN_REPORT_PATH)
+    parser.add_argument('-rS', '--run-state', help="Path of json journal of finished phases", type=str,
+                        default=consts.RUN_STATE_PATH)
+    parser.add_argument('-R', '--resume', help="Skip install phases finished by previous run according to "
+                                               "run state", action="store_true")
     args = parser.parse_args()
     main()
@@ -0,0 +1,194 @@
+# Tracks cluster installation stage by stage. Every host and the cluster itself is in a stage, its status and
+# progress current_stage, that it entered at progress stage_started_at or status_updated_at (or when it was
+# first seen). Durations of stages from previous runs are kept in install history, so the next transition is
+# predicted from them and polls are frequent only around it. Stages progress view and estimated time left
+# are logged on every change
+
+import os
+import json
+import time
+import datetime
+import statistics
+import consts
+import run_report
+from logger import log
+
+# Durations kept per stage and for whole installation
+HISTORY_RUNS = 20
+# Seconds to poll before predicted transition
+LEAD_SECONDS = 5
+# Poll interval when there is no history of current stages
+UNKNOWN_INTERVAL = 15
+CLUSTER_ID = "cluster"
+
+
+# Inventory times are utc, as datetime or as string if client didn't deserialize them
+def _timestamp(value):
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = _parse_time(value.rstrip("Z").replace("+00:00", ""))
+        if value is None:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.timestamp()
+
+
+def _parse_time(value):
+    for time_format in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    return None
+
+
+def _stage(status, progress):
+    current_stage = progress.get("current_stage") if isinstance(progress, dict) else progress
+    return "%s/%s" % (status, current_stage) if current_stage else status
+
+
+def _reported_at(entity):
+    progress = entity.get("progress")
+    return _timestamp(progress.get("stage_started_at") if isinstance(progress, dict) else None) or \
+        _timestamp(entity.get("status_updated_at"))
+
+
+# Install start of the cluster, a tracker that attached to a running installation (--resume) didn't see it.
+# Older inventories have no install_started_at, installing status_updated_at is the start while still installing
+def _install_started_at(cluster):
+    started_at = _timestamp(cluster.get("install_started_at"))
+    if not started_at and cluster["status"] == consts.ClusterStatus.INSTALLING:
+        started_at = _timestamp(cluster.get("status_updated_at"))
+    return started_at
+
+
+def load_history(path=consts.INSTALL_HISTORY_PATH):
+    if not os.path.exists(path):
+        return {"stages": {}, "totals": []}
+    with open(path) as _file:
+        return json.load(_file)
+
+
+class InstallTracker(object):
+
+    def __init__(self, history_path=consts.INSTALL_HISTORY_PATH):
+        self.history_path = history_path
+        self.history = load_history(history_path)
+        self.started_at = time.time()
+        # False if install start is unknown, total duration of such installation isn't recorded
+        self.started_at_known = True
+        # id -> {"name", "status", "stage", "entered_at", "done": [(stage, duration)]}
+        self.entities = {}
+
+    def _expected(self, stage):
+        durations = self.history["stages"].get(stage)
+        return statistics.median(durations) if durations else None
+
+    def _track(self, entity_id, name, status, stage, reported_at, now):
+        entity = self.entities.get(entity_id)
+        if entity and entity["stage"] == stage:
+            return False
+        entered_at = now
+        if reported_at and (not entity or reported_at > entity["entered_at"]):
+            entered_at = min(reported_at, now)
+        if entity:
+            entity["done"].append((entity["stage"], entered_at - entity["entered_at"]))
+        else:
+            entity = self.entities[entity_id] = {"name": name, "done": []}
+        entity.update(status=status, stage=stage, entered_at=entered_at)
+        return True
+
+    # Updates stages from cluster dict, returns True once cluster and all its hosts are installed
+    def update(self, cluster):
+        now = time.time()
+        hosts = cluster.get("hosts") or []
+        run_report.report.record_hosts_statuses(hosts)
+        hosts_in_error = [host for host in hosts if host["status"] == consts.NodesStatus.ERROR]
+        if hosts_in_error or cluster["status"] == consts.ClusterStatus.ERROR:
+            log.error("Installation failed, cluster status %s: %s, hosts in error %s", cluster["status"],
+                      cluster.get("status_info"), hosts_in_error)
+            raise Exception("Cluster installation failed with %s hosts in error" % len(hosts_in_error))
+
+        if not self.entities:
+            started_at = _install_started_at(cluster)
+            if started_at:
+                self.started_at = min(started_at, now)
+            else:
+                self.started_at_known = cluster["status"] == consts.ClusterStatus.READY
+        changed = self._track(CLUSTER_ID, cluster.get("name") or CLUSTER_ID, cluster["status"], cluster["status"],
+                              _timestamp(cluster.get("status_updated_at")), now)
+        for host in hosts:
+            changed |= self._track(host["id"], host.get("requested_hostname") or host["id"], host["status"],
+                                   _stage(host["status"], host.get("progress")), _reported_at(host), now)
+        if changed:
+            # Formatted here, the listener thread would read entities while they are updated
+            log.info("%s", self.progress_view(now))
+
+        return cluster["status"] == consts.ClusterStatus.INSTALLED and \
+            all(host["status"] == consts.NodesStatus.INSTALLED for host in hosts)
+
+    def _installing(self):
+        return [entity for entity in self.entities.values() if entity["status"] != consts.NodesStatus.INSTALLED]
+
+    def eta(self, now=None):
+        now = now or time.time()
+        if not self.history["totals"]:
+            return None
+        left = statistics.median(self.history["totals"]) - (now - self.started_at)
+        # Stage that is expected to last longer than the whole installation still pushes it forward
+        for entity in self._installing():
+            expected = self._expected(entity["stage"])
+            if expected is not None:
+                left = max(left, entity["entered_at"] + expected - now)
+        return max(left, 0)
+
+    # Seconds till LEAD_SECONDS before the nearest predicted transition. Overdue transitions are polled
+    # more rarely the longer they are late
+    def next_interval(self, now=None):
+        now = now or time.time()
+        intervals = []
+        for entity in self._installing():
+            expected = self._expected(entity["stage"])
+            if expected is None:
+                intervals.append(UNKNOWN_INTERVAL)
+                continue
+            till_transition = entity["entered_at"] + expected - now
+            intervals.append(till_transition - LEAD_SECONDS if till_transition > LEAD_SECONDS
+                             else LEAD_SECONDS + max(-till_transition, 0) / 2)
+        return min(intervals) if intervals else UNKNOWN_INTERVAL
+
+    def progress_view(self, now=None):
+        now = now or time.time()
+        elapsed = now - self.started_at
+        eta = self.eta(now)
+        if eta is None:
+            header = "Installation %ds, no history to estimate time left" % elapsed
+        else:
+            header = "Installation %ds, about %ds left (%d%%)" % (elapsed, eta, 100 * elapsed / max(elapsed + eta, 1))
+        rows = [header]
+        for entity in sorted(self.entities.values(), key=lambda entity: entity["name"]):
+            expected = self._expected(entity["stage"])
+            rows.append("  %-40s %-50s %6ds / %s" % (entity["name"], entity["stage"], now - entity["entered_at"],
+                                                    "%ds" % expected if expected is not None else "?"))
+        return "\n".join(rows)
+
+    # Adds durations of this installation to history, only successful installations are recorded
+    def save_history(self):
+        for entity in self.entities.values():
+            for stage, duration in entity["done"]:
+                durations = self.history["stages"].setdefault(stage, [])
+                durations.append(duration)
+                del durations[:-HISTORY_RUNS]
+        if self.started_at_known:
+            self.history["totals"] = (self.history["totals"] + [time.time() - self.started_at])[-HISTORY_RUNS:]
+        else:
+            log.info("Install start is unknown, total installation duration isn't saved to history")
+
+        os.makedirs(os.path.dirname(self.history_path) or ".", exist_ok=True)
+        tmp_path = "%s.tmp" % self.history_path
+        with open(tmp_path, "w") as _file:
+            json.dump(self.history, _file, indent=2)
+        os.replace(tmp_path, self.history_path)
+        log.info("Install history saved to %s", self.history_path)
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+import libvirt
+from waiting.exceptions import TimeoutExpired
+import consts
+import polling
+from logger import log
+
+DNSMASQ_STATUS_FILE = "/var/lib/libvirt/dnsmasq/%s.status"
+
+_event_loop_lock = threading.Lock()
+_event_loop_thread = None
+
+
+def _run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+
+# Event implementation must be registered before opening the connection that should receive events,
+# so watcher opens its own connection after calling it. Safe to call more than once.
+def start_event_loop():
+    global _event_loop_thread
+    with _event_loop_lock:
+        if _event_loop_thread is None:
+            libvirt.virEventRegisterDefaultImpl()
+            _event_loop_thread = threading.Thread(target=_run_event_loop, name="libvirt-event-loop", daemon=True)
+            _event_loop_thread.start()
+
+
+# Watches dhcp leases of libvirt network and wakes waiters as soon as new lease appears.
+# Libvirt has no lease events, so the watcher is woken by network/domain lifecycle events and by
+# changes of dnsmasq status file (cheap stat). If none of them are available it polls
+# DHCPLeases with interval that backs off from min_interval to max_interval and resets on every change.
+class LeasesWatcher(object):
+
+    def __init__(self, network_name, uri=consts.LIBVIRT_URI, min_interval=1, max_interval=10,
+                 status_file_interval=0.5):
+        self.network_name = network_name
+        self.uri = uri
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.status_file_interval = status_file_interval
+        self._condition = threading.Condition()
+        self._woken = False
+        self._conn = None
+        self._net = None
+        self._callback_ids = []
+        self._status_file = None
+        self._status_file_mtime = None
+        self._started_at = None
+        self._leases = []
+        self._time_to_ip = {}
+
+    def start(self):
+        self._started_at = time.time()
+        try:
+            start_event_loop()
+            self._conn = libvirt.open(self.uri)
+            self._net = self._conn.networkLookupByName(self.network_name)
+            self._callback_ids.append(("network", self._conn.networkEventRegisterAny(
+                self._net, libvirt.VIR_NETWORK_EVENT_ID_LIFECYCLE, self._on_event, None)))
+            self._callback_ids.append(("domain", self._conn.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._on_event, None)))
+            self._status_file = DNSMASQ_STATUS_FILE % self._net.bridgeName()
+            if not os.access(self._status_file, os.R_OK):
+                self._status_file = None
+        except libvirt.libvirtError as exc:
+            log.warning("Libvirt events are not available, falling back to polling leases: %s", exc)
+            if not self._net:
+                self._conn = libvirt.open(self.uri)
+                self._net = self._conn.networkLookupByName(self.network_name)
+        return self
+
+    def stop(self):
+        for kind, callback_id in self._callback_ids:
+            try:
+                if kind == "network":
+                    self._conn.networkEventDeregisterAny(callback_id)
+                else:
+                    self._conn.domainEventDeregisterAny(callback_id)
+            except libvirt.libvirtError:
+                log.debug("Failed to deregister %s event callback %s", kind, callback_id)
+        self._callback_ids = []
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def _on_event(self, conn, obj, event, detail, opaque):
+        with self._condition:
+            self._woken = True
+            self._condition.notify_all()
+
+    def _status_file_changed(self):
+        try:
+            mtime = os.stat(self._status_file).st_mtime
+        except OSError:
+            return True
+        changed = mtime != self._status_file_mtime
+        self._status_file_mtime = mtime
+        return changed
+
+    def _refresh(self):
+        self._leases = self._net.DHCPLeases()
+        for lease in self._leases:
+            if lease["mac"] not in self._time_to_ip:
+                self._time_to_ip[lease["mac"]] = time.time() - self._started_at
+                log.info("Node %s (%s) got ip %s after %.1f seconds", lease["hostname"], lease["mac"],
+                         lease["ipaddr"], self._time_to_ip[lease["mac"]])
+        return self._leases
+
+    # Sleeps till event arrives, status file changes or interval passes. Returns True if woken by a change
+    def _sleep(self, interval):
+        deadline = time.time() + interval
+        with self._condition:
+            while not self._woken:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(min(remaining, self.status_file_interval) if self._status_file else remaining)
+                if self._status_file and self._status_file_changed():
+                    self._woken = True
+            woken, self._woken = self._woken, False
+        return woken
+
+    @property
+    def leases(self):
+        return self._leases
+
+    # Seconds from watcher start till each mac got its lease
+    @property
+    def time_to_ip(self):
+        return dict(self._time_to_ip)
+
+    def wait_for_leases(self, nodes_count, timeout_seconds):
+        deadline = time.time() + timeout_seconds
+        interval = self.min_interval
+        if self._status_file:
+            self._status_file_changed()
+        while True:
+            known_leases = len(self._leases)
+            if len(self._refresh()) >= nodes_count:
+                return self._leases
+            if len(self._leases) != known_leases:
+                interval = self.min_interval
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                polling.run_timeout_hooks("Nodes to have ips")
+                raise TimeoutExpired(timeout_seconds, "Nodes to have ips")
+            if self._sleep(min(interval, remaining)):
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
@@ -1,18 +1,108 @@
-import logging
+import os
 import sys
+import json
+import uuid
+import queue
+import atexit
+import logging
+import threading
+import contextlib
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Records are put on a queue by the logging thread as they are and formatted and written to stdout and the rotating
+# log file by a single listener thread, so polls don't wait for formatting or writes and parallel clusters don't
+# interleave lines.
+# Every record has run_id, cluster and host_id fields, with LOG_JSON set the log file is json lines.
+# Parallel runs on the same machine should set their own LOG_FILE
+LOG_FILE = os.environ.get("LOG_FILE") or "test_infra.log"
+LOG_JSON = bool(os.environ.get("LOG_JSON"))
+LOG_LEVEL = os.environ.get("LOG_LEVEL") or "DEBUG"
+LOG_MAX_BYTES = 50 * 1024 ** 2
+LOG_BACKUPS = 5
+RUN_ID = os.environ.get("RUN_ID") or str(uuid.uuid4())[:8]
+CONTEXT_FIELDS = ["run_id", "cluster", "host_id"]
 
 logging.getLogger("requests").setLevel(logging.ERROR)
 logging.getLogger("urllib3").setLevel(logging.ERROR)
 
-log = logging.getLogger('')
-log.setLevel(logging.DEBUG)
-format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+_context = threading.local()
+
+
+# Fields added to every record logged by the current thread inside the block, e.g. with log_context(cluster=name)
+@contextlib.contextmanager
+def log_context(**fields):
+    previous = getattr(_context, "fields", {})
+    _context.fields = dict(previous, **fields)
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+
+# Log argument that is computed only if the record is emitted, e.g. log.debug("Hosts %s", Lazy(json.dumps, hosts)).
+# It is computed by the listener thread, so func must not read anything the logging thread keeps changing
+class Lazy(object):
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self._value = None
+
+    # Computed once, the rotating file handler formats the record to check rollover and then to write it
+    def __str__(self):
+        if self._value is None:
+            self._value = str(self.func(*self.args, **self.kwargs))
+        return self._value
+
+
+# Runs in the logging thread, where thread context is known. Fields given with extra are kept
+class _ContextFilter(logging.Filter):
+
+    def filter(self, record):
+        fields = dict(getattr(_context, "fields", {}), run_id=RUN_ID)
+        for field in CONTEXT_FIELDS:
+            if getattr(record, field, None) is None:
+                setattr(record, field, fields.get(field, ""))
+        return True
+
+
+class _QueueHandler(QueueHandler):
+
+    # Queue is in process, record keeps its args and exc_info and is formatted by the sinks that emit it
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {"time": self.formatTime(record), "level": record.levelname, "message": record.getMessage(),
+                "source": "%s:%s" % (record.filename, record.lineno)}
+        data.update({field: getattr(record, field, "") or None for field in CONTEXT_FIELDS})
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
 
 ch = logging.StreamHandler(sys.stdout)
+ch.setLevel(LOG_LEVEL)
 ch.setFormatter(logging.Formatter('%(asctime)s %(levelname)-10s %(message)s \t'
                                   '(%(pathname)s:%(lineno)d)'))
-log.addHandler(ch)
 
-fh = logging.FileHandler(filename="test_infra.log")
-fh.setFormatter(format)
-log.addHandler(fh)
+fh = RotatingFileHandler(filename=LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+fh.setFormatter(JsonFormatter() if LOG_JSON else
+                logging.Formatter("%(asctime)s - %(run_id)s %(cluster)s - %(levelname)s - %(message)s"))
+
+_queue = queue.Queue(-1)
+_listener = QueueListener(_queue, ch, fh, respect_handler_level=True)
+_listener.start()
+# Listener writes everything left in the queue before the process exits
+atexit.register(_listener.stop)
+
+qh = _QueueHandler(_queue)
+qh.addFilter(_ContextFilter())
+
+log = logging.getLogger('')
+log.setLevel(logging.DEBUG)
+log.addHandler(qh)
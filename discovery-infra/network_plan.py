@@ -0,0 +1,93 @@
+import ipaddress
+import threading
+from collections import namedtuple
+
+NODES_OFFSET = 10
+VIPS_OFFSET = 100
+
+# Everything that is derived from vms network of a single cluster, computed once by create_network_plan
+NetworkPlan = namedtuple("NetworkPlan", ["network_name", "bridge", "machine_cidr", "master_ips", "worker_ips",
+                                         "api_vip", "ingress_vip"])
+
+
+# Nodes get addresses from network address + NODES_OFFSET, masters first and then workers,
+# api and ingress vips are network address + VIPS_OFFSET and VIPS_OFFSET + 1 and are skipped by nodes
+def create_network_plan(network_name, bridge, machine_cidr, masters_count, workers_count):
+    network = ipaddress.ip_network(machine_cidr)
+    api_vip = network.network_address + VIPS_OFFSET
+    ingress_vip = api_vip + 1
+    if ingress_vip not in network:
+        raise Exception("Network %s is too small for vips" % machine_cidr)
+
+    ips = []
+    address = network.network_address + NODES_OFFSET
+    while len(ips) < masters_count + workers_count:
+        if address >= network.broadcast_address:
+            raise Exception("Network %s is too small for %s nodes" % (machine_cidr, masters_count + workers_count))
+        if address not in (api_vip, ingress_vip):
+            ips.append(str(address))
+        address += 1
+
+    return NetworkPlan(network_name=network_name, bridge=bridge, machine_cidr=str(network),
+                       master_ips=tuple(ips[:masters_count]), worker_ips=tuple(ips[masters_count:]),
+                       api_vip=str(api_vip), ingress_vip=str(ingress_vip))
+
+
+# Allocates networks of base_cidr size one after another starting from base_cidr, skipping names, bridges
+# and subnets used by existing networks (as returned by utils.get_libvirt_networks_usage) and by previous
+# allocations. Used subnets are turned once into sorted ranges of slots, so every allocation only moves forward
+class NetworkAllocator(object):
+
+    def __init__(self, base_cidr, network_prefix, bridge_prefix, used_names=(), used_bridges=(), used_cidrs=()):
+        self.base = ipaddress.ip_network(base_cidr)
+        self.network_prefix = network_prefix
+        self.bridge_prefix = bridge_prefix
+        self._used_names = set(used_names)
+        self._used_bridges = set(used_bridges)
+        self._blocked = self._blocked_slots(used_cidrs)
+        self._blocked_index = 0
+        self._slot = 0
+        self._lock = threading.Lock()
+
+    def _blocked_slots(self, cidrs):
+        start = int(self.base.network_address)
+        size = self.base.num_addresses
+        blocked = []
+        for cidr in cidrs:
+            cidr = ipaddress.ip_network(cidr, strict=False)
+            if cidr.version != self.base.version or int(cidr.broadcast_address) < start:
+                continue
+            blocked.append((max(int(cidr.network_address) - start, 0) // size,
+                            (int(cidr.broadcast_address) - start) // size))
+        return sorted(blocked)
+
+    def _is_blocked(self, slot):
+        while self._blocked_index < len(self._blocked) and self._blocked[self._blocked_index][1] < slot:
+            self._blocked_index += 1
+        return self._blocked_index < len(self._blocked) and self._blocked[self._blocked_index][0] <= slot
+
+    def allocate(self, masters_count, workers_count):
+        with self._lock:
+            while True:
+                slot = self._slot
+                self._slot += 1
+                address = int(self.base.network_address) + slot * self.base.num_addresses
+                if address + self.base.num_addresses > 2 ** self.base.max_prefixlen:
+                    raise Exception("No free networks left after %s" % self.base)
+                network_name = "%s-%s" % (self.network_prefix, slot)
+                bridge = "%s%s" % (self.bridge_prefix, slot)
+                if self._is_blocked(slot) or network_name in self._used_names or bridge in self._used_bridges:
+                    continue
+
+                self._used_names.add(network_name)
+                self._used_bridges.add(bridge)
+                machine_cidr = ipaddress.ip_network((address, self.base.prefixlen))
+                return create_network_plan(network_name, bridge, str(machine_cidr), masters_count, workers_count)
+
+
+# Plan saved as json (lists instead of tuples) back to NetworkPlan
+def network_plan_from_dict(data):
+    data = dict(data)
+    data["master_ips"] = tuple(data["master_ips"])
+    data["worker_ips"] = tuple(data["worker_ips"])
+    return NetworkPlan(**data)
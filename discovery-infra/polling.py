@@ -0,0 +1,146 @@
+import threading
+import time
+from waiting.exceptions import TimeoutExpired
+from logger import log
+
+DEFAULT_MIN_INTERVAL = 1
+DEFAULT_MAX_INTERVAL = 30
+BACKOFF_FACTOR = 2
+
+
+class WaitStats(object):
+
+    def __init__(self, waiting_for):
+        self.waiting_for = waiting_for
+        self.started_at = time.time()
+        self.finished_at = None
+        self.requests = 0
+        self.succeeded = False
+
+    @property
+    def latency(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        return {"waiting_for": self.waiting_for, "latency": self.latency,
+                "requests": self.requests, "succeeded": self.succeeded}
+
+
+_timeout_hooks = []
+
+
+# hook(waiting_for) is called on every wait timeout before TimeoutExpired is raised
+def add_timeout_hook(hook):
+    _timeout_hooks.append(hook)
+
+
+def run_timeout_hooks(waiting_for):
+    for hook in list(_timeout_hooks):
+        try:
+            hook(waiting_for)
+        except Exception:
+            log.exception("Timeout hook %s failed", hook)
+
+
+class _InFlight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Polling engine for all waits. Interval starts from min_interval and is multiplied by BACKOFF_FACTOR
+# up to max_interval while fetched state doesn't change, any change resets it back to min_interval.
+# Fetches with the same key that run concurrently (parallel waits on the same cluster) are done once
+# and their result is shared between the waiters.
+class Poller(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.stats = []
+
+    # Returns (result, True) if this call did the fetch or (result, False) if it got result of concurrent fetch
+    def fetch(self, fetch, key):
+        if key is None:
+            return fetch(), True
+
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            owner = in_flight is None
+            if owner:
+                in_flight = self._in_flight[key] = _InFlight()
+
+        if not owner:
+            in_flight.done.wait()
+            if in_flight.error:
+                raise in_flight.error
+            return in_flight.result, False
+
+        try:
+            in_flight.result = fetch()
+        except Exception as exc:
+            in_flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+        return in_flight.result, True
+
+    # Waits till condition(fetch()) is true. fingerprint(result) is compared between ticks to detect changes.
+    # If interval_func is given, it returns seconds to the next tick instead of the backoff
+    def wait_for(self, fetch, condition, timeout_seconds, waiting_for, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, expected_exceptions=(), key=None, fingerprint=None,
+                 interval_func=None):
+        stats = WaitStats(waiting_for)
+        with self._lock:
+            self.stats.append(stats)
+
+        deadline = time.time() + timeout_seconds
+        interval = min(min_interval, max_interval)
+        last_fingerprint = None
+        try:
+            while True:
+                try:
+                    result, requested = self.fetch(fetch, key)
+                    stats.requests += int(requested)
+                    if condition(result):
+                        stats.succeeded = True
+                        return result
+                    current_fingerprint = fingerprint(result) if fingerprint else result
+                    if current_fingerprint != last_fingerprint:
+                        interval = min(min_interval, max_interval)
+                    else:
+                        interval = min(interval * BACKOFF_FACTOR, max_interval)
+                    last_fingerprint = current_fingerprint
+                    if interval_func:
+                        interval = min(max(interval_func(), min_interval), max_interval)
+                except expected_exceptions as exc:
+                    log.debug("Got expected exception while waiting for %s: %s", waiting_for, exc)
+                    interval = min(interval * BACKOFF_FACTOR, max_interval)
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    run_timeout_hooks(waiting_for)
+                    raise TimeoutExpired(timeout_seconds, waiting_for)
+                time.sleep(min(interval, remaining))
+        finally:
+            stats.finished_at = time.time()
+            log.info("Waiting for %s %s after %.1f seconds and %s requests", waiting_for,
+                     "succeeded" if stats.succeeded else "failed", stats.latency, stats.requests)
+
+    def wait(self, predicate, timeout_seconds, waiting_for, **kwargs):
+        return self.wait_for(predicate, bool, timeout_seconds=timeout_seconds, waiting_for=waiting_for, **kwargs)
+
+
+poller = Poller()
+
+
+def wait_for(fetch, condition, timeout_seconds, waiting_for, **kwargs):
+    return poller.wait_for(fetch, condition, timeout_seconds=timeout_seconds, waiting_for=waiting_for, **kwargs)
+
+
+def wait(predicate, timeout_seconds, waiting_for, **kwargs):
+    return poller.wait(predicate, timeout_seconds=timeout_seconds, waiting_for=waiting_for, **kwargs)
@@ -0,0 +1,126 @@
+# Hosts roles by declarative policies. Every node gets the role of the first policy that matches its vm name,
+# still has room for more hosts and whose hardware thresholds are met by the host hardware_info.
+# Roles are sent in batches, every poll sends roles of all hosts that registered since the previous one
+
+import re
+import json
+import threading
+from collections import namedtuple, Counter
+import consts
+import polling
+from logger import log
+
+RolePolicy = namedtuple("RolePolicy", ["role", "name_pattern", "count", "min_cpus", "min_memory_gib"])
+
+
+def create_policy(role, name_pattern=None, count=None, min_cpus=None, min_memory_gib=None):
+    return RolePolicy(role=role, name_pattern=name_pattern, count=count, min_cpus=min_cpus,
+                      min_memory_gib=min_memory_gib)
+
+
+# Same as roles by vm names: worker if worker is in the name, master otherwise
+DEFAULT_POLICIES = [create_policy(consts.NodeRoles.WORKER, name_pattern=consts.NodeRoles.WORKER),
+                    create_policy(consts.NodeRoles.MASTER)]
+
+
+# Json list of policies, for example [{"role": "master", "count": 3, "min_cpus": 4}, {"role": "worker"}]
+def load_policies(path):
+    with open(path) as _file:
+        return [create_policy(**policy) for policy in json.load(_file)]
+
+
+class RoleAssigner(object):
+
+    def __init__(self, policies=DEFAULT_POLICIES):
+        self.policies = policies
+        self.needs_hardware = any(policy.min_cpus or policy.min_memory_gib for policy in policies)
+        self._patterns = [re.compile(policy.name_pattern) if policy.name_pattern else None for policy in policies]
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hardware_matches(policy, hardware):
+        return (not policy.min_cpus or hardware["cpus"] >= policy.min_cpus) and \
+               (not policy.min_memory_gib or hardware["memory_gib"] >= policy.min_memory_gib)
+
+    # Returns None if hardware is needed to decide and host didn't report it yet
+    def assign(self, name, hardware):
+        if hardware is None and self.needs_hardware:
+            return None
+        with self._lock:
+            for index, policy in enumerate(self.policies):
+                if self._patterns[index] and not self._patterns[index].search(name):
+                    continue
+                if policy.count is not None and self._counts[index] >= policy.count:
+                    continue
+                if hardware is not None and not self._hardware_matches(policy, hardware):
+                    continue
+                self._counts[index] += 1
+                return policy.role
+        raise Exception("No role policy matches node %s with hardware %s" % (name, hardware))
+
+    # Counts role of a host that already has it, e.g. when workers are added, against the first policy of
+    # that role with room left, so count limits include hosts that were assigned before
+    def count_existing(self, role):
+        with self._lock:
+            indexes = [index for index, policy in enumerate(self.policies) if policy.role == role]
+            for index in indexes:
+                if self.policies[index].count is None or self._counts[index] < self.policies[index].count:
+                    self._counts[index] += 1
+                    return
+            if indexes:
+                self._counts[indexes[-1]] += 1
+
+
+# Polls hosts and sets roles of every node from nodes (mac -> libvirt metadata with name) as soon as its host
+# registers. Roles of other hosts of the cluster, from the first poll, are counted against the policies.
+# set_vips_func is called once, when first host is insufficient
+class RolesPipeline(object):
+
+    def __init__(self, client, cluster_id, nodes, policies=DEFAULT_POLICIES, set_vips_func=None):
+        self.client = client
+        self.cluster_id = cluster_id
+        self.assigner = RoleAssigner(policies)
+        self.pending = dict(nodes)
+        self.set_vips_func = set_vips_func
+        self.batches = 0
+        self._existing_counted = False
+
+    def _set_vips_if_needed(self, snapshot):
+        if self.set_vips_func and any(host["status"] == consts.NodesStatus.INSUFFICIENT for host in snapshot.hosts):
+            self.set_vips_func()
+            self.set_vips_func = None
+
+    def _count_existing_roles(self, snapshot):
+        pending_macs = set(mac.lower() for mac in self.pending)
+        for host in snapshot.hosts:
+            if host.get("role") and pending_macs.isdisjoint(snapshot.macs_by_host_id[host["id"]]):
+                self.assigner.count_existing(host["role"])
+        self._existing_counted = True
+
+    def process(self, snapshot):
+        if not self._existing_counted:
+            self._count_existing_roles(snapshot)
+        batch = []
+        for mac, node in list(self.pending.items()):
+            host = snapshot.get_host_by_mac(mac)
+            if not host:
+                continue
+            role = self.assigner.assign(node["name"], snapshot.hardware_by_host_id.get(host["id"]))
+            if role:
+                batch.append({"id": host["id"], "role": role})
+                del self.pending[mac]
+
+        if batch:
+            self.batches += 1
+            log.info("Setting roles of %s hosts, %s hosts are left", len(batch), len(self.pending))
+            self.client.set_hosts_roles(cluster_id=self.cluster_id, hosts_with_roles=batch)
+        self._set_vips_if_needed(snapshot)
+        return not self.pending and not self.set_vips_func
+
+    def run(self, timeout=consts.NODES_REGISTERED_TIMEOUT, max_interval=5):
+        polling.wait_for(lambda: self.client.get_hosts_snapshot(self.cluster_id), self.process,
+                         timeout_seconds=timeout, max_interval=max_interval,
+                         waiting_for="Roles of %s nodes to be set" % len(self.pending),
+                         fingerprint=lambda snapshot: [(host["id"], host["status"]) for host in snapshot.hosts])
+        log.info("Roles of all nodes were set in %s batches", self.batches)
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+# Phase timings and hosts status transitions of a single run, saved as json report.
+# Running this file diffs two reports to find performance regressions between runs
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+import consts
+import logger
+from logger import log
+
+
+class RunReport(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.metadata = {"run_id": logger.RUN_ID}
+        self.spans = []
+        self.hosts = {}
+
+    # Times the wrapped code, yielded span dict gets its duration when the block exits
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        span = {"name": name, "attributes": attributes, "started_at": time.time(), "duration": None,
+                "failed": False}
+        with self._lock:
+            self.spans.append(span)
+        try:
+            yield span
+        except:
+            span["failed"] = True
+            raise
+        finally:
+            span["duration"] = time.time() - span["started_at"]
+            log.info("Phase %s %s took %.1f seconds", name, attributes or "", span["duration"])
+
+    # Appends transition for every host which status differs from the last recorded one
+    def record_hosts_statuses(self, hosts):
+        now = time.time()
+        with self._lock:
+            for host in hosts:
+                transitions = self.hosts.setdefault(host["id"], [])
+                if not transitions or transitions[-1]["status"] != host["status"]:
+                    transitions.append({"status": host["status"], "timestamp": now})
+
+    def to_dict(self):
+        with self._lock:
+            return {"started_at": self.started_at,
+                    "duration": time.time() - self.started_at,
+                    "metadata": dict(self.metadata),
+                    "spans": list(self.spans),
+                    "hosts": dict(self.hosts)}
+
+    def save(self, path=consts.RUN_REPORT_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as _file:
+            json.dump(self.to_dict(), _file, indent=2)
+        log.info("Run report saved to %s", path)
+
+
+report = RunReport()
+
+
+def load_report(path):
+    with open(path) as _file:
+        return json.load(_file)
+
+
+# Longest duration of every phase, parallel clusters have the same phase few times
+def phases_durations(run_report):
+    durations = {}
+    for span in run_report["spans"]:
+        if span["duration"] is not None and not span["failed"]:
+            durations[span["name"]] = max(durations.get(span["name"], 0), span["duration"])
+    durations["total"] = run_report["duration"]
+    return durations
+
+
+# Returns list of (phase, old duration, new duration) where new is slower than old by more than threshold ratio
+def diff_reports(old_report, new_report, threshold):
+    old_durations = phases_durations(old_report)
+    new_durations = phases_durations(new_report)
+    rows = []
+    regressions = []
+    for phase in sorted(set(old_durations) | set(new_durations)):
+        old, new = old_durations.get(phase), new_durations.get(phase)
+        change = "%+.0f%%" % ((new - old) / old * 100) if old and new is not None else "-"
+        rows.append("%-30s %10s %10s %8s" % (phase, "%.1f" % old if old is not None else "-",
+                                              "%.1f" % new if new is not None else "-", change))
+        if old and new is not None and new > old * (1 + threshold):
+            regressions.append((phase, old, new))
+    log.info("Phases durations (seconds):\n%-30s %10s %10s %8s\n%s", "phase", "old", "new", "change",
+             "\n".join(rows))
+    return regressions
+
+
+def main():
+    regressions = diff_reports(load_report(args.old_report), load_report(args.new_report), args.threshold)
+    for phase, old, new in regressions:
+        log.error("Phase %s regressed from %.1f to %.1f seconds", phase, old, new)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Diff two run reports')
+    parser.add_argument('old_report', help='Report of the base run', type=str)
+    parser.add_argument('new_report', help='Report of the run to check', type=str)
+    parser.add_argument('-t', '--threshold', help='Allowed slowdown ratio per phase', type=float, default=0.2)
+    args = parser.parse_args()
+    main()
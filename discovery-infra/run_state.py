@@ -0,0 +1,84 @@
+# Json journal of deploy and install progress, so a failed run can be rerun with --resume and skip
+# what was already done. Every cluster has its finished phases, cluster id, image checksum,
+# libvirt domains and registered hosts ids. The journal is rewritten atomically on every change
+
+import os
+import json
+import threading
+import consts
+from logger import log
+
+
+class ClusterState(object):
+
+    def __init__(self, run_state, data):
+        self._run_state = run_state
+        self._data = data
+
+    def get(self, key, default=None):
+        with self._run_state.lock:
+            return self._data.get(key, default)
+
+    def update(self, **values):
+        with self._run_state.lock:
+            self._data.update(values)
+        self._run_state.save()
+
+    # Phase is considered done only when resuming, fresh runs redo everything
+    def is_done(self, phase):
+        with self._run_state.lock:
+            done = self._run_state.resume and phase in self._data["phases"]
+        if done:
+            log.info("Phase %s of %s is already done, skipping it", phase, self._data["cluster_name"])
+        return done
+
+    def mark_done(self, phase, **values):
+        with self._run_state.lock:
+            if phase not in self._data["phases"]:
+                self._data["phases"].append(phase)
+            self._data.update(values)
+        self._run_state.save()
+
+
+class RunState(object):
+
+    def __init__(self, path=consts.RUN_STATE_PATH):
+        self.path = path
+        self.resume = False
+        self.lock = threading.RLock()
+        self._clusters = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            log.info("No run state in %s, starting from scratch", self.path)
+            return
+        with open(self.path) as _file:
+            data = json.load(_file)
+        with self.lock:
+            self._clusters = data["clusters"]
+        log.info("Loaded run state of clusters %s from %s", list(self._clusters), self.path)
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = "%s.tmp" % self.path
+            with open(tmp_path, "w") as _file:
+                json.dump({"clusters": self._clusters}, _file, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self.lock:
+            self._clusters = {}
+        self.save()
+
+    def cluster_names(self):
+        with self.lock:
+            return list(self._clusters)
+
+    def cluster(self, cluster_name):
+        with self.lock:
+            data = self._clusters.setdefault(cluster_name, {"cluster_name": cluster_name, "phases": []})
+        return ClusterState(self, data)
+
+
+state = RunState()
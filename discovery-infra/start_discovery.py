@@ -1,113 +1,210 @@
 #!/usr/bin/python3
 
 import json
-import waiting
 import os
-import pprint
 import argparse
-import ipaddress
+import shlex
 import uuid
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from distutils.dir_util import copy_tree
 from pathlib import Path
 import utils
 import consts
+import polling
 import bm_inventory_api
 import install_cluster
+import run_report
+import run_state
+import network_plan
+import role_assignment
+import artifacts_collector
+import capacity_planner
+import logger
 from logger import log
 import time
 
 
-# Creates ip list, if will be needed in any other place, please move to utils
-def _create_ip_address_list(node_count, starting_ip_addr):
-    return [str(ipaddress.ip_address(starting_ip_addr) + i) for i in range(node_count)]
-
-
 # Filling tfvars json files with terraform needed variables to spawn vms
-def fill_tfvars(image_path, storage_path, master_count, nodes_details):
-    if not os.path.exists(consts.TFVARS_JSON_FILE):
-        Path(consts.TF_FOLDER).mkdir(parents=True, exist_ok=True)
-        copy_tree(consts.TF_TEMPLATE, consts.TF_FOLDER)
+def fill_tfvars(image_path, storage_path, master_count, nodes_details, network, tf_folder=consts.TF_FOLDER):
+    tfvars_json_file = os.path.join(tf_folder, consts.TFVARS_JSON_FILE_NAME)
+    if not os.path.exists(tfvars_json_file):
+        Path(tf_folder).mkdir(parents=True, exist_ok=True)
+        copy_tree(consts.TF_TEMPLATE, tf_folder)
 
-    with open(consts.TFVARS_JSON_FILE) as _file:
+    with open(tfvars_json_file) as _file:
         tfvars = json.load(_file)
-    network_subnet_starting_ip = str(ipaddress.ip_address(ipaddress.IPv4Network(
-        nodes_details["machine_cidr"]).network_address) + 10)
     tfvars["image_path"] = image_path
     tfvars["master_count"] = min(master_count, consts.NUMBER_OF_MASTERS)
-    tfvars["libvirt_master_ips"] = _create_ip_address_list(min(master_count, consts.NUMBER_OF_MASTERS),
-                                                           starting_ip_addr=network_subnet_starting_ip)
-    tfvars["api_vip"] = _get_vips_ips()[0]
-    tfvars["libvirt_worker_ips"] = _create_ip_address_list(nodes_details["worker_count"], starting_ip_addr=str(
-            ipaddress.ip_address(consts.STARTING_IP_ADDRESS) + tfvars["master_count"]))
+    tfvars["libvirt_master_ips"] = list(network.master_ips)
+    tfvars["api_vip"] = network.api_vip
+    tfvars["libvirt_worker_ips"] = list(network.worker_ips)
     tfvars["libvirt_storage_pool_path"] = storage_path
     tfvars.update(nodes_details)
 
-    with open(consts.TFVARS_JSON_FILE, "w") as _file:
+    with open(tfvars_json_file, "w") as _file:
         json.dump(tfvars, _file)
 
 
 # Run make run terraform -> creates vms
-def create_nodes(image_path, storage_path, master_count, nodes_details):
+def create_nodes(image_path, storage_path, master_count, nodes_details, network, tf_folder=consts.TF_FOLDER):
     log.info("Creating tfvars")
-    fill_tfvars(image_path, storage_path, master_count, nodes_details)
+    fill_tfvars(image_path, storage_path, master_count, nodes_details, network, tf_folder=tf_folder)
     log.info("Start running terraform")
-    cmd = "make run_terraform_from_skipper"
+    cmd = "make run_terraform_from_skipper TF_FOLDER=%s" % tf_folder
     return utils.run_command(cmd)
 
 
+# Takes as many nodes as possible from the warm pool, terraform creates the network and only the rest of nodes.
+# Handed out pool domains are kept in tfvars for delete_nodes, the pool is refilled in the background
+def create_nodes_with_warm_pool(image_path, storage_path, master_count, nodes_details, network,
+                                tf_folder=consts.TF_FOLDER):
+    # libvirt domains cloning is needed only by runs with warm pool
+    import warm_pool
+    master_count = min(master_count, consts.NUMBER_OF_MASTERS)
+    masters, workers = warm_pool.reserve(master_count, nodes_details["worker_count"],
+                                         master_memory=nodes_details["libvirt_master_memory"],
+                                         worker_memory=nodes_details["libvirt_worker_memory"],
+                                         master_vcpu=nodes_details["libvirt_master_vcpu"],
+                                         worker_vcpu=nodes_details["libvirt_worker_vcpu"])
+    terraform_details = dict(nodes_details, worker_count=nodes_details["worker_count"] - len(workers))
+    create_nodes(image_path, storage_path, master_count - len(masters), terraform_details, network,
+                 tf_folder=tf_folder)
+    if not masters and not workers:
+        log.info("Warm pool has no matching domains, all nodes were created by terraform")
+        return
+
+    domains = warm_pool.hand_out(masters, workers, network, nodes_details["cluster_name"], image_path)
+    tfvars = utils.get_tfvars(tf_folder)
+    tfvars["warm_pool_domains"] = domains
+    with open(os.path.join(tf_folder, consts.TFVARS_JSON_FILE_NAME), "w") as _file:
+        json.dump(tfvars, _file)
+    warm_pool.refill_in_background()
+
+
 # Starts terraform nodes creation, waits till all nodes will get ip and will move to known status
 def create_nodes_and_wait_till_registered(inventory_client, cluster, image_path, storage_path,
-                                          master_count, nodes_details):
+                                          master_count, nodes_details, network, tf_folder=consts.TF_FOLDER,
+                                          wait_for_registration=True, use_warm_pool=False):
     nodes_count = master_count + nodes_details["worker_count"]
-    create_nodes(image_path, storage_path=storage_path, master_count=master_count, nodes_details=nodes_details)
-
-    # TODO: Check for only new nodes
-    utils.wait_till_nodes_are_ready(nodes_count=nodes_count, network_name=nodes_details["libvirt_network_name"])
+    cluster_name = nodes_details["cluster_name"]
+    create_func = create_nodes_with_warm_pool if use_warm_pool else create_nodes
+    with run_report.report.span("terraform", cluster=cluster_name):
+        create_func(image_path, storage_path=storage_path, master_count=master_count, nodes_details=nodes_details,
+                    network=network, tf_folder=tf_folder)
+
+    # Every node of the network is created here, add_workers waits only for the new macs
+    with run_report.report.span("dhcp", cluster=cluster_name):
+        utils.wait_till_nodes_are_ready(nodes_count=nodes_count, network_name=nodes_details["libvirt_network_name"])
     if not inventory_client:
         log.info("No inventory url, will not wait till nodes registration")
         return
+    if not wait_for_registration:
+        return
 
     log.info("Wait till nodes will be registered")
-    waiting.wait(lambda: utils.are_all_libvirt_nodes_in_cluster_hosts(inventory_client, cluster.id,
-                                                                      nodes_details["libvirt_network_name"]),
-                 timeout_seconds=consts.NODES_REGISTERED_TIMEOUT,
-                 sleep_seconds=10, waiting_for="Nodes to be registered in inventory service")
-    log.info("Registered nodes are:")
-    pprint.pprint(inventory_client.get_cluster_hosts(cluster.id))
-
-
-# Set nodes roles by vm name
-# If master in name -> role will be master, same for worker
-def set_hosts_roles(client, cluster_id, network_name):
-    added_hosts = []
-    libvirt_nodes = utils.get_libvirt_nodes_mac_role_ip_and_name(network_name)
-    inventory_hosts = client.get_cluster_hosts(cluster_id)
+    with run_report.report.span("registration", cluster=cluster_name):
+        polling.wait(lambda: utils.are_all_libvirt_nodes_in_cluster_hosts(inventory_client, cluster.id,
+                                                                          nodes_details["libvirt_network_name"]),
+                     timeout_seconds=consts.NODES_REGISTERED_TIMEOUT,
+                     max_interval=10, waiting_for="Nodes to be registered in inventory service")
+    log.info("Registered nodes are: %s", _hosts_summary(inventory_client.get_cluster_hosts(cluster.id)))
+
+
+def _hosts_summary(hosts):
+    return [(host["id"], host["status"], host.get("role")) for host in hosts]
+
+
+# Runs terraform apply only for given resources, terraform must have been initialized in tf_folder
+def _apply_terraform_targets(tf_folder, targets):
+    cmd = "cd %s && terraform apply -auto-approve -input=false -state=terraform.tfstate " \
+          "-state-out=terraform.tfstate -var-file=%s %s" % (tf_folder, consts.TFVARS_JSON_FILE_NAME,
+                                                             " ".join(shlex.quote("-target=%s" % target)
+                                                                      for target in targets))
+    return utils.run_command(cmd, shell=True)
+
+
+# Plan of network of already running nodes, with workers_count workers in addition to the existing ones
+def _tfvars_network_plan(tfvars, workers_count):
+    return network_plan.create_network_plan(network_name=tfvars["libvirt_network_name"],
+                                            bridge=tfvars["libvirt_network_if"],
+                                            machine_cidr=tfvars["machine_cidr"],
+                                            masters_count=len(tfvars["libvirt_master_ips"]),
+                                            workers_count=len(tfvars["libvirt_worker_ips"]) + workers_count)
+
+
+# Adds workers to already running nodes: appends their ips to tfvars, applies only new workers
+# resources and waits only for new macs to be registered and known
+def add_workers(client, cluster_id, workers_count, tf_folder=consts.TF_FOLDER):
+    tfvars = utils.get_tfvars(tf_folder)
+    tfvars_path = os.path.join(tf_folder, consts.TFVARS_JSON_FILE_NAME)
+    with open(tfvars_path) as _file:
+        original_tfvars = _file.read()
+    network_name = tfvars["libvirt_network_name"]
+    existing_macs = set(utils.get_libvirt_nodes_macs(network_name))
+    first_index = len(tfvars["libvirt_worker_ips"])
+
+    network = _tfvars_network_plan(tfvars, workers_count)
+    tfvars["libvirt_worker_ips"] += list(network.worker_ips[first_index:])
+    tfvars["worker_count"] = len(tfvars["libvirt_worker_ips"])
+    with open(tfvars_path, "w") as _file:
+        json.dump(tfvars, _file)
 
-    for libvirt_mac, libvirt_metadata in libvirt_nodes.items():
-        for host in inventory_hosts:
-            hw = json.loads(host["hardware_info"])
+    # Terraform reads new workers from tfvars, they are restored if apply fails, so they don't claim
+    # workers that weren't created
+    log.info("Adding %s workers to %s", workers_count, tfvars["cluster_name"])
+    try:
+        with run_report.report.span("terraform", cluster=tfvars["cluster_name"]):
+            _apply_terraform_targets(tf_folder, [target % index
+                                                 for index in range(first_index, tfvars["worker_count"])
+                                                 for target in ["libvirt_volume.worker[%s]",
+                                                                "libvirt_domain.worker[%s]"]])
+    except:
+        log.error("Failed to add workers, restoring %s", tfvars_path)
+        with open(tfvars_path, "w") as _file:
+            _file.write(original_tfvars)
+        raise
+
+    with run_report.report.span("dhcp", cluster=tfvars["cluster_name"]):
+        utils.wait_till_nodes_are_ready(nodes_count=len(existing_macs) + workers_count, network_name=network_name)
+    new_macs = [mac for mac in utils.get_libvirt_nodes_macs(network_name) if mac not in existing_macs]
+    log.info("New workers macs %s", new_macs)
+    if not client:
+        return
 
-            if libvirt_mac.lower() in map(lambda nic: nic["mac"].lower(), hw["nics"]):
-                added_hosts.append({"id": host["id"], "role": libvirt_metadata["role"]})
+    with run_report.report.span("registration", cluster=tfvars["cluster_name"]):
+        polling.wait(lambda: all(client.get_hosts_snapshot(cluster_id).has_mac(mac) for mac in new_macs),
+                     timeout_seconds=consts.NODES_REGISTERED_TIMEOUT,
+                     max_interval=10, waiting_for="New workers to be registered in inventory service")
+    with run_report.report.span("roles", cluster=tfvars["cluster_name"]):
+        set_hosts_roles(client, cluster_id, network_name, macs=new_macs, policies=_role_policies())
+        utils.wait_till_hosts_with_macs_are_in_status(client=client, cluster_id=cluster_id, macs=new_macs,
+                                                      statuses=[consts.NodesStatus.KNOWN])
 
-    assert len(libvirt_nodes) == len(added_hosts), "All nodes should have matching inventory hosts"
-    client.set_hosts_roles(cluster_id=cluster_id, hosts_with_roles=added_hosts)
 
+def _role_policies():
+    return role_assignment.load_policies(args.role_policies) if args.role_policies else \
+        role_assignment.DEFAULT_POLICIES
 
-def set_cluster_vips(client, cluster_id):
-    cluster_info = client.cluster_get(cluster_id)
-    api_vip, ingress_vip = _get_vips_ips()
-    cluster_info.api_vip = api_vip
-    cluster_info.ingress_vip = ingress_vip
-    client.update_cluster(cluster_id, cluster_info)
 
+# Set nodes roles by role policies, by default by vm name:
+# If worker in name -> role will be worker, otherwise master
+# Roles are set in batches as hosts register, set_vips_func is called once first host is insufficient
+# If macs are given, sets roles only for nodes with these macs
+def set_hosts_roles(client, cluster_id, network_name, macs=None, set_vips_func=None,
+                    policies=role_assignment.DEFAULT_POLICIES):
+    libvirt_nodes = utils.get_libvirt_nodes_mac_role_ip_and_name(network_name)
+    if macs is not None:
+        libvirt_nodes = {mac: metadata for mac, metadata in libvirt_nodes.items() if mac in macs}
+    role_assignment.RolesPipeline(client, cluster_id, libvirt_nodes, policies=policies,
+                                  set_vips_func=set_vips_func).run()
 
-def _get_vips_ips():
-    network_subnet_starting_ip = str(ipaddress.ip_address(ipaddress.IPv4Network(
-        args.vm_network_cidr).network_address) + 100)
-    ips = _create_ip_address_list(2, starting_ip_addr=str(
-        ipaddress.ip_address(network_subnet_starting_ip)))
-    return ips[0], ips[1]
+
+def set_cluster_vips(client, cluster_id, network):
+    cluster_info = client.cluster_get(cluster_id)
+    cluster_info.api_vip = network.api_vip
+    cluster_info.ingress_vip = network.ingress_vip
+    client.update_cluster(cluster_id, cluster_info)
 
 
 # TODO add config file
@@ -123,75 +220,299 @@ def _cluster_create_params():
 
 
 # convert params from args to terraform tfvars
-def _create_node_details(cluster_name):
+def _create_node_details(cluster_env):
     return {"libvirt_worker_memory": args.worker_memory,
             "libvirt_master_memory": args.master_memory,
+            "libvirt_worker_vcpu": args.worker_vcpu,
+            "libvirt_master_vcpu": args.master_vcpu,
             "worker_count": args.number_of_workers,
-            "cluster_name": cluster_name,
+            "cluster_name": cluster_env["cluster_name"],
             "cluster_domain": args.base_dns_domain,
-            "machine_cidr": args.vm_network_cidr,
-            "libvirt_network_name": args.network_name,
-            "libvirt_network_if": args.network_bridge}
+            "machine_cidr": cluster_env["network"].machine_cidr,
+            "libvirt_network_name": cluster_env["network"].network_name,
+            "libvirt_network_if": cluster_env["network"].bridge}
+
+
+# Everything that must be unique per cluster when few clusters run on the same hypervisor
+def _create_cluster_env(cluster_name, network, tf_folder=consts.TF_FOLDER, image_path=consts.IMAGE_PATH,
+                        kubeconfig_path=consts.DEFAULT_CLUSTER_KUBECONFIG_PATH):
+    return {"cluster_name": cluster_name,
+            "network": network,
+            "tf_folder": tf_folder,
+            "image_path": args.image or image_path,
+            "kubeconfig_path": kubeconfig_path}
+
+
+def _masters_count():
+    return min(args.master_count, consts.NUMBER_OF_MASTERS)
+
+
+# Size and mtime of image, multi GB images are not hashed to check they are unchanged
+def _image_stat(image_path):
+    if not os.path.exists(image_path):
+        return None
+    stat = os.stat(image_path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def _image_unchanged(image_path, image_stat):
+    if not image_stat or _image_stat(image_path) != image_stat:
+        log.info("Image %s is missing or changed since previous run", image_path)
+        return False
+    return True
+
+
+def _cluster_env_to_dict(cluster_env):
+    return dict(cluster_env, network=cluster_env["network"]._asdict())
+
+
+def _cluster_env_from_dict(data):
+    return dict(data, network=network_plan.network_plan_from_dict(data["network"]))
+
+
+# Allocates names, bridges and subnets that are not used by existing libvirt networks or by each other.
+# When resuming, clusters envs of the previous run are reused
+def _allocate_cluster_envs(clusters_count):
+    resumed_envs = [run_state.state.cluster(name).get("env") for name in run_state.state.cluster_names()]
+    resumed_envs = [_cluster_env_from_dict(env) for env in resumed_envs if env]
+    if run_state.state.resume and len(resumed_envs) == clusters_count:
+        return resumed_envs
+
+    used_names, used_bridges, used_cidrs = utils.get_libvirt_networks_usage()
+    allocator = network_plan.NetworkAllocator(args.vm_network_cidr, network_prefix=args.network_name,
+                                              bridge_prefix=args.network_bridge.rstrip("0123456789") or "tt",
+                                              used_names=used_names, used_bridges=used_bridges,
+                                              used_cidrs=used_cidrs)
+    base_name = args.cluster_name or consts.CLUSTER_PREFIX + str(uuid.uuid4())[:8]
+
+    cluster_envs = []
+    for index in range(clusters_count):
+        cluster_name = "%s-%s" % (base_name, index)
+        cluster_envs.append(_create_cluster_env(
+            cluster_name=cluster_name,
+            network=allocator.allocate(_masters_count(), args.number_of_workers),
+            tf_folder=os.path.join(consts.TF_FOLDER, cluster_name),
+            image_path=os.path.join(consts.IMAGE_FOLDER, "%s-installer-image.iso" % cluster_name),
+            kubeconfig_path="%s-%s" % (consts.DEFAULT_CLUSTER_KUBECONFIG_PATH, cluster_name)))
+        run_state.state.cluster(cluster_name).update(env=_cluster_env_to_dict(cluster_envs[-1]))
+    return cluster_envs
+
+
+# Records phase in run report and keeps its duration in timings for clusters summary
+@contextlib.contextmanager
+def _timed(timings, phase, cluster_env):
+    span = None
+    try:
+        with run_report.report.span(phase, cluster=cluster_env["cluster_name"]) as span:
+            yield
+    finally:
+        timings[phase] = span["duration"]
+
+
+def _vips_configured(client, cluster_id):
+    cluster_info = client.cluster_get(cluster_id)
+    return cluster_info.api_vip and cluster_info.ingress_vip
+
+
+def set_vips_and_roles(client, cluster_id, cluster_env):
+    macs = utils.get_libvirt_nodes_macs(cluster_env["network"].network_name)
+    set_vips_func = None
+    if not _vips_configured(client, cluster_id):
+        set_vips_func = lambda: set_cluster_vips(client, cluster_id, cluster_env["network"])
+    else:
+        log.info("VIPs already configured")
+
+    set_hosts_roles(client, cluster_id, cluster_env["network"].network_name, set_vips_func=set_vips_func,
+                    policies=_role_policies())
+    utils.wait_till_hosts_with_macs_are_in_status(client=client, cluster_id=cluster_id, macs=macs,
+                                                  statuses=[consts.NodesStatus.KNOWN])
+
+
+# Every host gets its role as soon as it registers, without waiting for the others
+def set_vips_and_roles_async(client, cluster_id, cluster_env):
+    # asyncio is imported only by runs with async registration
+    import async_orchestrator
+    set_vips_func = None
+    if not _vips_configured(client, cluster_id):
+        set_vips_func = lambda: set_cluster_vips(client, cluster_id, cluster_env["network"])
+    else:
+        log.info("VIPs already configured")
+    async_orchestrator.run(async_orchestrator.register_hosts(client, cluster_id, cluster_env["network"].network_name,
+                                                             set_vips_func, policies=_role_policies()))
+
+
+# Libvirt domains of the cluster network and its hosts registered in inventory, to be kept in run state
+def _created_nodes(client, cluster, cluster_env):
+    nodes = utils.get_libvirt_nodes_mac_role_ip_and_name(cluster_env["network"].network_name)
+    created = {"domains": sorted(node["name"] for node in nodes.values())}
+    if client:
+        created["hosts"] = [host["id"] for host in client.get_cluster_hosts(cluster.id)]
+    return created
 
 
 # Create vms from downloaded iso that will connect to bm-inventory and register
 # If install cluster is set , it will run install cluster command and wait till all nodes will be in installing status
-def nodes_flow(client, cluster_name, cluster):
-    nodes_details = _create_node_details(cluster_name)
+def nodes_flow(client, cluster, cluster_env, timings=None):
+    timings = {} if timings is None else timings
+    cluster_state = run_state.state.cluster(cluster_env["cluster_name"])
+    nodes_details = _create_node_details(cluster_env)
     if cluster:
         nodes_details["cluster_inventory_id"] = cluster.id
-    create_nodes_and_wait_till_registered(inventory_client=client,
-                                          cluster=cluster,
-                                          image_path=args.image or consts.IMAGE_PATH,
-                                          storage_path=args.storage_path,
-                                          master_count=args.master_count,
-                                          nodes_details=nodes_details)
+    # Registration is not waited for here, roles are set in batches as hosts register
+    if not cluster_state.is_done("nodes"):
+        with _timed(timings, "nodes", cluster_env):
+            create_nodes_and_wait_till_registered(inventory_client=client,
+                                                  cluster=cluster,
+                                                  image_path=cluster_env["image_path"],
+                                                  storage_path=args.storage_path,
+                                                  master_count=args.master_count,
+                                                  nodes_details=nodes_details,
+                                                  network=cluster_env["network"],
+                                                  tf_folder=cluster_env["tf_folder"],
+                                                  wait_for_registration=False,
+                                                  use_warm_pool=args.warm_pool)
+        cluster_state.mark_done("nodes", **_created_nodes(client, cluster, cluster_env))
     if client:
-        cluster_info = client.cluster_get(cluster.id)
-        macs = utils.get_libvirt_nodes_macs(nodes_details["libvirt_network_name"])
-
-        if not (cluster_info.api_vip and cluster_info.ingress_vip):
-            utils.wait_till_hosts_with_macs_are_in_status(client=client, cluster_id=cluster.id, macs=macs,
-                                                          statuses=[consts.NodesStatus.INSUFFICIENT])
-            set_cluster_vips(client, cluster.id)
-        else:
-            log.info("VIPs already configured")
-
-        set_hosts_roles(client, cluster.id, nodes_details["libvirt_network_name"])
-        utils.wait_till_hosts_with_macs_are_in_status(client=client, cluster_id=cluster.id, macs=macs,
-                                                      statuses=[consts.NodesStatus.KNOWN])
-        log.info("Printing after setting roles")
-        pprint.pprint(client.get_cluster_hosts(cluster.id))
+        if not cluster_state.is_done("roles"):
+            with _timed(timings, "roles", cluster_env):
+                if args.async_registration:
+                    set_vips_and_roles_async(client, cluster.id, cluster_env)
+                else:
+                    set_vips_and_roles(client, cluster.id, cluster_env)
+            cluster_state.mark_done("roles", hosts=[host["id"] for host in client.get_cluster_hosts(cluster.id)])
+        log.info("Nodes after setting roles: %s", _hosts_summary(client.get_cluster_hosts(cluster.id)))
 
         if args.install_cluster:
             time.sleep(10)
-            install_cluster.run_install_flow(client=client, cluster_id=cluster.id,
-                                             kubeconfig_path=consts.DEFAULT_CLUSTER_KUBECONFIG_PATH,
-                                             pull_secret=args.pull_secret)
+            with _timed(timings, "install", cluster_env):
+                install_cluster.run_install_flow(client=client, cluster_id=cluster.id,
+                                                 kubeconfig_path=cluster_env["kubeconfig_path"],
+                                                 pull_secret=args.pull_secret, cluster_state=cluster_state)
 
 
-def main():
+# Creates cluster, downloads its image and spawns its nodes. Returns time in seconds spent in each phase
+def cluster_flow(cluster_env):
+    timings = {}
     client = None
     cluster = {}
-    cluster_name = args.cluster_name or consts.CLUSTER_PREFIX + str(uuid.uuid4())[:8]
+    cluster_state = run_state.state.cluster(cluster_env["cluster_name"])
     # If image is passed, there is no need to create cluster and download image, need only to spawn vms with is image
     if not args.image:
-        utils.recreate_folder(consts.IMAGE_FOLDER)
         client = bm_inventory_api.create_client(args.inventory_url)
-        if args.cluster_id:
-            cluster = client.cluster_get(cluster_id=args.cluster_id)
-        else:
-            cluster = client.create_cluster(cluster_name,
-                                            ssh_public_key=args.ssh_key,
-                                            **_cluster_create_params()
-                                            )
-
-        client.generate_and_download_image(cluster_id=cluster.id, image_path=consts.IMAGE_PATH, ssh_key=args.ssh_key,
-                                           proxy_url=args.proxy_url)
+        with _timed(timings, "cluster", cluster_env):
+            # Run state has cluster id only when resuming, fresh runs clear it
+            cluster_id = args.cluster_id or cluster_state.get("cluster_id")
+            if cluster_id:
+                cluster = client.cluster_get(cluster_id=cluster_id)
+            else:
+                cluster = client.create_cluster(cluster_env["cluster_name"],
+                                                ssh_public_key=args.ssh_key,
+                                                **_cluster_create_params()
+                                                )
+        cluster_state.mark_done("cluster", cluster_id=cluster.id)
+
+        if not (cluster_state.is_done("iso") and _image_unchanged(cluster_env["image_path"],
+                                                                  cluster_state.get("iso_stat"))):
+            with _timed(timings, "iso", cluster_env):
+                client.generate_and_download_image(cluster_id=cluster.id, image_path=cluster_env["image_path"],
+                                                   ssh_key=args.ssh_key, proxy_url=args.proxy_url,
+                                                   use_cache=not args.skip_iso_cache)
+            cluster_state.mark_done("iso", iso_stat=_image_stat(cluster_env["image_path"]))
+
+    # Artifacts of the cluster will be collected if any wait of this run times out
+    artifacts_collector.add_target(cluster_env["cluster_name"], client=client,
+                                   cluster_id=cluster.id if cluster else None,
+                                   network_name=cluster_env["network"].network_name)
 
     # Iso only, cluster will be up and iso downloaded but vm will not be created
     if not args.iso_only:
-        nodes_flow(client, cluster_name, cluster)
+        nodes_flow(client, cluster, cluster_env, timings)
+    return timings
+
+
+def _log_clusters_summary(results):
+    phases = ["cluster", "iso", "nodes", "roles", "install"]
+    rows = [["cluster", "status"] + phases + ["total"]]
+    for cluster_name, (status, timings) in results.items():
+        rows.append([cluster_name, status] + ["%.1f" % timings[phase] if phase in timings else "-"
+                                              for phase in phases] + ["%.1f" % sum(timings.values())])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    log.info("Clusters summary (seconds):\n%s", "\n".join("  ".join(cell.ljust(width) for cell, width in
+                                                                   zip(row, widths)) for row in rows))
+
+
+# Runs cluster_flow for every cluster in its own thread, each cluster gets its own terraform folder,
+# image path and network
+def run_parallel_clusters(clusters_count):
+    cluster_envs = _allocate_cluster_envs(clusters_count)
+    results = {}
+
+    def _run(cluster_env):
+        timings = {}
+        with logger.log_context(cluster=cluster_env["cluster_name"]):
+            try:
+                timings = cluster_flow(cluster_env)
+                results[cluster_env["cluster_name"]] = ("done", timings)
+            except:
+                log.exception("Cluster %s flow failed", cluster_env["cluster_name"])
+                results[cluster_env["cluster_name"]] = ("failed", timings)
+                raise
+
+    with ThreadPoolExecutor(max_workers=clusters_count) as executor:
+        futures = [executor.submit(_run, cluster_env) for cluster_env in cluster_envs]
+    _log_clusters_summary(results)
+    failed = [future.exception() for future in futures if future.exception()]
+    if failed:
+        raise Exception("%s out of %s clusters failed" % (len(failed), clusters_count))
+
+
+# Fits nodes memory and vcpus to the hypervisor before anything is created, resumed runs already have their nodes
+def plan_capacity():
+    if args.iso_only or args.resume or args.capacity_planning == "off":
+        return
+    requested = capacity_planner.NodesResources(master_memory=args.master_memory, worker_memory=args.worker_memory,
+                                                master_vcpu=args.master_vcpu, worker_vcpu=args.worker_vcpu)
+    resources = capacity_planner.plan_for_host(args.storage_path, requested, clusters_count=args.clusters,
+                                               masters_count=_masters_count(),
+                                               workers_count=args.number_of_workers,
+                                               downscale=args.capacity_planning == "downscale")
+    args.master_memory, args.worker_memory, args.master_vcpu, args.worker_vcpu = resources
+
+
+def main():
+    run_report.report.metadata.update({"entry_point": "start_discovery", "clusters": args.clusters,
+                                       "masters": args.master_count, "workers": args.number_of_workers,
+                                       "install": args.install_cluster})
+    run_state.state.path = args.run_state
+    run_state.state.resume = args.resume
+    try:
+        if args.add_workers:
+            cluster_id = args.cluster_id or utils.get_tfvars()["cluster_inventory_id"]
+            client = bm_inventory_api.create_client(args.inventory_url) if cluster_id else None
+            add_workers(client, cluster_id, args.add_workers)
+            return
+        if args.resume:
+            run_state.state.load()
+        else:
+            run_state.state.clear()
+            if not args.image:
+                utils.recreate_folder(consts.IMAGE_FOLDER)
+        plan_capacity()
+        if args.clusters > 1:
+            run_parallel_clusters(args.clusters)
+            return
+
+        resumed_names = run_state.state.cluster_names()
+        cluster_name = args.cluster_name or (resumed_names[0] if resumed_names else
+                                             consts.CLUSTER_PREFIX + str(uuid.uuid4())[:8])
+        network = network_plan.create_network_plan(network_name=args.network_name, bridge=args.network_bridge,
+                                                   machine_cidr=args.vm_network_cidr,
+                                                   masters_count=_masters_count(),
+                                                   workers_count=args.number_of_workers)
+        with logger.log_context(cluster=cluster_name):
+            cluster_flow(_create_cluster_env(cluster_name=cluster_name, network=network))
+    finally:
+        run_report.report.save(args.run_report)
 
 
 if __name__ == "__main__":
@@ -205,6 +526,15 @@ if __name__ == "__main__":
                         default="")
     parser.add_argument('-mm', '--master-memory', help='Master memory (ram) in mb', type=int, default=8192)
     parser.add_argument('-wm', '--worker-memory', help='Worker memory (ram) in mb', type=int, default=8192)
+    parser.add_argument('-mv', '--master-vcpu', help='Master vcpus', type=int, default=4)
+    parser.add_argument('-wv', '--worker-vcpu', help='Worker vcpus', type=int, default=4)
+    parser.add_argument('-wP', '--warm-pool', help="Take nodes from warm pool of paused vms created by "
+                                                   "warm_pool.py, terraform creates only the rest of them",
+                        action="store_true")
+    parser.add_argument('-cP', '--capacity-planning', help="Check that nodes fit the hypervisor before creating "
+                                                           "them: downscale nodes memory if needed, reject the run "
+                                                           "or skip the check", type=str,
+                        choices=["downscale", "reject", "off"], default="downscale")
     parser.add_argument('-nw', '--number-of-workers', help='Workers count to spawn', type=int, default=0)
     parser.add_argument('-cn', '--cluster-network', help='Cluster network with cidr', type=str, default="10.128.0.0/14")
     parser.add_argument('-hp', '--host-prefix', help='Host prefix to use', type=int, default=23)
@@ -224,8 +554,27 @@ if __name__ == "__main__":
                                                        "from the same subnet as vms", type=str, default="no")
     parser.add_argument('-iU', '--inventory-url', help="Full url of remote inventory", type=str, default="")
     parser.add_argument('-id', '--cluster-id', help='Cluster id to install', type=str, default=None)
+    parser.add_argument('-sC', '--skip-iso-cache', help="Always generate and download new image",
+                        action="store_true")
+    parser.add_argument('-rR', '--run-report', help="Path to save json run report to", type=str,
+                        default=consts.RUN_REPORT_PATH)
+    parser.add_argument('-aR', '--async-registration', help="Track every host separately and set its role "
+                                                            "as soon as it registers", action="store_true")
+    parser.add_argument('-aW', '--add-workers', help="Add given number of workers to already running nodes "
+                                                     "of the last deployed cluster", type=int, default=0)
+    parser.add_argument('-c', '--clusters', help="Number of clusters to deploy in parallel, each with its own "
+                                                 "network, terraform folder and image", type=int, default=1)
+    parser.add_argument('-rP', '--role-policies', help="Path to json list of role policies, every policy has "
+                                                       "role and optional name_pattern, count, min_cpus and "
+                                                       "min_memory_gib", type=str, default="")
+    parser.add_argument('-rS', '--run-state', help="Path of json journal of finished phases", type=str,
+                        default=consts.RUN_STATE_PATH)
+    parser.add_argument('-R', '--resume', help="Skip phases finished by previous run according to run state "
+                                               "and reattach to its cluster and nodes", action="store_true")
 
     args = parser.parse_args()
     if not args.pull_secret and args.install_cluster:
         raise Exception("Can't install cluster without pull secret, please provide one")
+    if args.clusters > 1 and args.cluster_id:
+        raise Exception("Can't deploy few clusters with the same cluster id")
     main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+# Startup time of every entry point. Each one is run with --help in a fresh interpreter, which measures
+# its imports only. Fails if startup is slower than max seconds, if heavy modules were imported or if
+# libvirt connection was opened before any actual work
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from logger import log
+
+ENTRY_POINTS = ["start_discovery.py", "install_cluster.py", "delete_nodes.py", "virsh_cleanup.py",
+                "update_bm_inventory_cm.py", "run_report.py", "warm_pool.py"]
+HEAVY_MODULES = ["bm_inventory_client", "tqdm"]
+
+# Runs entry point as __main__ and prints import stats as last stderr line
+_PROBE = """
+import os, sys, time, json, runpy
+started_at = time.perf_counter()
+sys.argv = [sys.argv[1], "--help"]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+utils = sys.modules.get("utils")
+sys.stderr.write("\\n" + json.dumps({"seconds": time.perf_counter() - started_at,
+                                     "modules": sorted(sys.modules),
+                                     "libvirt_connected": bool(utils and utils._conn)}) + "\\n")
+"""
+
+
+def measure(entry_point, runs):
+    folder = os.path.dirname(os.path.abspath(__file__))
+    durations = []
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, "-c", _PROBE, os.path.join(folder, entry_point)],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+                                 check=True)
+        probe = json.loads(process.stderr.strip().splitlines()[-1])
+        durations.append(probe["seconds"])
+    heavy = [module for module in HEAVY_MODULES if module in probe["modules"]]
+    return {"seconds": statistics.median(durations), "heavy_modules": heavy,
+            "libvirt_connected": probe["libvirt_connected"]}
+
+
+def main():
+    results = {entry_point: measure(entry_point, args.runs) for entry_point in args.entry_points}
+    rows = ["%-28s %8s  %s" % ("entry point", "seconds", "problems")]
+    failed = []
+    for entry_point, result in results.items():
+        problems = ["heavy modules %s" % result["heavy_modules"]] if result["heavy_modules"] else []
+        if result["libvirt_connected"]:
+            problems.append("libvirt connected")
+        if result["seconds"] > args.max_seconds:
+            problems.append("slower than %s seconds" % args.max_seconds)
+        if problems:
+            failed.append(entry_point)
+        rows.append("%-28s %8.3f  %s" % (entry_point, result["seconds"], ", ".join(problems)))
+    log.info("Startup times (median of %s runs):\n%s", args.runs, "\n".join(rows))
+    if args.output:
+        with open(args.output, "w") as _file:
+            json.dump(results, _file, indent=2)
+    if failed:
+        log.error("Startup regressed for %s", failed)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure startup time of entry points')
+    parser.add_argument('-e', '--entry-points', help='Entry points to measure', type=str, nargs="*",
+                        default=ENTRY_POINTS)
+    parser.add_argument('-r', '--runs', help='Runs per entry point, median is reported', type=int, default=5)
+    parser.add_argument('-m', '--max-seconds', help='Fail if startup of any entry point is slower',
+                        type=float, default=1.0)
+    parser.add_argument('-o', '--output', help='Path to save json results to', type=str, default="")
+    args = parser.parse_args()
+    main()
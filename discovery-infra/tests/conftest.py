@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Modules of discovery-infra import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.gettempdir(), "test_infra_tests.log"))
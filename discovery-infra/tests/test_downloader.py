@@ -0,0 +1,120 @@
+import os
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+import urllib3
+import downloader
+
+CONTENT = os.urandom(256 * 1024 + 7)
+ETAG = '"image-1"'
+
+
+# Serves CONTENT, with ranges unless server.ranges is False, and records Range header of every request
+class RangeHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get("Range"))
+        range_header = self.headers.get("Range")
+        if not self.server.ranges or not range_header:
+            self._send(200, CONTENT)
+            return
+        start, end = range_header[len("bytes="):].split("-")
+        start, end = int(start), min(int(end), len(CONTENT) - 1)
+        self._send(206, CONTENT[start:end + 1],
+                   {"Content-Range": "bytes %s-%s/%s" % (start, end, len(CONTENT))})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in dict(headers or {}, **self.server.validators).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.ranges = True
+    httpd.validators = {"ETag": ETAG}
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server):
+    return "http://127.0.0.1:%s/image" % server.server_address[1]
+
+
+def _downloader(segments=4):
+    return downloader.RangedDownloader(urllib3.PoolManager(), segments=segments, chunk_size=16 * 1024)
+
+
+# Half of every segment is on disk and in the journal
+def _write_partial(file_path, url, validator, segments=4):
+    ranged_downloader = _downloader(segments)
+    ranged_downloader._journal_path = file_path + ".journal"
+    journal = ranged_downloader._load_journal(url, len(CONTENT), validator, file_path)
+    with open(file_path, "wb") as _file:
+        _file.write(b"\0" * len(CONTENT))
+        for segment in journal["segments"]:
+            segment["offset"] = (segment["start"] + segment["end"]) // 2
+            _file.seek(segment["start"])
+            _file.write(CONTENT[segment["start"]:segment["offset"]])
+    with open(file_path + ".journal", "w") as _file:
+        json.dump(journal, _file)
+    return journal
+
+
+def test_download_with_ranges(server, tmp_path):
+    file_path = str(tmp_path / "image.iso")
+    assert _downloader().download(_url(server), file_path)
+    with open(file_path, "rb") as _file:
+        assert _file.read() == CONTENT
+    assert not os.path.exists(file_path + ".journal")
+    assert server.requests[0] == "bytes=0-0"
+    assert all(request.startswith("bytes=") for request in server.requests)
+
+
+def test_resume_from_journal(server, tmp_path):
+    file_path = str(tmp_path / "image.iso")
+    journal = _write_partial(file_path, _url(server), ETAG)
+    assert _downloader().download(_url(server), file_path)
+    with open(file_path, "rb") as _file:
+        assert _file.read() == CONTENT
+    assert sorted(server.requests[1:]) == sorted("bytes=%s-%s" % (segment["offset"], segment["end"])
+                                                 for segment in journal["segments"])
+
+
+def test_journal_ignored_without_validator(server, tmp_path):
+    server.validators = {}
+    file_path = str(tmp_path / "image.iso")
+    journal = _write_partial(file_path, _url(server), None)
+    assert _downloader().download(_url(server), file_path)
+    with open(file_path, "rb") as _file:
+        assert _file.read() == CONTENT
+    assert sorted(server.requests[1:]) == sorted("bytes=%s-%s" % (segment["start"], segment["end"])
+                                                 for segment in journal["segments"])
+
+
+def test_journal_ignored_when_validator_changed(server, tmp_path):
+    file_path = str(tmp_path / "image.iso")
+    _write_partial(file_path, _url(server), '"image-0"')
+    assert _downloader().download(_url(server), file_path)
+    with open(file_path, "rb") as _file:
+        assert _file.read() == CONTENT
+
+
+def test_fallback_when_server_ignores_ranges(server, tmp_path):
+    server.ranges = False
+    file_path = str(tmp_path / "image.iso")
+    assert not _downloader().download(_url(server), file_path)
+    assert not os.path.exists(file_path)
+    assert server.requests == ["bytes=0-0"]
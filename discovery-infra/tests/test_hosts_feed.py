@@ -0,0 +1,37 @@
+import hosts_feed
+from hosts_feed import HostChange
+
+
+def _host(host_id, status, progress=None):
+    return {"id": host_id, "status": status, "progress": progress}
+
+
+def test_no_changes():
+    hosts = {"a": _host("a", "known")}
+    assert hosts_feed.diff_hosts(hosts, dict(hosts)) == []
+
+
+def test_added_and_removed():
+    changes = hosts_feed.diff_hosts({"a": _host("a", "known")}, {"b": _host("b", "discovering")})
+    assert changes == [HostChange(hosts_feed.ADDED, "b", None, "discovering"),
+                       HostChange(hosts_feed.REMOVED, "a", "known", None)]
+
+
+def test_status_and_progress_changes():
+    previous = {"a": _host("a", "known"), "b": _host("b", "installing", "Starting installation")}
+    current = {"a": _host("a", "installing", "Starting installation"),
+               "b": _host("b", "installing", "Writing image to disk")}
+    assert hosts_feed.diff_hosts(previous, current) == [
+        HostChange(hosts_feed.STATUS, "a", "known", "installing"),
+        HostChange(hosts_feed.PROGRESS, "a", None, "Starting installation"),
+        HostChange(hosts_feed.PROGRESS, "b", "Starting installation", "Writing image to disk")]
+
+
+def test_feed_version_grows_only_on_changes():
+    fetches = iter([[_host("a", "discovering"), None], [_host("a", "discovering"), None],
+                    [_host("a", "known"), _host("b", "discovering")]])
+    feed = hosts_feed.hosts_feed(lambda: next(fetches))
+    updates = [next(feed) for _ in range(3)]
+    assert [update.version for update in updates] == [1, 1, 2]
+    assert updates[1].changes == []
+    assert [change.kind for change in updates[2].changes] == [hosts_feed.STATUS, hosts_feed.ADDED]
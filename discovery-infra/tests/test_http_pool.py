@@ -0,0 +1,52 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+import http_pool
+
+
+class OkHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = b"ok" * 1024
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    httpd = HTTPServer(("127.0.0.1", 0), OkHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%s/" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _request_in_thread(pool_manager, url):
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (pool_manager.request("GET", url), done.set()), daemon=True)
+    thread.start()
+    return done
+
+
+def test_preloaded_response_releases_gate(url):
+    pool_manager = http_pool.create_pool_manager(max_concurrent_requests=1)
+    assert pool_manager.request("GET", url).data
+    assert _request_in_thread(pool_manager, url).wait(5)
+
+
+def test_streamed_response_holds_gate_till_released(url):
+    pool_manager = http_pool.create_pool_manager(max_concurrent_requests=1)
+    response = pool_manager.request("GET", url, preload_content=False)
+    done = _request_in_thread(pool_manager, url)
+    assert not done.wait(0.5)
+    response.read()
+    response.release_conn()
+    assert done.wait(5)
+    # Released once, the gate is bounded
+    response.close()
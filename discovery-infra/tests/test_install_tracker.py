@@ -0,0 +1,40 @@
+import time
+import datetime
+import install_tracker
+
+
+def _cluster(status, **fields):
+    cluster = {"name": "test", "status": status, "hosts": []}
+    cluster.update(fields)
+    return cluster
+
+
+def _iso(seconds_ago):
+    return datetime.datetime.utcfromtimestamp(time.time() - seconds_ago).isoformat()
+
+
+def _tracker(tmp_path):
+    return install_tracker.InstallTracker(history_path=str(tmp_path / "history.json"))
+
+
+def test_resumed_installation_starts_at_install_started_at(tmp_path):
+    tracker = _tracker(tmp_path)
+    tracker.update(_cluster("finalizing", install_started_at=_iso(600), status_updated_at=_iso(10)))
+    tracker.save_history()
+    assert install_tracker.load_history(tracker.history_path)["totals"][0] >= 600
+
+
+def test_installing_status_updated_at_is_the_start(tmp_path):
+    tracker = _tracker(tmp_path)
+    tracker.update(_cluster("installing", status_updated_at=_iso(300)))
+    assert time.time() - tracker.started_at >= 300
+
+
+def test_unknown_start_skips_totals(tmp_path):
+    tracker = _tracker(tmp_path)
+    tracker.update(_cluster("finalizing", status_updated_at=_iso(10)))
+    tracker.update(_cluster("installed", status_updated_at=_iso(0)))
+    tracker.save_history()
+    history = install_tracker.load_history(tracker.history_path)
+    assert history["totals"] == []
+    assert history["stages"]["finalizing"]
@@ -0,0 +1,71 @@
+import json
+import pytest
+import network_plan
+
+
+def _plan(machine_cidr="192.168.126.0/24", masters_count=3, workers_count=2):
+    return network_plan.create_network_plan("net", "br", machine_cidr, masters_count, workers_count)
+
+
+def test_nodes_and_vips():
+    plan = _plan()
+    assert plan.master_ips == ("192.168.126.10", "192.168.126.11", "192.168.126.12")
+    assert plan.worker_ips == ("192.168.126.13", "192.168.126.14")
+    assert (plan.api_vip, plan.ingress_vip) == ("192.168.126.100", "192.168.126.101")
+
+
+def test_nodes_skip_vips():
+    plan = _plan(masters_count=0, workers_count=95)
+    assert plan.worker_ips[89] == "192.168.126.99"
+    assert plan.worker_ips[90] == "192.168.126.102"
+    assert plan.api_vip not in plan.worker_ips and plan.ingress_vip not in plan.worker_ips
+
+
+def test_network_too_small_for_vips():
+    with pytest.raises(Exception, match="too small for vips"):
+        _plan(machine_cidr="192.168.126.0/26")
+
+
+def test_network_too_small_for_nodes():
+    # .10 to .126 without the vips
+    assert len(_plan(machine_cidr="192.168.126.0/25", masters_count=0, workers_count=115).worker_ips) == 115
+    with pytest.raises(Exception, match="too small for 116 nodes"):
+        _plan(machine_cidr="192.168.126.0/25", masters_count=0, workers_count=116)
+
+
+def test_plan_from_dict():
+    plan = _plan()
+    assert network_plan.network_plan_from_dict(json.loads(json.dumps(plan._asdict()))) == plan
+
+
+def _allocator(**kwargs):
+    return network_plan.NetworkAllocator("192.168.126.0/24", "net", "br", **kwargs)
+
+
+def test_allocations_move_forward():
+    allocator = _allocator()
+    plans = [allocator.allocate(1, 1) for _ in range(3)]
+    assert [plan.machine_cidr for plan in plans] == ["192.168.126.0/24", "192.168.127.0/24", "192.168.128.0/24"]
+    assert [(plan.network_name, plan.bridge) for plan in plans] == [("net-0", "br0"), ("net-1", "br1"),
+                                                                    ("net-2", "br2")]
+
+
+def test_overlapping_used_cidrs_are_skipped():
+    # Slots 0-1, 1 again, 3, 5 and 4-5 are used, a cidr below the base is ignored
+    allocator = _allocator(used_cidrs=["192.168.126.0/23", "192.168.127.128/25", "192.168.129.0/24",
+                                       "192.168.131.0/24", "192.168.130.0/23", "10.0.0.0/8"])
+    assert [allocator.allocate(1, 1).machine_cidr for _ in range(3)] == \
+        ["192.168.128.0/24", "192.168.132.0/24", "192.168.133.0/24"]
+
+
+def test_used_names_and_bridges_are_skipped():
+    allocator = _allocator(used_names=["net-0"], used_bridges=["br1"])
+    plan = allocator.allocate(1, 1)
+    assert (plan.network_name, plan.bridge, plan.machine_cidr) == ("net-2", "br2", "192.168.128.0/24")
+
+
+def test_no_free_networks():
+    allocator = network_plan.NetworkAllocator("255.255.255.0/24", "net", "br")
+    allocator.allocate(0, 1)
+    with pytest.raises(Exception, match="No free networks"):
+        allocator.allocate(0, 1)
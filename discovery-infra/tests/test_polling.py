@@ -0,0 +1,120 @@
+import threading
+import pytest
+from waiting.exceptions import TimeoutExpired
+import polling
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    intervals = []
+    monkeypatch.setattr(polling.time, "sleep", intervals.append)
+    return intervals
+
+
+def _sequence(values):
+    values = iter(values)
+    return lambda: next(values)
+
+
+def test_backoff_while_unchanged(sleeps):
+    result = polling.Poller().wait_for(_sequence(["a"] * 4 + ["done"]), lambda value: value == "done",
+                                       timeout_seconds=60, waiting_for="test", min_interval=1, max_interval=5)
+    assert result == "done"
+    assert sleeps == [1, 2, 4, 5]
+
+
+def test_change_resets_interval(sleeps):
+    polling.Poller().wait_for(_sequence(["a", "a", "a", "b", "b", "done"]), lambda value: value == "done",
+                              timeout_seconds=60, waiting_for="test", min_interval=1, max_interval=30)
+    assert sleeps == [1, 2, 4, 1, 2]
+
+
+def test_fingerprint_ignores_other_fields(sleeps):
+    values = [{"status": "a", "tick": tick} for tick in range(3)] + [{"status": "done"}]
+    polling.Poller().wait_for(_sequence(values), lambda value: value["status"] == "done", timeout_seconds=60,
+                              waiting_for="test", fingerprint=lambda value: value["status"])
+    assert sleeps == [1, 2, 4]
+
+
+def test_expected_exceptions_back_off(sleeps):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ValueError("not yet")
+        return True
+
+    assert polling.Poller().wait(fetch, timeout_seconds=60, waiting_for="test", min_interval=1,
+                                 expected_exceptions=ValueError)
+    assert sleeps == [2, 4]
+
+
+def test_timeout_runs_hooks(sleeps, monkeypatch):
+    timeouts = []
+    monkeypatch.setattr(polling, "_timeout_hooks", [timeouts.append])
+    poller = polling.Poller()
+    with pytest.raises(TimeoutExpired):
+        poller.wait(lambda: False, timeout_seconds=0, waiting_for="never")
+    assert timeouts == ["never"]
+    assert not poller.stats[0].succeeded
+
+
+def _fetch_concurrently(poller, fetch, started):
+    results = []
+
+    def run():
+        try:
+            results.append(poller.fetch(fetch, key="cluster"))
+        except Exception as exc:
+            results.append(exc)
+
+    owner = threading.Thread(target=run)
+    owner.start()
+    assert started.wait(5)
+    waiter = threading.Thread(target=run)
+    waiter.start()
+    # Waiter finds the fetch in flight and waits for it
+    waiter.join(0.2)
+    return results, [owner, waiter]
+
+
+def test_concurrent_fetches_with_same_key_are_shared():
+    poller = polling.Poller()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "hosts"
+
+    results, threads = _fetch_concurrently(poller, fetch, started)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [("hosts", False), ("hosts", True)]
+    assert not poller._in_flight
+
+
+def test_error_of_shared_fetch_is_raised_to_all_waiters():
+    poller = polling.Poller()
+    started, release = threading.Event(), threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        raise ValueError("inventory is down")
+
+    results, threads = _fetch_concurrently(poller, fetch, started)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(results) == 2 and all(isinstance(result, ValueError) for result in results)
+
+
+def test_fetches_without_key_are_not_shared():
+    poller = polling.Poller()
+    assert poller.fetch(lambda: 1, key=None) == (1, True)
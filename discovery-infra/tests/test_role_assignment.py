@@ -0,0 +1,89 @@
+import pytest
+import consts
+import role_assignment
+from role_assignment import create_policy
+
+MASTER, WORKER = consts.NodeRoles.MASTER, consts.NodeRoles.WORKER
+THREE_MASTERS = [create_policy(MASTER, count=3), create_policy(WORKER)]
+BIG = {"cpus": 8, "memory_gib": 32}
+SMALL = {"cpus": 2, "memory_gib": 8}
+
+
+def test_default_policies_by_name():
+    assigner = role_assignment.RoleAssigner()
+    assert assigner.assign("test-infra-cluster-master-0", None) == MASTER
+    assert assigner.assign("test-infra-cluster-worker-0", None) == WORKER
+
+
+def test_count_limits():
+    assigner = role_assignment.RoleAssigner(THREE_MASTERS)
+    assert [assigner.assign("node-%s" % index, None) for index in range(5)] == [MASTER] * 3 + [WORKER] * 2
+
+
+def test_hardware_thresholds():
+    assigner = role_assignment.RoleAssigner([create_policy(MASTER, count=3, min_cpus=4, min_memory_gib=16),
+                                             create_policy(WORKER)])
+    assert assigner.assign("node-0", None) is None
+    assert assigner.assign("node-0", SMALL) == WORKER
+    assert assigner.assign("node-1", BIG) == MASTER
+
+
+def test_no_matching_policy():
+    assigner = role_assignment.RoleAssigner([create_policy(MASTER, count=1)])
+    assigner.assign("node-0", None)
+    with pytest.raises(Exception, match="No role policy matches node node-1"):
+        assigner.assign("node-1", None)
+
+
+def test_existing_roles_count_against_limits():
+    assigner = role_assignment.RoleAssigner(THREE_MASTERS)
+    for _ in range(3):
+        assigner.count_existing(MASTER)
+    assert assigner.assign("node-3", None) == WORKER
+
+
+class Snapshot(object):
+
+    def __init__(self, hosts, macs_by_host_id, hardware_by_host_id=None):
+        self.hosts = hosts
+        self.macs_by_host_id = macs_by_host_id
+        self.hardware_by_host_id = hardware_by_host_id or {}
+
+    def get_host_by_mac(self, mac):
+        return next((host for host in self.hosts if mac in self.macs_by_host_id[host["id"]]), None)
+
+
+class Client(object):
+
+    def __init__(self):
+        self.batches = []
+
+    def set_hosts_roles(self, cluster_id, hosts_with_roles):
+        self.batches.append(hosts_with_roles)
+
+
+def _snapshot(roles, hardware=None):
+    hosts = [{"id": "host-%s" % index, "status": consts.NodesStatus.KNOWN, "role": role}
+             for index, role in enumerate(roles)]
+    return Snapshot(hosts, {host["id"]: ["52:54:00:00:00:%02d" % index] for index, host in enumerate(hosts)},
+                    hardware)
+
+
+def test_pipeline_counts_roles_of_existing_hosts():
+    client = Client()
+    nodes = {"52:54:00:00:00:03": {"name": "node-3"}, "52:54:00:00:00:04": {"name": "node-4"}}
+    pipeline = role_assignment.RolesPipeline(client, "cluster", nodes, THREE_MASTERS)
+    assert pipeline.process(_snapshot([MASTER, MASTER, MASTER, None, None]))
+    assert client.batches == [[{"id": "host-3", "role": WORKER}, {"id": "host-4", "role": WORKER}]]
+
+
+def test_pipeline_defers_hosts_without_hardware():
+    client = Client()
+    policies = [create_policy(MASTER, count=1, min_cpus=4), create_policy(WORKER)]
+    nodes = {"52:54:00:00:00:00": {"name": "node-0"}, "52:54:00:00:00:01": {"name": "node-1"}}
+    pipeline = role_assignment.RolesPipeline(client, "cluster", nodes, policies)
+    assert not pipeline.process(_snapshot([None, None], {"host-0": None, "host-1": BIG}))
+    assert client.batches == [[{"id": "host-1", "role": MASTER}]]
+    # Existing roles are counted once, from the first poll, host-1 role set meanwhile isn't counted again
+    assert pipeline.process(_snapshot([None, MASTER], {"host-0": BIG, "host-1": BIG}))
+    assert client.batches[1] == [{"id": "host-0", "role": WORKER}]
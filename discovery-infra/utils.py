@@ -1,17 +1,35 @@
 import os
 import shutil
-import itertools
+import hashlib
+import threading
 import subprocess
 from pathlib import Path
 import shlex
-import waiting
+import ipaddress
+from xml.etree import ElementTree
 import json
 from retry import retry
 import consts
+import polling
+import run_report
+import hosts_feed
+import leases_watcher
 from logger import log
 import libvirt
 
-conn = libvirt.open('qemu:///system')
+_conn = None
+_conn_lock = threading.Lock()
+
+
+# Connection is opened on first use and shared by all callers, so entry points that don't touch
+# libvirt don't need libvirtd. Closed connections are reopened
+def get_libvirt_connection():
+    global _conn
+    with _conn_lock:
+        if _conn is None or not _conn.isAlive():
+            log.debug("Opening libvirt connection to %s", consts.LIBVIRT_URI)
+            _conn = libvirt.open(consts.LIBVIRT_URI)
+        return _conn
 
 
 def run_command(command, shell=False):
@@ -46,20 +64,19 @@ def get_service_url(service_name):
 
 
 def get_network_leases(network_name):
-    net = conn.networkLookupByName(network_name)
+    net = get_libvirt_connection().networkLookupByName(network_name)
     return net.DHCPLeases()
 
 
 def wait_till_nodes_are_ready(nodes_count, network_name):
     log.info("Wait till %s nodes will be ready and have ips", nodes_count)
-    try:
-        waiting.wait(lambda: len(get_network_leases(network_name)) >= nodes_count,
-                     timeout_seconds=consts.NODES_REGISTERED_TIMEOUT * nodes_count,
-                     sleep_seconds=10, waiting_for="Nodes to have ips")
-        log.info("All nodes have booted and got ips")
-    except:
-        log.error("Not all nodes are ready. Current dhcp leases are %s", get_network_leases(network_name))
-        raise
+    with leases_watcher.LeasesWatcher(network_name) as watcher:
+        try:
+            watcher.wait_for_leases(nodes_count, timeout_seconds=consts.NODES_REGISTERED_TIMEOUT * nodes_count)
+            log.info("All nodes have booted and got ips, time to ip per node: %s", watcher.time_to_ip)
+        except:
+            log.error("Not all nodes are ready. Current dhcp leases are %s", get_network_leases(network_name))
+            raise
 
 
 # Require wait_till_nodes_are_ready has finished and all nodes are up
@@ -82,25 +99,50 @@ def get_libvirt_nodes_macs(network_name):
     return get_libvirt_nodes_mac_role_ip_and_name(network_name).keys()
 
 
+# Returns names, bridges and ip networks of all defined libvirt networks
+def get_libvirt_networks_usage():
+    names, bridges, cidrs = set(), set(), []
+    for net in get_libvirt_connection().listAllNetworks():
+        names.add(net.name())
+        root = ElementTree.fromstring(net.XMLDesc())
+        bridge = root.find("bridge")
+        if bridge is not None and bridge.get("name"):
+            bridges.add(bridge.get("name"))
+        for ip in root.findall("ip"):
+            if ip.get("family", "ipv4") != "ipv4":
+                continue
+            mask = ip.get("netmask") or ip.get("prefix")
+            cidrs.append(ipaddress.ip_network("%s/%s" % (ip.get("address"), mask), strict=False))
+    return names, bridges, cidrs
+
+
 def are_all_libvirt_nodes_in_cluster_hosts(client, cluster_id, network_name):
-    hosts_macs = client.get_hosts_id_with_macs(cluster_id)
-    return all(mac.lower() in
-               map(str.lower, itertools.chain(*hosts_macs.values())) for mac in get_libvirt_nodes_macs(network_name))
+    snapshot = client.get_hosts_snapshot(cluster_id)
+    return all(snapshot.has_mac(mac) for mac in get_libvirt_nodes_macs(network_name))
 
 
 def get_cluster_hosts_with_mac(client, cluster_id, macs):
-    return [client.get_host_by_mac(cluster_id, mac) for mac in macs]
+    return client.get_hosts_snapshot(cluster_id).get_hosts_by_macs(macs)
 
 
-def get_tfvars():
-    if not os.path.exists(consts.TFVARS_JSON_FILE):
-        raise Exception("%s doesn't exists" % consts.TFVARS_JSON_FILE)
-    with open(consts.TFVARS_JSON_FILE) as _file:
+def get_tfvars(tf_folder=consts.TF_FOLDER):
+    tfvars_json_file = os.path.join(tf_folder, consts.TFVARS_JSON_FILE_NAME)
+    if not os.path.exists(tfvars_json_file):
+        raise Exception("%s doesn't exists" % tfvars_json_file)
+    with open(tfvars_json_file) as _file:
         tfvars = json.load(_file)
     return tfvars
 
 
+# Feed of hosts changes, fetches with the same key are shared between concurrent waits
+def _create_hosts_feed(fetch, key):
+    return hosts_feed.hosts_feed(lambda: polling.poller.fetch(fetch, key)[0])
+
+
+# Hosts that are not registered yet (None) are not counted
 def are_hosts_in_status(client, cluster_id, hosts, nodes_count, statuses, fall_on_error_status=True):
+    hosts = [host for host in hosts if host]
+    run_report.report.record_hosts_statuses(hosts)
     hosts_in_status = [host for host in hosts if host["status"] in statuses]
     if len(hosts_in_status) >= nodes_count:
         return True
@@ -109,8 +151,7 @@ def are_hosts_in_status(client, cluster_id, hosts, nodes_count, statuses, fall_o
         log.error("Some of the hosts are in insufficient or error status. Hosts in error %s", hosts_in_error)
         raise Exception("All the nodes must be in valid status, but got some in error")
 
-    log.info("Asked hosts to be in one of the statuses from %s and currently hosts statuses are %s", statuses,
-             [(host["id"], host["status"], host["status_info"]) for host in hosts])
+    log.debug("%s out of %s hosts are in one of the statuses %s", len(hosts_in_status), nodes_count, statuses)
     return False
 
 
@@ -119,11 +160,15 @@ def wait_till_hosts_with_macs_are_in_status(client, cluster_id, macs, statuses,
                                             fall_on_error_status=True, interval=5):
     log.info("Wait till %s nodes are in one of the statuses %s", len(macs), statuses)
 
+    feed = _create_hosts_feed(lambda: client.get_hosts_snapshot(cluster_id).get_hosts_by_macs(macs),
+                              key=("hosts_by_macs", client.inventory_url, cluster_id, tuple(macs)))
     try:
-        waiting.wait(lambda: are_hosts_in_status(client, cluster_id, get_cluster_hosts_with_mac(client, cluster_id, macs),
-                                                 len(macs), statuses, fall_on_error_status),
-                     timeout_seconds=timeout,
-                     sleep_seconds=interval, waiting_for="Nodes to be in of the statuses %s" % statuses)
+        polling.wait_for(lambda: next(feed),
+                         lambda update: are_hosts_in_status(client, cluster_id, update.hosts, len(macs), statuses,
+                                                            fall_on_error_status),
+                         timeout_seconds=timeout,
+                         max_interval=interval, waiting_for="Nodes to be in of the statuses %s" % statuses,
+                         fingerprint=lambda update: update.version)
     except:
         hosts = get_cluster_hosts_with_mac(client, cluster_id, macs)
         log.info("All nodes: %s", hosts)
@@ -133,14 +178,17 @@ def wait_till_hosts_with_macs_are_in_status(client, cluster_id, macs, statuses,
 def wait_till_all_hosts_are_in_status(client, cluster_id, nodes_count, statuses,
                                       timeout=consts.NODES_REGISTERED_TIMEOUT,
                                       fall_on_error_status=True, interval=5):
-    hosts = client.get_cluster_hosts(cluster_id)
     log.info("Wait till %s nodes are in one of the statuses %s", nodes_count, statuses)
 
+    feed = _create_hosts_feed(lambda: client.get_cluster_hosts(cluster_id),
+                              key=("hosts", client.inventory_url, cluster_id))
     try:
-        waiting.wait(lambda: are_hosts_in_status(client, cluster_id, client.get_cluster_hosts(cluster_id),
-                                                 nodes_count, statuses, fall_on_error_status),
-                     timeout_seconds=timeout,
-                     sleep_seconds=interval, waiting_for="Nodes to be in of the statuses %s" % statuses)
+        polling.wait_for(lambda: next(feed),
+                         lambda update: are_hosts_in_status(client, cluster_id, update.hosts, nodes_count, statuses,
+                                                            fall_on_error_status),
+                         timeout_seconds=timeout,
+                         max_interval=interval, waiting_for="Nodes to be in of the statuses %s" % statuses,
+                         fingerprint=lambda update: update.version)
     except:
         hosts = client.get_cluster_hosts(cluster_id)
         log.info("All nodes: %s", hosts)
@@ -150,9 +198,12 @@ def wait_till_all_hosts_are_in_status(client, cluster_id, nodes_count, statuses,
 def wait_till_cluster_is_in_status(client, cluster_id, statuses, timeout=consts.NODES_REGISTERED_TIMEOUT, interval=30):
     log.info("Wait till cluster %s is in status %s", cluster_id, statuses)
     try:
-        waiting.wait(lambda: client.cluster_get(cluster_id).status in statuses,
-                     timeout_seconds=timeout,
-                     sleep_seconds=interval, waiting_for="Cluster to be in status %s" % statuses)
+        polling.wait_for(lambda: client.cluster_get(cluster_id),
+                         lambda cluster: cluster.status in statuses,
+                         timeout_seconds=timeout,
+                         max_interval=interval, waiting_for="Cluster to be in status %s" % statuses,
+                         key=("cluster", client.inventory_url, cluster_id),
+                         fingerprint=lambda cluster: (cluster.status, cluster.status_info))
     except:
         log.info("Cluster: %s", client.cluster_get(cluster_id))
         raise
@@ -170,6 +221,14 @@ def file_exists(file_path):
     return Path(file_path).exists()
 
 
+def file_sha256(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as _file:
+        for chunk in iter(lambda: _file.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
 def recreate_folder(folder):
     if os.path.exists(folder):
         shutil.rmtree(folder)
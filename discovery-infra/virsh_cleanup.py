@@ -1,64 +1,102 @@
 #!/usr/bin/python3
 
 import argparse
-import subprocess
+import re
+from concurrent.futures import ThreadPoolExecutor
+import libvirt
+import utils
 from logger import log
 
 DEFAULT_SKIP_LIST = ["default"]
+MAX_WORKERS = 10
 
 
-def run_command(command, check=False, resource_filter=None):
-    if resource_filter:
-        command += "| grep -E \"%s\"" % "|".join(resource_filter)
-    process = subprocess.run(command, shell=True, check=check, stdout=subprocess.PIPE, universal_newlines=True)
-    output = process.stdout.strip()
-    return output
+def filter_resources(names, skip_list, resource_filter):
+    pattern = re.compile("|".join(resource_filter)) if resource_filter else None
+    return [name for name in names if name and name not in skip_list and (not pattern or pattern.search(name))]
 
 
-def clean_domains(skip_list, resource_filter):
-    domains = run_command("virsh -c qemu:///system list --all --name", resource_filter=resource_filter)
-    domains = domains.splitlines()
-    for domain in domains:
-        log.info("Deleting domain %s", domain)
-        if domain and domain not in skip_list:
-            run_command("virsh -c qemu:///system destroy %s" % domain, check=False)
-            run_command("virsh -c qemu:///system undefine %s" % domain, check=False)
+# Runs delete_func on every resource with bounded thread pool, failures are logged and don't stop other deletions
+def _delete_in_parallel(delete_func, resources):
+    def _delete(resource):
+        try:
+            delete_func(resource)
+        except libvirt.libvirtError as exc:
+            log.warning("Failed to delete %s: %s", resource.name(), exc)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(_delete, resources))
+
+
+def _delete_domain(domain):
+    log.info("Deleting domain %s", domain.name())
+    if domain.isActive():
+        domain.destroy()
+    domain.undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE | libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA)
+
+
+def _delete_volume(volume):
+    log.info("Deleting volume %s", volume.path())
+    volume.delete()
+
+
+def _delete_pool(pool):
+    if pool.isActive():
+        clean_volumes(pool)
+        pool.destroy()
+    log.info("Deleting pool %s", pool.name())
+    pool.undefine()
+
+
+def _delete_network(net):
+    log.info("Deleting network %s", net.name())
+    if net.isActive():
+        net.destroy()
+    net.undefine()
+
+
+def _filter_objects(objects, skip_list, resource_filter):
+    names = filter_resources([obj.name() for obj in objects], skip_list, resource_filter)
+    return [obj for obj in objects if obj.name() in names]
+
+
+def clean_domains(skip_list, resource_filter, dry_run=False):
+    domains = _filter_objects(utils.get_libvirt_connection().listAllDomains(), skip_list, resource_filter)
+    if not dry_run:
+        _delete_in_parallel(_delete_domain, domains)
+    return [domain.name() for domain in domains]
 
 
 def clean_volumes(pool):
-    volumes_with_path = run_command("virsh -c qemu:///system vol-list %s | tail -n +3" % pool).splitlines()
-    for volume_with_path in volumes_with_path:
-        volume, _ = volume_with_path.split()
-        if volume:
-            log.info("Deleting volume %s in pool %s", volume, pool)
-            run_command("virsh -c qemu:///system vol-delete --pool %s %s" % (pool, volume), check=False)
+    _delete_in_parallel(_delete_volume, pool.listAllVolumes())
 
 
-def clean_pools(skip_list, resource_filter):
-    pools = run_command("virsh -c qemu:///system pool-list --all --name", resource_filter=resource_filter)
-    pools = pools.splitlines()
-    for pool in pools:
-        if pool and pool not in skip_list:
-            clean_volumes(pool)
-            log.info("Deleting pool %s", pool)
-            run_command("virsh -c qemu:///system pool-destroy %s" % pool, check=False)
-            run_command("virsh -c qemu:///system pool-undefine %s" % pool, check=False)
+def clean_pools(skip_list, resource_filter, dry_run=False):
+    pools = _filter_objects(utils.get_libvirt_connection().listAllStoragePools(), skip_list, resource_filter)
+    if not dry_run:
+        _delete_in_parallel(_delete_pool, pools)
+    return [pool.name() for pool in pools]
 
 
-def clean_networks(skip_list, resource_filter):
-    networks = run_command("virsh -c qemu:///system net-list --all --name", resource_filter=resource_filter)
-    networks = networks.splitlines()
-    for net in networks:
-        if net and net not in skip_list:
-            log.info("Deleting network %s", net)
-            run_command("virsh -c qemu:///system net-destroy %s" % net, check=False)
-            run_command("virsh -c qemu:///system net-undefine %s" % net, check=False)
+def clean_networks(skip_list, resource_filter, dry_run=False):
+    networks = _filter_objects(utils.get_libvirt_connection().listAllNetworks(), skip_list, resource_filter)
+    if not dry_run:
+        _delete_in_parallel(_delete_network, networks)
+    return [net.name() for net in networks]
 
 
-def clean_virsh_resources(skip_list, resource_filter):
-    clean_domains(skip_list, resource_filter)
-    clean_pools(skip_list, resource_filter)
-    clean_networks(skip_list, resource_filter)
+# Domains are deleted first as they use pools volumes and networks, pools and networks are independent
+def clean_virsh_resources(skip_list, resource_filter, dry_run=False):
+    resources = {"domains": clean_domains(skip_list, resource_filter, dry_run)}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        pools = executor.submit(clean_pools, skip_list, resource_filter, dry_run)
+        networks = executor.submit(clean_networks, skip_list, resource_filter, dry_run)
+    resources["pools"] = pools.result()
+    resources["networks"] = networks.result()
+    if dry_run:
+        for kind, names in resources.items():
+            log.info("Would delete %s: %s", kind, names)
+    return resources
 
 
 def main(p_args):
@@ -71,7 +109,7 @@ def main(p_args):
     else:
         skip_list.extend(["minikube", "minikube-net"])
 
-    clean_virsh_resources(skip_list, resource_filter)
+    clean_virsh_resources(skip_list, resource_filter, p_args.dry_run)
 
 
 if __name__ == "__main__":
@@ -81,5 +119,6 @@ if __name__ == "__main__":
     group.add_argument('-m', '--minikube', help='Clean minikube resources', action="store_true")
     group.add_argument('-sm', '--skip-minikube', help='Clean all but skip minikube resources', action="store_true")
     group.add_argument('-f', '--filter', help='List of filter of resources to delete', nargs="*",type=str, default=None)
+    parser.add_argument('-d', '--dry-run', help='Only list resources that would be deleted', action="store_true")
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+
+# Warm pool of discovery vms that are already defined, have their disks and are started paused on the pool network,
+# before their firmware runs, so clusters don't wait for terraform to create them. The pool is filled once with
+# terraform (create_nodes) with domains that are defined but not started, and refilled by cloning pool domains
+# through libvirt.
+# Cluster id is part of the discovery iso, so a handed out vm gets the cluster iso in its cdrom, is moved to the
+# cluster network with a dhcp host entry of its cluster node name and ip, and is resumed to boot the iso for the
+# first time. The pool saves creating domains and their disks only, handed out vms still boot the iso and
+# register like vms created by terraform.
+# Handed out domains are kept in the cluster tfvars as warm_pool_domains, delete_nodes releases them
+
+import os
+import uuid
+import shutil
+import argparse
+import threading
+from xml.etree import ElementTree
+import libvirt
+import consts
+import utils
+import network_plan
+from logger import log
+
+_lock = threading.Lock()
+# Domains reserved by this process and not handed out yet
+_reserved = set()
+_refill_thread = None
+_refill_requested = False
+
+
+def _domain_root(domain):
+    return ElementTree.fromstring(domain.XMLDesc())
+
+
+def _interface_network(root):
+    source = root.find("devices/interface/source")
+    return source.get("network") if source is not None else None
+
+
+# Pool domains that are still on the pool network, are not reserved and are at least of given size.
+# Domains that are being cloned are defined but not started yet, they aren't free till they are started
+def _free_domains(memory_mib=0, vcpu=0):
+    domains = []
+    for domain in utils.get_libvirt_connection().listAllDomains():
+        if not domain.name().startswith(consts.WARM_POOL_NAME) or domain.name() in _reserved:
+            continue
+        if not domain.isActive():
+            continue
+        if _interface_network(_domain_root(domain)) != consts.WARM_POOL_NETWORK:
+            continue
+        _, max_memory_kib, _, vcpus, _ = domain.info()
+        if max_memory_kib >= memory_mib * 1024 and vcpus >= vcpu:
+            domains.append(domain)
+    return sorted(domains, key=lambda domain: domain.name())
+
+
+def pool_size():
+    return len(_free_domains())
+
+
+# Reserves up to masters_count and workers_count pool domains of the requested size,
+# returns (masters, workers) lists of domains
+def reserve(masters_count, workers_count, master_memory, worker_memory, master_vcpu, worker_vcpu):
+    with _lock:
+        masters = _free_domains(master_memory, master_vcpu)[:masters_count]
+        _reserved.update(domain.name() for domain in masters)
+        workers = _free_domains(worker_memory, worker_vcpu)[:workers_count]
+        _reserved.update(domain.name() for domain in workers)
+    log.info("Reserved %s masters and %s workers from warm pool", len(masters), len(workers))
+    return masters, workers
+
+
+def _add_dhcp_host(network_name, mac, name, ip):
+    net = utils.get_libvirt_connection().networkLookupByName(network_name)
+    net.update(libvirt.VIR_NETWORK_UPDATE_COMMAND_ADD_LAST, libvirt.VIR_NETWORK_SECTION_IP_DHCP_HOST, -1,
+               "<host mac='%s' name='%s' ip='%s'/>" % (mac, name, ip),
+               libvirt.VIR_NETWORK_UPDATE_AFFECT_LIVE | libvirt.VIR_NETWORK_UPDATE_AFFECT_CONFIG)
+
+
+def _update_device(domain, device):
+    domain.updateDeviceFlags(ElementTree.tostring(device).decode(),
+                             libvirt.VIR_DOMAIN_AFFECT_LIVE | libvirt.VIR_DOMAIN_AFFECT_CONFIG)
+
+
+# Moves domain to the cluster network under node name and ip, swaps its cdrom to image_path and boots it
+def _hand_out_domain(domain, network_name, node_name, ip, image_path):
+    root = _domain_root(domain)
+    interface = root.find("devices/interface")
+    mac = interface.find("mac").get("address")
+    log.info("Handing out %s as %s with ip %s", domain.name(), node_name, ip)
+
+    _add_dhcp_host(network_name, mac, node_name, ip)
+    interface.find("source").attrib = {"network": network_name}
+    _update_device(domain, interface)
+
+    cdrom = root.find("devices/disk[@device='cdrom']")
+    cdrom.find("source").attrib = {"file": os.path.abspath(image_path)}
+    _update_device(domain, cdrom)
+
+    # Pool domains were never resumed, so they boot the cluster iso from the start
+    if domain.info()[0] == libvirt.VIR_DOMAIN_PAUSED:
+        domain.resume()
+
+
+# Hands out reserved masters and workers as the last nodes of network plan, nodes created by terraform
+# are the first ones. Returns names of handed out domains
+def hand_out(masters, workers, network, cluster_name, image_path):
+    nodes = []
+    first_master = len(network.master_ips) - len(masters)
+    for index, domain in enumerate(masters, first_master):
+        nodes.append((domain, "%s-master-%s" % (cluster_name, index), network.master_ips[index]))
+    first_worker = len(network.worker_ips) - len(workers)
+    for index, domain in enumerate(workers, first_worker):
+        nodes.append((domain, "%s-worker-%s" % (cluster_name, index), network.worker_ips[index]))
+
+    try:
+        for domain, node_name, ip in nodes:
+            _hand_out_domain(domain, network.network_name, node_name, ip, image_path)
+    finally:
+        with _lock:
+            _reserved.difference_update(domain.name() for domain, _, _ in nodes)
+    return [domain.name() for domain, _, _ in nodes]
+
+
+def _disk_paths(root):
+    return [source.get("file") for source in root.findall("devices/disk[@device='disk']/source")
+            if source.get("file")]
+
+
+# New qcow2 volume of the same size and backing store as template volume
+def _clone_volume(template_path, name):
+    conn = utils.get_libvirt_connection()
+    template = conn.storageVolLookupByPath(template_path)
+    volume = ElementTree.Element("volume")
+    ElementTree.SubElement(volume, "name").text = name
+    ElementTree.SubElement(volume, "capacity").text = str(template.info()[1])
+    ElementTree.SubElement(ElementTree.SubElement(volume, "target"), "format").set("type", "qcow2")
+    backing_store = ElementTree.fromstring(template.XMLDesc()).find("backingStore")
+    if backing_store is not None:
+        volume.append(backing_store)
+    pool = template.storagePoolLookupByVolume()
+    return pool.createXML(ElementTree.tostring(volume).decode(), 0).path()
+
+
+# Defines a copy of template domain config with a new disk, on the pool network and with the pool image,
+# and starts it paused
+def _clone_domain(template, image_path):
+    root = ElementTree.fromstring(template.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE))
+    name = "%s-worker-%s" % (consts.WARM_POOL_NAME, str(uuid.uuid4())[:8])
+    root.find("name").text = name
+    # libvirt generates new uuid and mac
+    root.remove(root.find("uuid"))
+    interface = root.find("devices/interface")
+    interface.remove(interface.find("mac"))
+    interface.find("source").attrib = {"network": consts.WARM_POOL_NETWORK}
+    root.find("devices/disk[@device='cdrom']/source").attrib = {"file": os.path.abspath(image_path)}
+    disk_source = root.find("devices/disk[@device='disk']/source")
+    disk_source.set("file", _clone_volume(disk_source.get("file"), name))
+
+    domain = utils.get_libvirt_connection().defineXML(ElementTree.tostring(root).decode())
+    domain.createWithFlags(libvirt.VIR_DOMAIN_START_PAUSED)
+    log.info("Cloned %s to warm pool", name)
+    return domain
+
+
+# Missing count is computed under the lock, domains are cloned without it, so reserve isn't blocked by cloning
+def refill(size, image_path):
+    with _lock:
+        missing = size - len(_free_domains())
+    if missing <= 0:
+        return
+    # Handed out domains can be templates too, their config is reset to the pool one by cloning
+    templates = [domain for domain in utils.get_libvirt_connection().listAllDomains()
+                 if domain.name().startswith(consts.WARM_POOL_NAME)]
+    if not templates:
+        log.warning("Warm pool has no domains to clone from, fill it again with warm_pool.py")
+        return
+    log.info("Refilling warm pool with %s domains", missing)
+    for _ in range(missing):
+        _clone_domain(templates[0], image_path)
+
+
+# Refills again while refills were requested during the previous one, domains handed out meanwhile are replaced too
+def _refill_while_requested(size, image_path):
+    global _refill_thread, _refill_requested
+    while True:
+        with _lock:
+            if not _refill_requested:
+                _refill_thread = None
+                return
+            _refill_requested = False
+        try:
+            refill(size, image_path)
+        except Exception:
+            log.exception("Failed to refill warm pool")
+
+
+# Refill runs in a non daemon thread, so it finishes before the process exits. A refill requested while
+# the thread runs is done by the same thread
+def refill_in_background(tf_folder=consts.WARM_POOL_TF_FOLDER):
+    global _refill_thread, _refill_requested
+    tfvars = utils.get_tfvars(tf_folder)
+    with _lock:
+        _refill_requested = True
+        if _refill_thread:
+            return
+        _refill_thread = threading.Thread(target=_refill_while_requested,
+                                          args=(tfvars["worker_count"], tfvars["image_path"]),
+                                          name="warm-pool-refill")
+        _refill_thread.start()
+
+
+# Deletes handed out domains and their disks
+def release(domain_names):
+    conn = utils.get_libvirt_connection()
+    for name in domain_names:
+        try:
+            domain = conn.lookupByName(name)
+            paths = _disk_paths(_domain_root(domain))
+            log.info("Releasing warm pool domain %s", name)
+            if domain.isActive():
+                domain.destroy()
+            domain.undefine()
+            for path in paths:
+                conn.storageVolLookupByPath(path).delete()
+        except libvirt.libvirtError as exc:
+            log.warning("Failed to release warm pool domain %s: %s", name, exc)
+
+
+def fill(size, image_path, storage_path, memory, vcpu, tf_folder=consts.WARM_POOL_TF_FOLDER):
+    # start_discovery imports this module lazily, it is imported here only when the pool is filled
+    import start_discovery
+    network = network_plan.create_network_plan(network_name=consts.WARM_POOL_NETWORK,
+                                               bridge=consts.WARM_POOL_BRIDGE, machine_cidr=consts.WARM_POOL_CIDR,
+                                               masters_count=0, workers_count=size)
+    nodes_details = {"libvirt_worker_memory": memory,
+                     "libvirt_master_memory": memory,
+                     "libvirt_worker_vcpu": vcpu,
+                     "libvirt_master_vcpu": vcpu,
+                     "worker_count": size,
+                     "cluster_name": consts.WARM_POOL_NAME,
+                     "cluster_domain": consts.WARM_POOL_NAME,
+                     "machine_cidr": network.machine_cidr,
+                     "libvirt_network_name": network.network_name,
+                     "libvirt_network_if": network.bridge,
+                     "libvirt_domain_running": False}
+    # Domains are only defined by terraform, they are started paused so they never boot the iso they were
+    # defined with and don't register to its cluster
+    start_discovery.create_nodes(image_path, storage_path, 0, nodes_details, network, tf_folder=tf_folder)
+    for domain in utils.get_libvirt_connection().listAllDomains():
+        if domain.name().startswith(consts.WARM_POOL_NAME) and not domain.isActive():
+            domain.createWithFlags(libvirt.VIR_DOMAIN_START_PAUSED)
+    log.info("Warm pool has %s paused domains", pool_size())
+
+
+def delete(tf_folder=consts.WARM_POOL_TF_FOLDER):
+    import virsh_cleanup
+    virsh_cleanup.clean_virsh_resources(virsh_cleanup.DEFAULT_SKIP_LIST, ["^%s(-|$)" % consts.WARM_POOL_NAME])
+    if os.path.exists(tf_folder):
+        shutil.rmtree(tf_folder)
+
+
+def main():
+    if args.delete:
+        delete()
+    elif args.refill:
+        tfvars = utils.get_tfvars(consts.WARM_POOL_TF_FOLDER)
+        refill(args.size, tfvars["image_path"])
+    else:
+        fill(args.size, args.image or consts.IMAGE_PATH, args.storage_path, args.memory, args.vcpu)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fill, refill or delete warm pool of paused discovery vms')
+    parser.add_argument('-s', '--size', help='Domains to keep in the pool', type=int, default=3)
+    parser.add_argument('-i', '--image', help='Iso the pool domains are created with', type=str,
+                        default=consts.IMAGE_PATH)
+    parser.add_argument('-p', '--storage-path', help="Path to storage pool", type=str,
+                        default=consts.STORAGE_PATH)
+    parser.add_argument('-mm', '--memory', help='Domains memory (ram) in mb', type=int, default=16384)
+    parser.add_argument('-v', '--vcpu', help='Domains vcpus', type=int, default=4)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-r', '--refill', help='Clone pool domains up to pool size', action="store_true")
+    group.add_argument('-d', '--delete', help='Delete the pool and its domains, including handed out ones',
+                       action="store_true")
+    args = parser.parse_args()
+    main()
@@ -46,6 +46,7 @@ resource "libvirt_domain" "master" {
   count = var.master_count
 
   name = "${var.cluster_name}-master-${count.index}"
+  running = var.libvirt_domain_running
 
   memory = var.libvirt_master_memory
   vcpu   = var.libvirt_master_vcpu
@@ -84,6 +85,7 @@ resource "libvirt_domain" "worker" {
   count = var.worker_count
 
   name = "${var.cluster_name}-worker-${count.index}"
+  running = var.libvirt_domain_running
 
   memory = var.libvirt_worker_memory
   vcpu   = var.libvirt_worker_vcpu
@@ -102,3 +102,8 @@ variable "libvirt_storage_pool_path" {
   description = "storage pool path"
 }
 
+variable "libvirt_domain_running" {
+  type        = bool
+  description = "Start domains once they are created, warm pool domains are only defined"
+  default     = true
+}